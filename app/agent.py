@@ -1,7 +1,8 @@
 import os
 import json
-from google.adk.agents import Agent
-from app.tools import (
+from functools import lru_cache
+# Async tools let ADK run parallel function calls concurrently
+from app.async_tools import (
     get_yahoo_finance_data,
     get_multi_tickers_data,
     search_finance_news,
@@ -9,9 +10,26 @@ from app.tools import (
     screen_market_by_valuation,
     schedule_investment_reminder,
     cancel_investment_reminders,
-    list_investment_schedules
+    list_investment_schedules,
+    remember_user_fact
 )
 from app.config import AGENT_CONFIG
+from app import metrics, tracing, ratelimit, compaction
+
+# Any model name ADK can resolve, including ones registered by bench/fake_llm.py
+AGENT_MODEL = os.getenv("AGENT_MODEL", "gemini-3-flash-preview")
+
+TOOLS = [
+    get_yahoo_finance_data,
+    get_multi_tickers_data,
+    search_finance_news,
+    get_sector_analysis,
+    screen_market_by_valuation,
+    schedule_investment_reminder,
+    cancel_investment_reminders,
+    list_investment_schedules,
+    remember_user_fact
+]
 
 # --- Agent Core ---
 
@@ -20,28 +38,45 @@ def load_config():
 
 def create_agent():
     """Creates and configures the investment agent."""
+    from google.adk.agents import Agent
     config = load_config()
     
     agent = Agent(
         name=config["name"],
         description=config["description"],
-        model="gemini-3-flash-preview",
+        model=AGENT_MODEL,
         instruction=config["instructions"],
-        tools=[
-            get_yahoo_finance_data,
-            get_multi_tickers_data,
-            search_finance_news,
-            get_sector_analysis,
-            screen_market_by_valuation,
-            schedule_investment_reminder,
-            cancel_investment_reminders,
-            list_investment_schedules
-        ]
+        tools=[tracing.traced("tool", tool=tool.__name__)(tool) for tool in TOOLS],
+        # Waiting for a Gemini token happens before the model span starts
+        before_model_callback=[ratelimit.before_model, compaction.before_model, tracing.before_model],
+        after_model_callback=tracing.after_model,
+        on_model_error_callback=tracing.on_model_error,
+        before_tool_callback=metrics.before_tool,
+        after_tool_callback=metrics.after_tool,
+        on_tool_error_callback=metrics.on_tool_error
     )
     return agent
 
-# Create root_agent at module level for ADK web UI
-root_agent = create_agent()
+@lru_cache(maxsize=1)
+def get_agent():
+    """The process's agent, built on first use and shared by every caller."""
+    return create_agent()
+
+@lru_cache(maxsize=1)
+def get_runner():
+    """
+    The process's Runner over the Redis session service, built on first use.
+    Sessions live in Redis, so API replicas and Celery workers share conversations.
+    """
+    from google.adk.runners import Runner
+    from app.sessions import RedisSessionService, APP_NAME
+    return Runner(app_name=APP_NAME, agent=get_agent(), session_service=RedisSessionService())
+
+def __getattr__(name):
+    # The ADK web UI looks up `root_agent`; build it then instead of on every import
+    if name == "root_agent":
+        return get_agent()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == "__main__":
     from google.adk.runners import Runner
@@ -0,0 +1,247 @@
+import os
+import sys
+import time
+import threading
+from app.config import ALLOWED_NUMBERS, logger
+from app.store import redis_client
+
+# Authorized numbers live in a Redis set shared by every replica. Each process answers
+# membership from a local snapshot, reloaded when the version key moves (announced on
+# the channel, and polled in case an announcement is missed).
+ALLOWLIST_ENABLED = os.getenv("ALLOWLIST_ENABLED", "true").lower() == "true"
+ALLOWLIST_KEY = os.getenv("ALLOWLIST_KEY", "allowlist:numbers")
+ALLOWLIST_VERSION_KEY = f"{ALLOWLIST_KEY}:version"
+ALLOWLIST_CHANNEL = f"{ALLOWLIST_KEY}:changed"
+ALLOWLIST_POLL_SECONDS = float(os.getenv("ALLOWLIST_POLL_SECONDS", "30"))
+# Numbers per SADD/SREM/SSCAN round trip
+BATCH_SIZE = 10000
+
+# Numbers are kept as ints locally: ~3x smaller than str for large lists
+_snapshot: frozenset[int] = frozenset()
+_version: int | None = None
+_loaded_at: float | None = None
+_watcher: threading.Thread | None = None
+_reload_lock = threading.Lock()
+
+
+def normalize(number) -> int | None:
+    """Digits of a phone number (country code, no '+') as an int, or None if it isn't one."""
+    digits = "".join(ch for ch in str(number) if ch.isdigit())
+    if not 6 <= len(digits) <= 15:
+        return None
+    return int(digits)
+
+
+def _normalize_all(numbers) -> list[int]:
+    normalized = (normalize(number) for number in numbers)
+    return [number for number in normalized if number is not None]
+
+
+def is_allowed(number: str) -> bool:
+    """O(1) check against the local snapshot; an empty allowlist lets everyone in."""
+    if not ALLOWLIST_ENABLED or not _snapshot:
+        return True
+    return normalize(number) in _snapshot
+
+
+# --- Snapshot ---
+
+def _remote_version() -> int:
+    return int(redis_client.get(ALLOWLIST_VERSION_KEY) or 0)
+
+
+def iter_numbers():
+    """Yields every number in the Redis set, in batches that don't block Redis."""
+    for member in redis_client.sscan_iter(ALLOWLIST_KEY, count=BATCH_SIZE):
+        yield member.decode()
+
+
+def reload():
+    """Replaces the local snapshot with the current Redis set."""
+    global _snapshot, _version, _loaded_at
+    with _reload_lock:
+        version = _remote_version()
+        numbers = frozenset(_normalize_all(iter_numbers()))
+        _snapshot, _version, _loaded_at = numbers, version, time.time()
+    logger.info(f"Allowlist loaded: {len(numbers)} numbers (version {version})")
+
+
+def reload_if_changed() -> bool:
+    if _remote_version() == _version:
+        return False
+    reload()
+    return True
+
+
+def _watch():
+    while True:
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(ALLOWLIST_CHANNEL)
+            # Catch up on anything announced while we weren't subscribed, re-seeding
+            # first if Redis came back empty
+            seed()
+            reload_if_changed()
+            while True:
+                if pubsub.get_message(timeout=ALLOWLIST_POLL_SECONDS):
+                    reload_if_changed()
+                elif _remote_version() != _version:
+                    logger.warning("Allowlist change missed on pub/sub; reloading")
+                    reload()
+        except Exception as e:
+            logger.error(f"Allowlist watcher error: {e}")
+            time.sleep(5)
+
+
+def seed(numbers=ALLOWED_NUMBERS) -> int:
+    """Copies numbers (by default agent_config.json's allowed_numbers) into Redis, once per Redis."""
+    if not redis_client.set(ALLOWLIST_VERSION_KEY, 0, nx=True):
+        return 0
+    added = add(numbers)
+    if added:
+        logger.info(f"Seeded the allowlist with {added} numbers from agent_config.json")
+    return added
+
+
+def start():
+    """Seeds and loads the allowlist and starts watching for changes (once per process)."""
+    global _snapshot, _watcher
+    if not ALLOWLIST_ENABLED or _watcher is not None:
+        return
+    try:
+        seed()
+        reload()
+    except Exception as e:
+        # Without Redis, fall back to the config file so the allowlist still holds
+        _snapshot = frozenset(_normalize_all(ALLOWED_NUMBERS))
+        logger.error(f"Allowlist unavailable, using agent_config.json ({len(_snapshot)} numbers): {e}")
+    _watcher = threading.Thread(target=_watch, name="allowlist-watcher", daemon=True)
+    _watcher.start()
+
+
+def stats() -> dict:
+    return {
+        "enabled": ALLOWLIST_ENABLED,
+        "numbers": len(_snapshot),
+        "version": _version,
+        "loaded_at": _loaded_at,
+    }
+
+
+# --- Changes ---
+
+def _publish():
+    """Bumps the version and tells every process to reload."""
+    version = redis_client.incr(ALLOWLIST_VERSION_KEY)
+    redis_client.publish(ALLOWLIST_CHANNEL, version)
+
+
+def _apply(command: str, key: str, numbers: list[int]) -> int:
+    changed = 0
+    for i in range(0, len(numbers), BATCH_SIZE):
+        changed += getattr(redis_client, command)(key, *numbers[i:i + BATCH_SIZE])
+    return changed
+
+
+def add(numbers) -> int:
+    """Authorizes numbers. Returns how many were new."""
+    added = _apply("sadd", ALLOWLIST_KEY, _normalize_all(numbers))
+    if added:
+        _publish()
+    return added
+
+
+class WouldOpenAllowlist(ValueError):
+    """Raised instead of emptying the allowlist, since an empty allowlist lets everyone in."""
+
+
+def _present(numbers: list[int]) -> int:
+    present = 0
+    for i in range(0, len(numbers), BATCH_SIZE):
+        present += sum(redis_client.smismember(ALLOWLIST_KEY, numbers[i:i + BATCH_SIZE]))
+    return present
+
+
+def remove(numbers, allow_empty: bool = False) -> int:
+    """
+    Revokes numbers. Returns how many were removed. Refuses to remove every number
+    (which would open the bot to anyone) unless `allow_empty`.
+    """
+    numbers = list(dict.fromkeys(_normalize_all(numbers)))
+    if not allow_empty and numbers and _present(numbers) >= redis_client.scard(ALLOWLIST_KEY):
+        raise WouldOpenAllowlist("Removing these numbers would empty the allowlist and let everyone in")
+    removed = _apply("srem", ALLOWLIST_KEY, numbers)
+    if removed:
+        _publish()
+    return removed
+
+
+def replace(numbers, allow_empty: bool = False) -> int:
+    """
+    Makes `numbers` the whole allowlist, swapped in atomically. Returns its size.
+    An empty list (which would let everyone in) is refused unless `allow_empty`.
+    """
+    numbers = _normalize_all(numbers)
+    if not numbers and not allow_empty:
+        raise WouldOpenAllowlist("No valid numbers given; an empty allowlist would let everyone in")
+    staging = f"{ALLOWLIST_KEY}:import"
+    redis_client.delete(staging)
+    _apply("sadd", staging, numbers)
+    if numbers:
+        redis_client.rename(staging, ALLOWLIST_KEY)
+    else:
+        redis_client.delete(ALLOWLIST_KEY)
+    _publish()
+    return redis_client.scard(ALLOWLIST_KEY)
+
+
+def _read_lines(path: str):
+    f = sys.stdin if path == "-" else open(path)
+    try:
+        for line in f:
+            # One number per line; anything after a comma (CSV exports) or '#' is ignored
+            line = line.split("#", 1)[0].split(",", 1)[0].strip()
+            if line:
+                yield line
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Manage the WhatsApp allowlist in Redis")
+    commands = parser.add_subparsers(dest="command", required=True)
+    cmd_import = commands.add_parser("import", help="add numbers from a file (one per line, '-' for stdin)")
+    cmd_import.add_argument("file")
+    cmd_import.add_argument("--replace", action="store_true", help="make the file the whole allowlist")
+    cmd_import.add_argument("--allow-empty", action="store_true", help="allow an empty list (lets everyone in)")
+    cmd_export = commands.add_parser("export", help="write every number, one per line")
+    cmd_export.add_argument("file", nargs="?", default="-")
+    commands.add_parser("add", help="authorize numbers").add_argument("numbers", nargs="+")
+    cmd_remove = commands.add_parser("remove", help="revoke numbers")
+    cmd_remove.add_argument("numbers", nargs="+")
+    cmd_remove.add_argument("--allow-empty", action="store_true", help="allow removing the last numbers (lets everyone in)")
+    commands.add_parser("count", help="print how many numbers are allowed")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "import":
+            if args.replace:
+                print(f"Allowlist replaced: {replace(_read_lines(args.file), args.allow_empty)} numbers")
+            else:
+                print(f"Added {add(_read_lines(args.file))} new numbers")
+        elif args.command == "export":
+            out = sys.stdout if args.file == "-" else open(args.file, "w")
+            for number in iter_numbers():
+                out.write(number + "\n")
+            if out is not sys.stdout:
+                out.close()
+        elif args.command == "add":
+            print(f"Added {add(args.numbers)} new numbers")
+        elif args.command == "remove":
+            print(f"Removed {remove(args.numbers, args.allow_empty)} numbers")
+        elif args.command == "count":
+            print(redis_client.scard(ALLOWLIST_KEY))
+    except WouldOpenAllowlist as e:
+        sys.exit(f"{e}. Pass --allow-empty to do it anyway.")
@@ -0,0 +1,129 @@
+# Asyncio versions of the agent tools in app/tools.py. ADK awaits coroutine tools
+# concurrently when the model calls several in one turn, so they overlap instead of
+# running back to back. Names, arguments and docstrings match the sync tools.
+# Redis goes through redis.asyncio and Yahoo quote/search endpoints through an async HTTP
+# session; yfinance-only lookups (profiles, sectors, screens) run in worker threads.
+import asyncio
+from app import tools
+from app.cache import redis_cache
+from app.config import logger
+from app.quotes import normalize_symbols, get_quotes_async, get_profile_async
+from app.news import get_news_async
+
+
+async def get_yahoo_finance_data(symbol: str) -> str:
+    """
+    Fetches real-time stock data, company information, and key statistics for a single ticker.
+    Args:
+        symbol: The stock ticker symbol (e.g., 'AAPL', 'NVDA').
+    """
+    try:
+        symbols = normalize_symbols(symbol)
+        if not symbols:
+            return f"Error fetching data for {symbol}: invalid ticker symbol."
+        symbol = symbols[0]
+
+        profile, quotes = await asyncio.gather(get_profile_async(symbol), get_quotes_async([symbol]))
+        quote = quotes.get(symbol)
+        if quote is None:
+            return f"Error fetching data for {symbol}: no market data found."
+        return tools.format_quote_report(symbol, quote, profile)
+    except Exception as e:
+        logger.error(f"Error fetching data for {symbol}: {e}")
+        return f"Error fetching data for {symbol}: {str(e)}"
+
+
+async def get_multi_tickers_data(symbols_string: str) -> str:
+    """
+    Fetches current prices for multiple stock symbols at once.
+    Args:
+        symbols_string: Space-separated tickers (e.g., 'AAPL MSFT GOOG').
+    """
+    try:
+        symbols = normalize_symbols(symbols_string)
+        if not symbols:
+            return f"Error fetching multi-ticker data: no valid symbols in '{symbols_string}'."
+        return tools.format_multi_quotes(symbols, await get_quotes_async(symbols))
+    except Exception as e:
+        logger.error(f"Error fetching multi-ticker data: {e}")
+        return f"Error fetching multi-ticker data: {str(e)}"
+
+
+async def search_finance_news(query: str) -> str:
+    """
+    Searches for the latest market news and quotes based on a query.
+    Args:
+        query: Search term (e.g., 'AI stocks', 'Nvidia news').
+    """
+    try:
+        logger.info(f"Searching news for {query}")
+        return tools.format_news(query, await get_news_async(query))
+    except Exception as e:
+        logger.error(f"Error searching news for {query}: {e}")
+        return f"Error searching news for {query}: {str(e)}"
+
+
+# Same function names as the sync tools, so both share cache entries and the warmer's refreshes
+@redis_cache(ttl_seconds=900, market="US")
+async def get_sector_analysis(sector_name: str) -> str:
+    """
+    Gets information and top companies for a market sector.
+    Args:
+        sector_name: e.g., 'technology', 'healthcare', 'financial-services', 'energy'.
+    """
+    return await asyncio.to_thread(tools.get_sector_analysis.__wrapped__, sector_name)
+
+
+@redis_cache(ttl_seconds=120, market="US")
+async def screen_market_by_valuation(criteria: str = "undervalued_growth") -> str:
+    """
+    Uses the yfinance Screener to find stocks matching a specific strategy.
+    Args:
+        criteria: One of 'undervalued_growth', 'day_gainers', 'day_losers', 'most_actives', 'growth_technology_stocks', 'most_shorted_stocks'.
+    """
+    return await asyncio.to_thread(tools.screen_market_by_valuation.__wrapped__, criteria)
+
+
+async def schedule_investment_reminder(phone_number: str, interval: str, duration: str = "forever", topic: str = "general market", personalized: bool = False) -> str:
+    """
+    Schedules a repeatable or one-time investment reminder.
+    Args:
+        phone_number: The user's WhatsApp phone number.
+        interval: How often to send update (e.g., '5 minutes', '1 hour', '1 day').
+        duration: How long to keep sending (e.g., 'once', '2 days', 'forever').
+        topic: The specific investment topic.
+        personalized: True only if the user asks for updates tailored to their own conversation.
+            Otherwise everyone following the same topic receives the same shared update.
+    """
+    return await asyncio.to_thread(tools.schedule_investment_reminder, phone_number, interval, duration, topic, personalized)
+
+
+async def cancel_investment_reminders(phone_number: str, topic: str = None, reminder_id: str = None) -> str:
+    """
+    Cancels or stops active investment reminders for a user.
+    Args:
+        phone_number: The user's WhatsApp phone number.
+        topic: The specific topic to stop. If None, stops all for this number.
+        reminder_id: The ID of a single reminder to stop (shown by list_investment_schedules).
+    """
+    return await asyncio.to_thread(tools.cancel_investment_reminders, phone_number, topic, reminder_id)
+
+
+async def list_investment_schedules(phone_number: str) -> str:
+    """
+    Lists all active scheduled investment reminders for a user.
+    Args:
+        phone_number: The user's WhatsApp phone number.
+    """
+    return await asyncio.to_thread(tools.list_investment_schedules, phone_number)
+
+
+async def remember_user_fact(name: str, fact: str, tool_context) -> str:
+    """
+    Remembers a lasting fact about the user (e.g. their watchlist, risk profile or holdings)
+    so it is kept in every future conversation. Replaces any fact with the same name.
+    Args:
+        name: Short label for the fact (e.g., 'watchlist', 'risk profile').
+        fact: The fact itself (e.g., 'AAPL, NVDA, TSLA'). Pass an empty string to forget it.
+    """
+    return tools.remember_user_fact(name, fact, tool_context)
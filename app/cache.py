@@ -0,0 +1,587 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import inspect
+import hashlib
+import threading
+import weakref
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps, lru_cache
+from app.config import logger
+from app.store import redis_client, get_async_redis
+from app.market_hours import adaptive_ttl
+from app import popularity, tracing
+from app.metrics import CACHE_REQUESTS
+
+# How long a cache entry may be served stale (past its TTL) while one caller refreshes it,
+# as a multiple of the entry's TTL
+CACHE_STALE_FACTOR = float(os.getenv("CACHE_STALE_FACTOR", "1.0"))
+# Upper bound on how long one caller may hold a key's refresh lock
+CACHE_LOCK_SECONDS = int(os.getenv("CACHE_LOCK_SECONDS", "15"))
+# How long callers that lost the refresh race wait for the winner before computing themselves
+CACHE_LOCK_WAIT_SECONDS = float(os.getenv("CACHE_LOCK_WAIT_SECONDS", "10"))
+# Errors and empty results are cached this long so a broken symbol doesn't hammer upstream
+CACHE_NEGATIVE_TTL_SECONDS = int(os.getenv("CACHE_NEGATIVE_TTL_SECONDS", "30"))
+# In-process (L1) tier: entry count, and an optional cap on how long an entry is trusted
+# locally (0 = until the entry's own TTL, same as Redis)
+CACHE_L1_SIZE = int(os.getenv("CACHE_L1_SIZE", "2048"))
+CACHE_L1_TTL_SECONDS = float(os.getenv("CACHE_L1_TTL_SECONDS", "0"))
+# Broadcast writes and invalidations over Redis pub/sub so other processes drop their L1 copy
+CACHE_INVALIDATION_CHANNEL = os.getenv("CACHE_INVALIDATION_CHANNEL", "cache:invalidate")
+CACHE_PUBSUB_ENABLED = os.getenv("CACHE_PUBSUB_ENABLED", "false").lower() == "true"
+
+refresh_pool = ThreadPoolExecutor(max_workers=int(os.getenv("CACHE_REFRESH_WORKERS", "4")), thread_name_prefix="cache-refresh")
+
+_RELEASE_LOCK = redis_client.register_script("""
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+""")
+
+
+class _KeyedLocks:
+    """In-process locks per cache key, so concurrent threads share one computation."""
+
+    def __init__(self):
+        self._guard = threading.Lock()
+        self._locks: dict[str, list] = {}
+
+    def acquire(self, key: str) -> threading.Lock:
+        with self._guard:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        entry[0].acquire()
+        return entry[0]
+
+    def release(self, key: str):
+        with self._guard:
+            entry = self._locks[key]
+            entry[0].release()
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+
+_keyed_locks = _KeyedLocks()
+
+
+class LocalCache:
+    """Bounded, thread-safe LRU whose entries expire at an absolute time."""
+
+    def __init__(self, max_entries: int = CACHE_L1_SIZE):
+        self.max_entries = max_entries
+        self._data: OrderedDict[str, tuple] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        """Returns the value, or None if absent or expired."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, expires_at = item
+            if time.time() >= expires_at:
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value, expires_at: float):
+        if self.max_entries <= 0:
+            return
+        if CACHE_L1_TTL_SECONDS > 0:
+            expires_at = min(expires_at, time.time() + CACHE_L1_TTL_SECONDS)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+local_cache = LocalCache()
+
+_listener = None
+_listener_guard = threading.Lock()
+
+
+# Tags this process's broadcasts so it doesn't evict entries it just wrote
+_INSTANCE_ID = uuid.uuid4().hex[:12]
+
+
+def _on_invalidate(message):
+    data = message.get("data")
+    if not isinstance(data, bytes):
+        return
+    origin, _, key = data.decode().partition("|")
+    if origin != _INSTANCE_ID:
+        local_cache.delete(key)
+
+
+def _ensure_listener():
+    """Starts the pub/sub listener that evicts L1 entries written or invalidated elsewhere."""
+    global _listener
+    if not CACHE_PUBSUB_ENABLED or _listener is not None:
+        return
+    with _listener_guard:
+        if _listener is not None:
+            return
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{CACHE_INVALIDATION_CHANNEL: _on_invalidate})
+            _listener = pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+        except Exception as e:
+            logger.error(f"Cache invalidation listener unavailable: {e}")
+
+
+def _broadcast(cache_key: str):
+    if CACHE_PUBSUB_ENABLED:
+        redis_client.publish(CACHE_INVALIDATION_CHANNEL, f"{_INSTANCE_ID}|{cache_key}")
+
+
+@lru_cache(maxsize=4096)
+def make_cache_key(func_name: str, args: tuple, kwargs: tuple) -> str:
+    key_parts = [func_name] + list(map(str, args)) + [f"{k}={v}" for k, v in kwargs]
+    return "cache:" + hashlib.md5(":".join(key_parts).encode()).hexdigest()
+
+
+# --- Entries: value plus soft expiry; Redis holds them until the hard (stale) expiry ---
+
+def read_entry(cache_key: str):
+    """Returns (value, is_fresh), or (None, False) on a miss. Fresh values are copied into L1."""
+    raw = redis_client.get(cache_key)
+    if raw is None:
+        return None, False
+    entry = json.loads(raw)
+    fresh = time.time() < entry["exp"]
+    if fresh:
+        local_cache.set(cache_key, entry["v"], entry["exp"])
+    return entry["v"], fresh
+
+
+def write_entry(cache_key: str, value, ttl_seconds: float, stale_seconds: float = None):
+    stale_seconds = ttl_seconds * CACHE_STALE_FACTOR if stale_seconds is None else stale_seconds
+    expires_at = time.time() + ttl_seconds
+    redis_client.set(cache_key, json.dumps({"v": value, "exp": expires_at}), ex=max(1, int(ttl_seconds + stale_seconds)))
+    _broadcast(cache_key)
+    local_cache.set(cache_key, value, expires_at)
+
+
+def invalidate(cache_key: str):
+    """Drops a key from Redis and from every process's L1 tier (other processes need CACHE_PUBSUB_ENABLED)."""
+    local_cache.delete(cache_key)
+    redis_client.delete(cache_key)
+    _broadcast(cache_key)
+
+
+def try_lock(cache_key: str, lock_seconds: int = CACHE_LOCK_SECONDS) -> str | None:
+    """Takes the cross-process refresh lock for a key. Returns a release token, or None if held elsewhere."""
+    token = uuid.uuid4().hex
+    if redis_client.set(f"lock:{cache_key}", token, nx=True, ex=lock_seconds):
+        return token
+    return None
+
+
+def release_lock(cache_key: str, token: str):
+    _RELEASE_LOCK(keys=[f"lock:{cache_key}"], args=[token])
+
+
+def is_locked(cache_key: str) -> bool:
+    return bool(redis_client.exists(f"lock:{cache_key}"))
+
+
+def _cacheable(result) -> bool:
+    return bool(result) and not (isinstance(result, str) and result.startswith("Error"))
+
+
+def _store_result(cache_key: str, result, ttl_seconds: float, stale_seconds: float = None):
+    if _cacheable(result):
+        write_entry(cache_key, result, ttl_seconds, stale_seconds)
+    elif result is not None:
+        # Negative entry: short-lived and never served stale
+        write_entry(cache_key, result, min(ttl_seconds, CACHE_NEGATIVE_TTL_SECONDS), 0)
+
+
+def cached_call(cache_key: str, compute, ttl_seconds: float, stale_seconds: float = None, name: str = "cache", track: str = None):
+    """
+    Returns the cached value for `cache_key`, computing it with `compute()` when needed.
+    With `track`, the access is counted under (name, track) for the cache warmer.
+
+    - L1 hit: returned from process memory with no network I/O.
+    - Fresh hit: returned from Redis and copied into L1 until its TTL.
+    - Stale hit: returned directly; one caller across all processes refreshes it in the background.
+    - Miss: concurrent callers in this process share one computation, and across processes
+      only the holder of a short Redis lock computes while the others wait for its result.
+    """
+    def refresh(token: str):
+        try:
+            result = compute()
+            _store_result(cache_key, result, ttl_seconds, stale_seconds)
+            return result
+        except Exception as e:
+            logger.error(f"Cache refresh error for {name}: {e}")
+            raise
+        finally:
+            try:
+                release_lock(cache_key, token)
+            except Exception as e:
+                logger.error(f"Cache error: {e}")
+
+    def refresh_or_compute(token: str):
+        # Only Redis failures after compute() may reach here; never compute twice
+        result = compute()
+        try:
+            _store_result(cache_key, result, ttl_seconds, stale_seconds)
+            release_lock(cache_key, token)
+        except Exception as e:
+            logger.error(f"Cache error: {e}")
+        return result
+
+    value = local_cache.get(cache_key)
+    if value is not None:
+        CACHE_REQUESTS.labels(name, "l1").inc()
+        tracing.annotate(result="l1")
+        if track is not None:
+            popularity.track(name, track, hit=True)
+        return value
+    _ensure_listener()
+
+    try:
+        value, fresh = read_entry(cache_key)
+    except Exception as e:
+        logger.error(f"Cache error: {e}")
+        return compute()
+    outcome = "miss" if value is None else "hit" if fresh else "stale"
+    CACHE_REQUESTS.labels(name, outcome).inc()
+    tracing.annotate(result=outcome)
+    if track is not None:
+        popularity.track(name, track, hit=value is not None)
+
+    if value is not None:
+        if not fresh:
+            try:
+                token = try_lock(cache_key)
+            except Exception as e:
+                logger.error(f"Cache error: {e}")
+                token = None
+            if token:
+                logger.debug("cache.stale name=%s refreshing", name)
+                # Carry the caller's trace into the refresh thread
+                refresh_pool.submit(contextvars.copy_context().run, refresh, token)
+        return value
+
+    _keyed_locks.acquire(cache_key)
+    try:
+        try:
+            # Another thread may have filled it while we waited
+            value, _ = read_entry(cache_key)
+            token = None if value is not None else try_lock(cache_key)
+        except Exception as e:
+            logger.error(f"Cache error: {e}")
+            return compute()
+        if value is not None:
+            return value
+        if token:
+            return refresh_or_compute(token)
+
+        deadline = time.monotonic() + CACHE_LOCK_WAIT_SECONDS
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            try:
+                value, _ = read_entry(cache_key)
+                if value is None and not is_locked(cache_key):
+                    # The holder finished without caching (e.g. an error result)
+                    break
+            except Exception as e:
+                logger.error(f"Cache error: {e}")
+                break
+            if value is not None:
+                return value
+        else:
+            logger.warning(f"Timed out waiting for {name} refresh; computing directly")
+        return compute()
+    finally:
+        _keyed_locks.release(cache_key)
+
+
+# --- Asyncio path: the same entries, locks and L1 tier, without blocking the event loop ---
+
+# In-flight fills per event loop, so concurrent coroutines share one computation
+_async_fills: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = weakref.WeakKeyDictionary()
+# Strong references to background refreshes until they finish
+_background: set = set()
+
+
+async def read_entry_async(cache_key: str):
+    raw = await get_async_redis().get(cache_key)
+    if raw is None:
+        return None, False
+    entry = json.loads(raw)
+    fresh = time.time() < entry["exp"]
+    if fresh:
+        local_cache.set(cache_key, entry["v"], entry["exp"])
+    return entry["v"], fresh
+
+
+async def _store_result_async(cache_key: str, result, ttl_seconds: float, stale_seconds: float = None):
+    if _cacheable(result):
+        stale_seconds = ttl_seconds * CACHE_STALE_FACTOR if stale_seconds is None else stale_seconds
+    elif result is not None:
+        ttl_seconds, stale_seconds = min(ttl_seconds, CACHE_NEGATIVE_TTL_SECONDS), 0
+    else:
+        return
+    expires_at = time.time() + ttl_seconds
+    client = get_async_redis()
+    await client.set(cache_key, json.dumps({"v": result, "exp": expires_at}), ex=max(1, int(ttl_seconds + stale_seconds)))
+    if CACHE_PUBSUB_ENABLED:
+        await client.publish(CACHE_INVALIDATION_CHANNEL, f"{_INSTANCE_ID}|{cache_key}")
+    local_cache.set(cache_key, result, expires_at)
+
+
+async def try_lock_async(cache_key: str, lock_seconds: int = CACHE_LOCK_SECONDS) -> str | None:
+    token = uuid.uuid4().hex
+    if await get_async_redis().set(f"lock:{cache_key}", token, nx=True, ex=lock_seconds):
+        return token
+    return None
+
+
+async def release_lock_async(cache_key: str, token: str):
+    await get_async_redis().eval(_RELEASE_LOCK.script, 1, f"lock:{cache_key}", token)
+
+
+def spawn(coro):
+    """Runs a coroutine in the background, keeping a reference until it completes."""
+    task = asyncio.ensure_future(coro)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    return task
+
+
+async def async_cached_call(cache_key: str, compute, ttl_seconds: float, stale_seconds: float = None,
+                            name: str = "cache", track: str = None):
+    """
+    Asyncio twin of cached_call; `compute` is a zero-argument callable returning an awaitable.
+    Coroutines in one loop share a single fill per key; across processes the Redis lock applies.
+    """
+    async def refresh(token: str):
+        try:
+            await _store_result_async(cache_key, await compute(), ttl_seconds, stale_seconds)
+        except Exception as e:
+            logger.error(f"Cache refresh error for {name}: {e}")
+        finally:
+            try:
+                await release_lock_async(cache_key, token)
+            except Exception as e:
+                logger.error(f"Cache error: {e}")
+
+    async def fill():
+        try:
+            token = await try_lock_async(cache_key)
+        except Exception as e:
+            logger.error(f"Cache error: {e}")
+            return await compute()
+        if token:
+            result = await compute()
+            try:
+                await _store_result_async(cache_key, result, ttl_seconds, stale_seconds)
+                await release_lock_async(cache_key, token)
+            except Exception as e:
+                logger.error(f"Cache error: {e}")
+            return result
+
+        deadline = time.monotonic() + CACHE_LOCK_WAIT_SECONDS
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+            try:
+                value, _ = await read_entry_async(cache_key)
+                if value is None and not await get_async_redis().exists(f"lock:{cache_key}"):
+                    break
+            except Exception as e:
+                logger.error(f"Cache error: {e}")
+                break
+            if value is not None:
+                return value
+        else:
+            logger.warning(f"Timed out waiting for {name} refresh; computing directly")
+        return await compute()
+
+    value = local_cache.get(cache_key)
+    if value is not None:
+        CACHE_REQUESTS.labels(name, "l1").inc()
+        tracing.annotate(result="l1")
+        if track is not None:
+            popularity.track(name, track, hit=True)
+        return value
+    _ensure_listener()
+
+    try:
+        value, fresh = await read_entry_async(cache_key)
+    except Exception as e:
+        logger.error(f"Cache error: {e}")
+        return await compute()
+    outcome = "miss" if value is None else "hit" if fresh else "stale"
+    CACHE_REQUESTS.labels(name, outcome).inc()
+    tracing.annotate(result=outcome)
+    if track is not None:
+        popularity.track(name, track, hit=value is not None)
+
+    if value is not None:
+        if not fresh:
+            try:
+                token = await try_lock_async(cache_key)
+            except Exception as e:
+                logger.error(f"Cache error: {e}")
+                token = None
+            if token:
+                spawn(refresh(token))
+        return value
+
+    fills = _async_fills.setdefault(asyncio.get_running_loop(), {})
+    task = fills.get(cache_key)
+    if task is None:
+        task = asyncio.ensure_future(fill())
+        fills[cache_key] = task
+        task.add_done_callback(lambda _: fills.pop(cache_key, None))
+    # One caller being cancelled must not cancel the shared fill
+    return await asyncio.shield(task)
+
+
+def entry_expiry(cache_key: str) -> float | None:
+    """Soft expiry (epoch seconds) of a cached entry, or None if it is not cached."""
+    raw = redis_client.get(cache_key)
+    return json.loads(raw)["exp"] if raw is not None else None
+
+
+# Functions decorated with redis_cache, by name, so the warmer can recompute popular entries
+_warmable: dict[str, tuple] = {}
+
+
+def _entry_ttls(ttl_seconds: int, stale_seconds: int | None, market: str | None) -> tuple:
+    if not market:
+        return ttl_seconds, stale_seconds
+    stale = ttl_seconds * CACHE_STALE_FACTOR if stale_seconds is None else stale_seconds
+    return adaptive_ttl(ttl_seconds, exchange=market), stale
+
+
+def _bind(signature: inspect.Signature, args: tuple, kwargs: dict) -> tuple[tuple, dict]:
+    """
+    A call's arguments, all by name with defaults filled in, so f("x"), f(name="x") and a
+    call relying on the default share one key. Calls that don't bind are left as they are.
+    """
+    try:
+        bound = signature.bind(*args, **kwargs)
+    except TypeError:
+        return tuple(args), dict(kwargs)
+    if any(p.kind in (p.VAR_POSITIONAL, p.VAR_KEYWORD) for p in signature.parameters.values()):
+        return tuple(args), dict(kwargs)
+    bound.apply_defaults()
+    return (), dict(bound.arguments)
+
+
+def _call_member(args: tuple, kwargs: dict) -> str | None:
+    """Popularity member for a call: its JSON-encoded arguments, or None if they don't encode."""
+    try:
+        return json.dumps([list(args), kwargs], sort_keys=True)
+    except (TypeError, ValueError):
+        return None
+
+
+def warm(name: str, args: tuple = (), kwargs: dict = None, ahead_seconds: float = 0) -> bool:
+    """
+    Recomputes a redis_cache'd call if its entry is missing or expires within `ahead_seconds`.
+    Skips keys another caller is already refreshing. Returns True if it recomputed.
+    """
+    func, ttl_seconds, stale_seconds, market = _warmable[name]
+    args, kwargs = _bind(inspect.signature(func), args, kwargs or {})
+    cache_key = make_cache_key.__wrapped__(name, args, tuple(sorted(kwargs.items())))
+    expires_at = entry_expiry(cache_key)
+    if expires_at is not None and expires_at - time.time() > ahead_seconds:
+        return False
+    token = try_lock(cache_key)
+    if not token:
+        return False
+    try:
+        ttl, stale = _entry_ttls(ttl_seconds, stale_seconds, market)
+        _store_result(cache_key, func(*args, **kwargs), ttl, stale)
+        return True
+    finally:
+        release_lock(cache_key, token)
+
+
+def warm_popular(top_n: int, ahead_seconds: float) -> int:
+    """Refreshes the `top_n` most used entries of every redis_cache'd function that are about to expire."""
+    warmed = 0
+    for name in list(_warmable):
+        for member in popularity.top(name, top_n):
+            args, kwargs = json.loads(member)
+            try:
+                warmed += warm(name, tuple(args), kwargs, ahead_seconds)
+            except Exception as e:
+                logger.error(f"Cache warm failed for {name}{tuple(args)}: {e}")
+    return warmed
+
+
+def redis_cache(ttl_seconds: int = 300, stale_seconds: int = None, market: str = None):
+    """
+    Caches a tool's string result in Redis for `ttl_seconds`, then serves it stale for up to
+    `stale_seconds` more (default: CACHE_STALE_FACTOR x ttl) while a single caller refreshes it.
+
+    With `market` (an exchange code from app.market_hours, e.g. "US"), `ttl_seconds` is the
+    in-session TTL; outside the session the entry lives longer, up to the next open.
+    Calls are counted by popularity so the warmer (tasks/cache_warmer.py) can keep hot ones fresh.
+
+    Coroutine functions are cached through the asyncio path; a sync and an async function
+    with the same name share entries, and the sync one is what the warmer recomputes.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        def key_for(args, kwargs):
+            try:
+                return make_cache_key(func.__name__, args, tuple(sorted(kwargs.items())))
+            except TypeError:
+                # Unhashable arguments: build the key without memoizing it
+                return make_cache_key.__wrapped__(func.__name__, args, tuple(sorted(kwargs.items())))
+
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                args, kwargs = _bind(signature, args, kwargs)
+                ttl, stale = _entry_ttls(ttl_seconds, stale_seconds, market)
+                with tracing.span("cache", function=func.__name__):
+                    return await async_cached_call(key_for(args, kwargs), lambda: func(*args, **kwargs), ttl, stale,
+                                                   name=func.__name__, track=_call_member(args, kwargs))
+            return async_wrapper
+
+        _warmable[func.__name__] = (func, ttl_seconds, stale_seconds, market)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            # ADK passes tool arguments by name, the warmer by position: both map to one key
+            args, kwargs = _bind(signature, args, kwargs)
+            ttl, stale = _entry_ttls(ttl_seconds, stale_seconds, market)
+            with tracing.span("cache", function=func.__name__):
+                return cached_call(key_for(args, kwargs), lambda: func(*args, **kwargs), ttl, stale,
+                                   name=func.__name__, track=_call_member(args, kwargs))
+        return wrapper
+    return decorator
@@ -0,0 +1,191 @@
+import os
+import json
+from app.config import logger
+from app import tracing
+from app.metrics import CONTEXT_TOKENS, COMPACTIONS
+
+# Keeps each model call's prompt near a fixed size however long the conversation gets.
+# ADK rebuilds the prompt from the session on every call; this rewrites that copy only,
+# the stored history is untouched.
+CONTEXT_COMPACTION_ENABLED = os.getenv("CONTEXT_COMPACTION_ENABLED", "true").lower() == "true"
+# Estimated prompt tokens (history + tool results) to stay under
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+# Most recent user turns that are always sent verbatim (the current one included)
+CONTEXT_KEEP_TURNS = int(os.getenv("CONTEXT_KEEP_TURNS", "4"))
+# Tool results in older turns are cut to this many characters
+CONTEXT_TOOL_OUTPUT_CHARS = int(os.getenv("CONTEXT_TOOL_OUTPUT_CHARS", "300"))
+# Dropped turns listed in the condensed summary (older ones are only counted)
+CONTEXT_SUMMARY_TURNS = int(os.getenv("CONTEXT_SUMMARY_TURNS", "20"))
+
+# User-scoped state, so facts follow the user across sessions and survive compaction
+PINNED_FACTS_KEY = "user:pinned_facts"
+MAX_PINNED_FACTS = 20
+
+_CHARS_PER_TOKEN = 4
+
+
+# --- Token estimates (no tokenizer round trip; ~4 characters per token) ---
+
+def _part_chars(part) -> int:
+    if part.text:
+        return len(part.text)
+    if part.function_call:
+        return len(part.function_call.name or "") + len(json.dumps(part.function_call.args or {}, default=str))
+    if part.function_response:
+        return len(part.function_response.name or "") + len(json.dumps(part.function_response.response or {}, default=str))
+    return 0
+
+
+def estimate_tokens(contents) -> int:
+    return sum(_part_chars(part) for content in contents for part in (content.parts or [])) // _CHARS_PER_TOKEN
+
+
+# --- Turns ---
+
+def _starts_turn(content) -> bool:
+    """A user message, as opposed to the function results ADK also sends with role 'user'."""
+    parts = content.parts or []
+    return content.role == "user" and any(p.text for p in parts) and not any(p.function_response for p in parts)
+
+
+def split_turns(contents) -> list[list]:
+    """Groups contents into turns: a user message and the calls, results and replies that follow it."""
+    turns = []
+    for content in contents:
+        if _starts_turn(content) or not turns:
+            turns.append([])
+        turns[-1].append(content)
+    return turns
+
+
+def _truncate_tool_outputs(turn: list, limit: int) -> tuple[list, int]:
+    """Copies of a turn's contents with long function results cut short, and how many were cut."""
+    cut = 0
+    out = []
+    for content in turn:
+        parts = []
+        for part in content.parts or []:
+            response = part.function_response
+            if response is not None:
+                raw = json.dumps(response.response or {}, default=str)
+                if len(raw) > limit:
+                    short = response.model_copy(update={"response": {"result": raw[:limit] + " …[truncated]"}})
+                    part = part.model_copy(update={"function_response": short})
+            parts.append(part)
+        changed = sum(new is not old for new, old in zip(parts, content.parts or []))
+        cut += changed
+        # The session's own events are never modified, only these copies
+        out.append(content.model_copy(update={"parts": parts}) if changed else content)
+    return out, cut
+
+
+def _one_line(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+def _turn_text(turn: list, role: str) -> str:
+    return " ".join(p.text for c in turn if c.role == role for p in (c.parts or []) if p.text and not p.thought)
+
+
+def summarize_turns(turns: list[list]) -> str:
+    """Condensed, extractive record of dropped turns: what the user asked and how it was answered."""
+    lines = []
+    skipped = max(0, len(turns) - CONTEXT_SUMMARY_TURNS)
+    if skipped:
+        lines.append(f"- ({skipped} earlier exchanges omitted)")
+    for turn in turns[skipped:]:
+        asked = _turn_text(turn, "user")
+        answered = _turn_text(turn, "model")
+        tools = sorted({p.function_call.name for c in turn for p in (c.parts or []) if p.function_call})
+        line = f"- User: {_one_line(asked, 160)}"
+        if tools:
+            line += f" [looked up with {', '.join(tools)}]"
+        if answered:
+            line += f"\n  You: {_one_line(answered, 240)}"
+        lines.append(line)
+    return "Earlier in this conversation (condensed; older messages are no longer shown):\n" + "\n".join(lines)
+
+
+def compact(contents: list, budget: int = CONTEXT_TOKEN_BUDGET, keep_turns: int = CONTEXT_KEEP_TURNS) -> tuple[list, str | None, dict]:
+    """
+    Shrinks a prompt's history to about `budget` tokens. Tool results outside the last
+    `keep_turns` turns are truncated first; if that isn't enough, the oldest turns are
+    dropped and returned as a condensed summary.
+    Returns (contents, summary or None, stats).
+    """
+    before = estimate_tokens(contents)
+    stats = {"tokens_before": before, "tokens_after": before, "truncated": 0, "dropped_turns": 0}
+    if before <= budget:
+        return contents, None, stats
+
+    turns = split_turns(contents)
+    split = max(0, len(turns) - keep_turns)
+    older, recent = turns[:split], turns[split:]
+    for i, turn in enumerate(older):
+        older[i], cut = _truncate_tool_outputs(turn, CONTEXT_TOOL_OUTPUT_CHARS)
+        stats["truncated"] += cut
+
+    sizes = [estimate_tokens(turn) for turn in older]
+    total = sum(sizes) + estimate_tokens([c for turn in recent for c in turn])
+    dropped = 0
+    while total > budget and dropped < len(older):
+        total -= sizes[dropped]
+        dropped += 1
+
+    stats.update(tokens_after=total, dropped_turns=dropped)
+    kept = [c for turn in older[dropped:] + recent for c in turn]
+    return kept, summarize_turns(older[:dropped]) if dropped else None, stats
+
+
+# --- Pinned facts ---
+
+def pinned_facts(state) -> dict:
+    return dict(state.get(PINNED_FACTS_KEY) or {})
+
+
+def pin_fact(state, name: str, fact: str) -> dict:
+    """Stores (or with an empty fact, forgets) a named fact in user state; returns the facts."""
+    facts = pinned_facts(state)
+    name = _one_line(name, 60).lower()
+    if fact and fact.strip():
+        facts[name] = _one_line(fact, 500)
+        # Oldest go first once the cap is reached; dicts keep insertion order
+        while len(facts) > MAX_PINNED_FACTS:
+            facts.pop(next(iter(facts)))
+    else:
+        facts.pop(name, None)
+    # Assigned (not mutated) so the change is recorded in the event's state delta
+    state[PINNED_FACTS_KEY] = facts
+    return facts
+
+
+def render_pinned(facts: dict) -> str:
+    lines = "\n".join(f"- {name}: {fact}" for name, fact in facts.items())
+    return f"Facts this user asked you to remember (current, always apply):\n{lines}"
+
+
+# --- ADK callback ---
+
+def before_model(callback_context, llm_request):
+    """ADK before_model_callback: pinned facts into the system instruction, history compacted to budget."""
+    facts = pinned_facts(callback_context.state)
+    if facts:
+        llm_request.append_instructions([render_pinned(facts)])
+    if not CONTEXT_COMPACTION_ENABLED:
+        return None
+
+    contents, summary, stats = compact(list(llm_request.contents or []))
+    if stats["truncated"]:
+        COMPACTIONS.labels("truncated").inc()
+    if summary:
+        llm_request.append_instructions([summary])
+        COMPACTIONS.labels("dropped").inc()
+    llm_request.contents = contents
+    CONTEXT_TOKENS.observe(stats["tokens_after"])
+    if stats["tokens_after"] != stats["tokens_before"]:
+        tracing.annotate(context_tokens=stats["tokens_after"], context_tokens_uncompacted=stats["tokens_before"],
+                         dropped_turns=stats["dropped_turns"])
+        logger.debug(f"Compacted prompt {stats['tokens_before']} -> {stats['tokens_after']} tokens "
+                     f"({stats['dropped_turns']} turns dropped, {stats['truncated']} tool results cut)")
+    return None
@@ -0,0 +1,74 @@
+import os
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+# Agent turns allowed to run at once in this process
+AGENT_MAX_CONCURRENCY = int(os.getenv("AGENT_MAX_CONCURRENCY", "32"))
+# Turns allowed to wait for a slot before new ones are rejected
+AGENT_MAX_QUEUE = int(os.getenv("AGENT_MAX_QUEUE", "200"))
+
+BUSY_MESSAGE = "⏳ I'm handling a lot of requests right now. Please try again in a minute."
+
+
+class LimiterBusy(Exception):
+    """Raised when the wait queue is full."""
+
+
+class ConcurrencyLimiter:
+    """
+    Async semaphore with a bounded wait queue and wait-time accounting.
+    Must be used from a single event loop.
+    """
+
+    def __init__(self, max_concurrency: int = AGENT_MAX_CONCURRENCY, max_queue: int = AGENT_MAX_QUEUE):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_wait = 0.0
+
+    @asynccontextmanager
+    async def slot(self):
+        """Holds one concurrency slot; raises LimiterBusy if the queue is full."""
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise LimiterBusy()
+
+        start = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        waited = time.perf_counter() - start
+        self.admitted += 1
+        self.total_wait += waited
+        self.last_wait = waited
+        self.max_wait = max(self.max_wait, waited)
+
+        self.active += 1
+        try:
+            yield waited
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self.total_wait / self.admitted * 1000, 1) if self.admitted else 0.0,
+            "last_wait_ms": round(self.last_wait * 1000, 1),
+            "max_wait_ms": round(self.max_wait * 1000, 1),
+        }
@@ -0,0 +1,152 @@
+import os
+import asyncio
+import time
+import uuid
+from typing import Awaitable, Callable
+
+from app.config import logger
+from app import tracing
+from app.metrics import QUEUE_WAIT_SECONDS
+from app.store import get_async_redis
+
+# Quiet period that closes a burst of messages, arriving while a turn runs, into one agent turn
+MAILBOX_DEBOUNCE_SECONDS = float(os.getenv("MAILBOX_DEBOUNCE_SECONDS", "1.5"))
+# Upper bound on how long a burst can keep extending the debounce window
+MAILBOX_MAX_WAIT_SECONDS = float(os.getenv("MAILBOX_MAX_WAIT_SECONDS", "5"))
+# Cross-replica per-user lock, held for the duration of one agent turn
+MAILBOX_LOCK_TTL_SECONDS = int(os.getenv("MAILBOX_LOCK_TTL_SECONDS", "180"))
+
+_RELEASE_LOCK = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class UserLock:
+    """
+    Redis lease that serializes turns for one user across API replicas.
+    Falls back to running unlocked if Redis is unavailable.
+    """
+
+    def __init__(self, user_id: str, ttl_seconds: int = MAILBOX_LOCK_TTL_SECONDS, poll_seconds: float = 0.1):
+        self.key = f"mailbox:lock:{user_id}"
+        self.token = uuid.uuid4().hex
+        self.ttl_seconds = ttl_seconds
+        self.poll_seconds = poll_seconds
+        self._held = False
+
+    async def __aenter__(self):
+        with tracing.span("mailbox.lock"):
+            return await self._acquire()
+
+    async def _acquire(self):
+        deadline = time.monotonic() + self.ttl_seconds
+        try:
+            r = get_async_redis()
+            while not await r.set(self.key, self.token, nx=True, ex=self.ttl_seconds):
+                if time.monotonic() > deadline:
+                    logger.warning(f"Gave up waiting for {self.key}")
+                    return self
+                await asyncio.sleep(self.poll_seconds)
+            self._held = True
+        except Exception as e:
+            logger.error(f"User lock unavailable for {self.key}: {e}")
+        return self
+
+    async def __aexit__(self, *exc):
+        if self._held:
+            try:
+                await get_async_redis().eval(_RELEASE_LOCK, 1, self.key, self.token)
+            except Exception as e:
+                logger.error(f"Failed to release {self.key}: {e}")
+        return False
+
+
+class UserMailbox:
+    """
+    Per-phone-number mailbox: turns for one user run strictly in order, one at a time.
+
+    A message to an idle mailbox starts its turn at once. Messages that arrive while a
+    turn for the same user is queued or running are merged, once they go quiet for the
+    debounce window, and handed to the handler as a single batch.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[str, list[str]], Awaitable[None]],
+        debounce_seconds: float = MAILBOX_DEBOUNCE_SECONDS,
+        max_wait_seconds: float = MAILBOX_MAX_WAIT_SECONDS,
+    ):
+        self._handler = handler
+        self.debounce_seconds = debounce_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self._pending: dict[str, list[str]] = {}
+        # When the oldest pending message of each user arrived
+        self._first_at: dict[str, float] = {}
+        # Trace context of each pending message, so its turn joins the message's trace
+        self._traces: dict[str, list[str]] = {}
+        self._workers: dict[str, asyncio.Task] = {}
+        self.coalesced = 0
+
+    def submit(self, user_id: str, text: str):
+        """Queues a message; starts the user's drain loop if it isn't running."""
+        self._pending.setdefault(user_id, []).append(text)
+        self._first_at.setdefault(user_id, time.monotonic())
+        self._traces.setdefault(user_id, []).append(tracing.current_context())
+        if user_id not in self._workers:
+            self._workers[user_id] = asyncio.create_task(self._drain(user_id))
+
+    def pending_count(self) -> int:
+        return sum(len(texts) for texts in self._pending.values())
+
+    def active_users(self) -> int:
+        return len(self._workers)
+
+    async def _wait_for_quiet(self, user_id: str):
+        """Sleeps until no new message has arrived for one debounce window (capped)."""
+        deadline = time.monotonic() + self.max_wait_seconds
+        seen = -1
+        while True:
+            count = len(self._pending.get(user_id, ()))
+            if count == seen or time.monotonic() >= deadline:
+                return
+            seen = count
+            await asyncio.sleep(min(self.debounce_seconds, max(0.0, deadline - time.monotonic())))
+
+    async def _drain(self, user_id: str):
+        try:
+            while True:
+                batch = self._pending.pop(user_id, [])
+                first_at = self._first_at.pop(user_id, None)
+                traces = [t for t in self._traces.pop(user_id, []) if t]
+                if not batch:
+                    return
+                if first_at is not None:
+                    QUEUE_WAIT_SECONDS.labels("mailbox").observe(time.monotonic() - first_at)
+                if len(batch) > 1:
+                    self.coalesced += len(batch) - 1
+                    logger.info(f"Coalesced {len(batch)} messages from {user_id} into one turn")
+                try:
+                    # A merged turn continues the first message's trace and links the others
+                    with tracing.span("mailbox.turn", parent=traces[0] if traces else None, new_trace=not traces,
+                                      messages=len(batch), linked_traces=[t.split(":")[0] for t in traces[1:]]):
+                        async with UserLock(user_id):
+                            await self._handler(user_id, batch)
+                except Exception as e:
+                    logger.error(f"Mailbox handler failed for {user_id}: {e}")
+                # Messages that arrived during the turn are merged once the burst goes quiet
+                if user_id in self._pending:
+                    await self._wait_for_quiet(user_id)
+        finally:
+            self._workers.pop(user_id, None)
+
+    async def shutdown(self, timeout: float = 30.0):
+        """Waits for in-flight turns to finish, then cancels whatever is left."""
+        workers = list(self._workers.values())
+        if not workers:
+            return
+        _, still_running = await asyncio.wait(workers, timeout=timeout)
+        for task in still_running:
+            task.cancel()
@@ -1,25 +1,61 @@
 import os
 import json
-from fastapi import FastAPI, Request, HTTPException, BackgroundTasks
-from app.agent import create_agent
-from app.whatsapp import send_whatsapp_message
+import hmac
+import time
+import asyncio
+from app import startup
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, HTTPException, Response
+from app.agent import get_runner
+from app.whatsapp import send_whatsapp_message, send_typing_indicator, open_client, close_client, ReplyStream
+from app.sessions import ensure_session, record_exchange
+from app.router import router
+from app import metrics, tracing, profiler, allowlist, ratelimit
+from app.mailbox import UserMailbox
+from app.limiter import ConcurrencyLimiter, LimiterBusy, BUSY_MESSAGE
 from dotenv import load_dotenv
-from google.adk.runners import Runner
-from google.adk.sessions import InMemorySessionService
-from google import genai
+from google.adk.agents.run_config import RunConfig, StreamingMode
 from google.genai import types
 
 load_dotenv()
 
-app = FastAPI()
-agent = create_agent()
-session_service = InMemorySessionService()
-runner = Runner(app_name="whatsapp-investment-bot", agent=agent, session_service=session_service)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup.mark("imports")
+    # Build the process's agent and runner before the first webhook, not during it
+    get_runner()
+    startup.mark("agent")
+    # Local snapshot of the Redis allowlist, kept current by a watcher thread
+    allowlist.start()
+    startup.mark("allowlist")
+    # One pooled, keep-alive Graph API client for the lifetime of the process
+    await open_client()
+    startup.ready("api")
+    yield
+    await mailbox.shutdown()
+    await close_client()
+    await close_yahoo_session()
+    await close_async_redis()
 
-from app.config import ALLOWED_NUMBERS
+app = FastAPI(lifespan=lifespan)
+
+from app.config import logger
+from app.store import get_async_redis, close_async_redis
+from app.yahoo import close_session as close_yahoo_session
 
 VERIFY_TOKEN = os.getenv("WHATSAPP_VERIFY_TOKEN")
 
+# Meta retries unacknowledged deliveries for up to a day
+DEDUP_KEY_PREFIX = "wa:seen:"
+DEDUP_TTL_SECONDS = int(os.getenv("WHATSAPP_DEDUP_TTL_SECONDS", "86400"))
+
+# Stream model output token by token (SSE) so replies can be flushed paragraph by paragraph
+AGENT_STREAMING = os.getenv("AGENT_STREAMING", "true").lower() == "true"
+run_config = RunConfig(streaming_mode=StreamingMode.SSE if AGENT_STREAMING else StreamingMode.NONE)
+
+# Fire-and-forget tasks (typing indicators) are kept referenced until done
+_background_tasks: set = set()
+
 @app.get("/webhook")
 async def verify_webhook(request: Request):
     # Meta's verification step
@@ -35,52 +71,88 @@ async def verify_webhook(request: Request):
             raise HTTPException(status_code=403, detail="Verification failed")
     return "Invalid request"
 
+def iter_webhook_messages(body: dict):
+    """Yields every message in a webhook payload, across all entries and changes."""
+    for entry in body.get("entry", []) or []:
+        for change in entry.get("changes", []) or []:
+            value = change.get("value", {}) or {}
+            for msg in value.get("messages", []) or []:
+                yield msg
+
+async def claim_new_message_ids(message_ids: list[str]) -> list[bool]:
+    """
+    Atomically marks message IDs as seen in Redis (SET NX with a TTL).
+    Returns True for each ID seen for the first time, so Meta redeliveries are dropped.
+    """
+    if not message_ids:
+        return []
+    try:
+        pipe = get_async_redis().pipeline(transaction=False)
+        for message_id in message_ids:
+            pipe.set(f"{DEDUP_KEY_PREFIX}{message_id}", 1, nx=True, ex=DEDUP_TTL_SECONDS)
+        return [bool(claimed) for claimed in await pipe.execute()]
+    except Exception as e:
+        # Fail open: a duplicate reply is better than a dropped message
+        logger.error(f"Message dedup unavailable: {e}")
+        return [True] * len(message_ids)
+
 @app.post("/webhook")
-async def webhook_post(request: Request, background_tasks: BackgroundTasks):
+async def webhook_post(request: Request):
     """Handle incoming WhatsApp messages asynchronously."""
+    started = time.perf_counter()
     try:
         body = await request.json()
-        # print(f"DEBUG: Webhook received body: {body}")
-        
-        # Extract message data
-        entry = body.get("entry", [])
-        if not entry:
-            return {"status": "ok"}
-        
-        changes = entry[0].get("changes", [])
-        if not changes:
-            return {"status": "ok"}
-        
-        value = changes[0].get("value", {})
-        messages = value.get("messages", [])
-        
-        if messages:
-            msg = messages[0]
+
+        pending = []
+        for msg in iter_webhook_messages(body):
             from_number = msg.get("from")
-            text_body = msg.get("text", {}).get("body")
-            
+            text_body = (msg.get("text") or {}).get("body")
+            if not from_number or not text_body:
+                continue
+
             # Check if phone number is allowed
-            clean_number = from_number.replace("+", "")
-            if ALLOWED_NUMBERS and clean_number not in ALLOWED_NUMBERS:
-                # logger.warning(f"Unauthorized access attempt from {from_number}")
-                return {"status": "unauthorized"}
-            
-            if text_body:
-                # Offload processing to background task
-                background_tasks.add_task(process_message_background, from_number, text_body)
-                
+            if not allowlist.is_allowed(from_number):
+                logger.warning(f"Unauthorized access attempt from {from_number}")
+                continue
+
+            pending.append(msg)
+
+        # Messages without an ID can't be deduplicated; always process them
+        ids = [msg["id"] for msg in pending if msg.get("id")]
+        claimed = iter(await claim_new_message_ids(ids))
+
+        for msg in pending:
+            if msg.get("id") and not next(claimed):
+                logger.info(f"Skipping duplicate delivery {msg.get('id')}")
+                continue
+            # Each message starts its own trace, carried through the mailbox into its turn
+            with tracing.span("webhook.message", new_trace=True, message_id=msg.get("id"), user=msg["from"]):
+                if msg.get("id"):
+                    # Read receipt + typing indicator right away, without delaying the ack
+                    task = asyncio.create_task(send_typing_indicator(msg["id"]))
+                    _background_tasks.add(task)
+                    task.add_done_callback(_background_tasks.discard)
+                # Queue on the sender's mailbox; turns run in order after the ack
+                mailbox.submit(msg["from"], msg["text"]["body"])
+
         return {"status": "ok"}
-    
+
     except Exception as e:
-        # logger.error(f"Error processing webhook: {e}")
+        logger.error(f"Error processing webhook: {e}")
         return {"status": "error", "message": str(e)}
+    finally:
+        metrics.WEBHOOK_ACK_SECONDS.observe(time.perf_counter() - started)
 
-async def process_message_background(from_number: str, text_body: str):
+@tracing.traced("process_message")
+async def process_message_background(from_number: str, texts: list[str]):
     """
     Background task to process the message with the AI agent.
-    This runs after the webhook returns 200 OK.
+    Called by the user's mailbox after the webhook returns 200 OK, with every
+    message that arrived while the previous turn ran merged into one turn.
     """
     try:
+        runner = get_runner()
+        text_body = "\n".join(texts)
         full_prompt = f"User (Phone: {from_number}): {text_body}"
         
         # Create message content object
@@ -89,44 +161,139 @@ async def process_message_background(from_number: str, text_body: str):
             parts=[types.Part(text=full_prompt)]
         )
         
+        # Simple, unambiguous requests (a price, a ticker list, 'my reminders') skip the LLM
+        if len(texts) == 1:
+            fast_reply = await router.handle(from_number, text_body)
+            tracing.annotate(routed=bool(fast_reply))
+            if fast_reply:
+                await send_whatsapp_message(from_number, fast_reply)
+                await record_exchange(runner.session_service, from_number, from_number, full_prompt, fast_reply, author=runner.agent.name)
+                return
+
+        # The sender's and the fleet's turn budgets, spent before queuing for a slot
+        try:
+            await ratelimit.start_turn(from_number)
+        except ratelimit.RateLimited as e:
+            tracing.annotate(rate_limited=e.bucket)
+            logger.warning(f"Turn for {from_number} refused: {e}")
+            await send_whatsapp_message(from_number, ratelimit.SLOW_DOWN_MESSAGE if e.bucket.startswith("user:") else BUSY_MESSAGE)
+            return
+
         # Create or get session
+        await ensure_session(runner.session_service, user_id=from_number, session_id=from_number)
+        
+        # Run agent natively on the event loop, behind the global concurrency limit.
+        # Text is delivered in parts as it is generated instead of after the whole run.
+        reply = ReplyStream(from_number)
+        usage = metrics.TurnUsage("interactive")
+        turned_away = False
         try:
-            session = await session_service.create_session(
-                app_name="whatsapp-investment-bot",
-                user_id=from_number,
-                session_id=from_number
+            async with agent_limiter.slot() as waited:
+                metrics.QUEUE_WAIT_SECONDS.labels("agent_slot").observe(waited)
+                tracing.annotate(slot_wait_seconds=round(waited, 3))
+                if waited > 1:
+                    logger.info(f"Agent turn for {from_number} waited {waited:.1f}s for a slot")
+                started = time.monotonic()
+                streamed = False
+                async for event in runner.run_async(
+                    user_id=from_number,
+                    session_id=from_number,
+                    new_message=message,
+                    run_config=run_config
+                ):
+                    usage.add(event)
+                    if not (event.content and event.content.parts):
+                        continue
+                    # With SSE, partial events carry the text and the closing event repeats it in full
+                    if not event.partial and streamed:
+                        streamed = False
+                        continue
+                    streamed = bool(event.partial)
+                    for part in event.content.parts:
+                        if part.text and not part.thought:
+                            reply.feed(part.text)
+        except LimiterBusy:
+            logger.warning(f"Agent queue full, turning away {from_number}")
+            turned_away = True
+        except ratelimit.RateLimited as e:
+            tracing.annotate(rate_limited=e.bucket)
+            logger.warning(f"Turn for {from_number} cut short: {e}")
+            turned_away = True
+        finally:
+            await reply.close()
+
+        if turned_away:
+            # After close(), so any part of the answer already generated arrives first
+            await send_whatsapp_message(from_number, BUSY_MESSAGE)
+            return
+
+        metrics.AGENT_RUN_SECONDS.labels("interactive").observe(time.monotonic() - started)
+        usage.record()
+        tracing.annotate(parts_sent=reply.parts_sent, prompt_tokens=usage.prompt, output_tokens=usage.output,
+                         context_tokens=usage.last_prompt)
+        if reply.first_part_at is not None:
+            metrics.FIRST_REPLY_SECONDS.observe(reply.first_part_at - started)
+            logger.info(
+                f"Replied to {from_number} in {reply.parts_sent} parts; "
+                f"first after {reply.first_part_at - started:.1f}s, run {time.monotonic() - started:.1f}s"
             )
-        except Exception:
-            # Session likely exists
-            pass
-        
-        # Run agent in threadpool to avoid blocking async loop
-        from starlette.concurrency import run_in_threadpool
-        
-        result = await run_in_threadpool(
-            runner.run, 
-            user_id=from_number, 
-            session_id=from_number, 
-            new_message=message
-        )
-        
-        # Extract response text
-        ai_text = ""
-        for event in result:
-            if hasattr(event, 'content') and event.content and hasattr(event.content, 'parts'):
-                for part in event.content.parts:
-                    if hasattr(part, 'text') and part.text:
-                        ai_text += part.text
-            elif hasattr(event, 'text') and event.text:
-                ai_text += event.text
-        
-        # Send response via WhatsApp API
-        if ai_text:
-            await send_whatsapp_message(from_number, ai_text)
-            
+
     except Exception as e:
-        print(f"Error in background task: {e}") # Replace with logger later if needed
+        tracing.annotate(error=str(e))
+        logger.error(f"Error in background task: {e}")
+
+agent_limiter = ConcurrencyLimiter()
+mailbox = UserMailbox(process_message_background)
 
 @app.get("/")
 def read_root():
     return {"message": "WhatsApp Investment Bot is running!"}
+
+@app.get("/metrics")
+def read_metrics():
+    """Prometheus scrape endpoint."""
+    data, content_type = metrics.render()
+    return Response(content=data, media_type=content_type)
+
+@app.get("/stats")
+def read_stats():
+    """Queue depth and wait times for the agent pipeline."""
+    return {
+        "agent": agent_limiter.stats(),
+        "router": router.stats(),
+        "mailbox": {
+            "active_users": mailbox.active_users(),
+            "pending_messages": mailbox.pending_count(),
+            "coalesced": mailbox.coalesced,
+        },
+        "allowlist": allowlist.stats(),
+        "rate_limits": ratelimit.stats(),
+        "startup": startup.report(),
+    }
+
+
+# --- Admin ---
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+def require_admin(request: Request):
+    if not ADMIN_TOKEN or not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+@app.post("/admin/profile")
+def start_profile(request: Request, seconds: float = 30, interval_ms: float = 10):
+    """Starts sampling stacks of live traffic for `seconds`; fetch the result with GET."""
+    require_admin(request)
+    try:
+        profiler.start(seconds, interval_ms / 1000)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return profiler.status()
+
+@app.get("/admin/profile")
+def read_profile(request: Request):
+    """Collapsed stacks of the last profile (flamegraph.pl / speedscope format), or its status while running."""
+    require_admin(request)
+    if profiler.running():
+        return profiler.status()
+    return Response(content=profiler.collapsed(), media_type="text/plain")
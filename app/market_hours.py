@@ -0,0 +1,262 @@
+import os
+import datetime as dt
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+# TTL multiplier while only pre/post-market trading is running
+EXTENDED_HOURS_TTL_FACTOR = float(os.getenv("EXTENDED_HOURS_TTL_FACTOR", "5"))
+# Longest a closed-market entry may live (covers long weekends plus a holiday)
+MAX_CLOSED_TTL_SECONDS = int(os.getenv("MAX_CLOSED_TTL_SECONDS", str(4 * 86400)))
+# Pre-market entries expire this long after the opening bell, once regular-session data is live
+MARKET_OPEN_GRACE_SECONDS = int(os.getenv("MARKET_OPEN_GRACE_SECONDS", "5"))
+
+OPEN, PRE, POST, CLOSED = "open", "pre", "post", "closed"
+
+
+class Exchange:
+    """Trading calendar for one exchange: local session times, weekends and holidays."""
+
+    def __init__(self, code, tz, open_time, close_time, pre_open=None, post_close=None,
+                 holidays=None, early_close=None, weekdays=range(5)):
+        self.code = code
+        self.tz = ZoneInfo(tz)
+        self.open_time = open_time
+        self.close_time = close_time
+        self.pre_open = pre_open or open_time
+        self.post_close = post_close or close_time
+        self._holidays = holidays
+        self._early_close = early_close
+        self.weekdays = set(weekdays)
+
+    def holidays(self, year: int) -> set:
+        days = set(self._holidays(year)) if self._holidays else set()
+        return days | _configured_holidays(self.code)
+
+    def is_trading_day(self, day: dt.date) -> bool:
+        return day.weekday() in self.weekdays and day not in self.holidays(day.year)
+
+    def close_on(self, day: dt.date) -> dt.time:
+        if self._early_close and day in self._early_close(day.year):
+            return dt.time(13, 0)
+        return self.close_time
+
+    def state(self, now: dt.datetime) -> str:
+        local = now.astimezone(self.tz)
+        day, t = local.date(), local.time()
+        if not self.is_trading_day(day):
+            return CLOSED
+        close = self.close_on(day)
+        if self.open_time <= t < close:
+            return OPEN
+        if self.pre_open <= t < self.open_time:
+            return PRE
+        if close <= t < max(close, self.post_close):
+            return POST
+        return CLOSED
+
+    def seconds_until_open(self, now: dt.datetime) -> float:
+        """Seconds until today's regular open (negative once it has passed)."""
+        local = now.astimezone(self.tz)
+        return (dt.datetime.combine(local.date(), self.open_time, tzinfo=self.tz) - local).total_seconds()
+
+    def next_session_start(self, now: dt.datetime) -> dt.datetime:
+        """Start of the next trading activity (pre-market if the exchange has one)."""
+        local = now.astimezone(self.tz)
+        day = local.date()
+        for _ in range(15):
+            if self.is_trading_day(day):
+                start = dt.datetime.combine(day, self.pre_open, tzinfo=self.tz)
+                if start > local:
+                    return start
+            day += dt.timedelta(days=1)
+        return local + dt.timedelta(seconds=MAX_CLOSED_TTL_SECONDS)
+
+
+class AlwaysOpen:
+    """Markets that trade around the clock (crypto)."""
+
+    code = "24X7"
+
+    def state(self, now: dt.datetime) -> str:
+        return OPEN
+
+
+# --- Holiday rules ---
+
+def _easter(year: int) -> dt.date:
+    """Gregorian Easter Sunday (anonymous Gregorian algorithm)."""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return dt.date(year, month, day + 1)
+
+
+def _nth_weekday(year: int, month: int, weekday: int, n: int) -> dt.date:
+    """n-th given weekday of a month; n=-1 for the last one."""
+    if n > 0:
+        first = dt.date(year, month, 1)
+        return first + dt.timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = dt.date(year + month // 12, month % 12 + 1, 1) - dt.timedelta(days=1)
+    return last - dt.timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def _observed(day: dt.date) -> dt.date:
+    """US rule: Saturday holidays move to Friday, Sunday holidays to Monday."""
+    if day.weekday() == 5:
+        return day - dt.timedelta(days=1)
+    if day.weekday() == 6:
+        return day + dt.timedelta(days=1)
+    return day
+
+
+@lru_cache(maxsize=32)
+def _us_holidays(year: int) -> frozenset:
+    days = {
+        _nth_weekday(year, 1, 0, 3),           # Martin Luther King Jr. Day
+        _nth_weekday(year, 2, 0, 3),           # Presidents' Day
+        _easter(year) - dt.timedelta(days=2),  # Good Friday
+        _nth_weekday(year, 5, 0, -1),          # Memorial Day
+        _observed(dt.date(year, 7, 4)),        # Independence Day
+        _nth_weekday(year, 9, 0, 1),           # Labor Day
+        _nth_weekday(year, 11, 3, 4),          # Thanksgiving
+        _observed(dt.date(year, 12, 25)),      # Christmas
+    }
+    # New Year's Day is not moved back to a Friday in December
+    new_year = dt.date(year, 1, 1)
+    if new_year.weekday() != 5:
+        days.add(_observed(new_year))
+    if year >= 2022:
+        days.add(_observed(dt.date(year, 6, 19)))  # Juneteenth
+    return frozenset(days)
+
+
+@lru_cache(maxsize=32)
+def _us_early_closes(year: int) -> frozenset:
+    days = {_nth_weekday(year, 11, 3, 4) + dt.timedelta(days=1)}  # Day after Thanksgiving
+    for day in (dt.date(year, 7, 3), dt.date(year, 12, 24)):
+        if day.weekday() < 5 and day not in _us_holidays(year):
+            days.add(day)
+    return frozenset(days)
+
+
+@lru_cache(maxsize=32)
+def _uk_holidays(year: int) -> frozenset:
+    easter = _easter(year)
+    new_year = dt.date(year, 1, 1)
+    if new_year.weekday() >= 5:
+        new_year += dt.timedelta(days=7 - new_year.weekday())
+    christmas, boxing = dt.date(year, 12, 25), dt.date(year, 12, 26)
+    if christmas.weekday() == 5:
+        christmas, boxing = christmas + dt.timedelta(days=2), boxing + dt.timedelta(days=2)
+    elif christmas.weekday() == 6:
+        christmas, boxing = christmas + dt.timedelta(days=1), boxing + dt.timedelta(days=1)
+    elif boxing.weekday() == 5:
+        boxing += dt.timedelta(days=2)
+    return frozenset({
+        new_year,
+        easter - dt.timedelta(days=2),  # Good Friday
+        easter + dt.timedelta(days=1),  # Easter Monday
+        _nth_weekday(year, 5, 0, 1),    # Early May bank holiday
+        _nth_weekday(year, 5, 0, -1),   # Spring bank holiday
+        _nth_weekday(year, 8, 0, -1),   # Summer bank holiday
+        christmas,
+        boxing,
+    })
+
+
+@lru_cache(maxsize=32)
+def _common_holidays(year: int) -> frozenset:
+    """New Year and Christmas, for exchanges whose other holidays are configured via env."""
+    return frozenset({dt.date(year, 1, 1), dt.date(year, 12, 25)})
+
+
+@lru_cache(maxsize=None)
+def _configured_holidays(code: str) -> frozenset:
+    """
+    Extra closures from MARKET_HOLIDAYS_<CODE>, e.g. MARKET_HOLIDAYS_NSE=2026-01-26,2026-03-03.
+    Used for exchanges whose holidays follow lunar or ad-hoc calendars.
+    """
+    raw = os.getenv(f"MARKET_HOLIDAYS_{code}", "")
+    return frozenset(dt.date.fromisoformat(d.strip()) for d in raw.split(",") if d.strip())
+
+
+EXCHANGES = {
+    "US": Exchange("US", "America/New_York", dt.time(9, 30), dt.time(16, 0), dt.time(4, 0), dt.time(20, 0),
+                   holidays=_us_holidays, early_close=_us_early_closes),
+    "LSE": Exchange("LSE", "Europe/London", dt.time(8, 0), dt.time(16, 30), holidays=_uk_holidays),
+    "XETRA": Exchange("XETRA", "Europe/Berlin", dt.time(9, 0), dt.time(17, 30), holidays=_common_holidays),
+    "NSE": Exchange("NSE", "Asia/Kolkata", dt.time(9, 15), dt.time(15, 30), dt.time(9, 0)),
+    "TSE": Exchange("TSE", "Asia/Tokyo", dt.time(9, 0), dt.time(15, 30), holidays=_common_holidays),
+    "HKEX": Exchange("HKEX", "Asia/Hong_Kong", dt.time(9, 30), dt.time(16, 0), holidays=_common_holidays),
+    "TSX": Exchange("TSX", "America/Toronto", dt.time(9, 30), dt.time(16, 0), holidays=_common_holidays),
+    "ASX": Exchange("ASX", "Australia/Sydney", dt.time(10, 0), dt.time(16, 0), holidays=_common_holidays),
+    # Spot FX trades around the clock on weekdays
+    "FX": Exchange("FX", "America/New_York", dt.time(0, 0), dt.time(23, 59, 59)),
+    "24X7": AlwaysOpen(),
+}
+
+# Yahoo ticker suffixes
+_SUFFIXES = {
+    ".NS": "NSE", ".BO": "NSE", ".L": "LSE", ".IL": "LSE", ".DE": "XETRA", ".F": "XETRA",
+    ".T": "TSE", ".HK": "HKEX", ".TO": "TSX", ".V": "TSX", ".AX": "ASX",
+}
+# Yahoo `exchange` codes found on quote records
+_YAHOO_EXCHANGES = {
+    "NMS": "US", "NGM": "US", "NCM": "US", "NYQ": "US", "ASE": "US", "PCX": "US", "BTS": "US", "NIM": "US", "PNK": "US",
+    "NSI": "NSE", "BSE": "NSE", "LSE": "LSE", "IOB": "LSE", "GER": "XETRA", "FRA": "XETRA", "JPX": "TSE",
+    "HKG": "HKEX", "TOR": "TSX", "VAN": "TSX", "ASX": "ASX", "CCC": "24X7", "CCY": "FX",
+}
+_INDEXES = {"^NSEI": "NSE", "^BSESN": "NSE", "^FTSE": "LSE", "^GDAXI": "XETRA", "^N225": "TSE", "^HSI": "HKEX", "^GSPTSE": "TSX", "^AXJO": "ASX"}
+
+
+def exchange_for(symbol: str = None, yahoo_exchange: str = None) -> str:
+    """Calendar code for a symbol, from its quote record's exchange if known, else its suffix."""
+    if yahoo_exchange and yahoo_exchange.upper() in _YAHOO_EXCHANGES:
+        return _YAHOO_EXCHANGES[yahoo_exchange.upper()]
+    symbol = (symbol or "").upper()
+    if symbol in _INDEXES:
+        return _INDEXES[symbol]
+    if symbol.endswith("=X"):
+        return "FX"
+    if symbol.endswith(("-USD", "-USDT", "-EUR")):
+        return "24X7"
+    dot = symbol.rfind(".")
+    if dot > 0 and symbol[dot:] in _SUFFIXES:
+        return _SUFFIXES[symbol[dot:]]
+    return "US"
+
+
+def market_state(exchange: str = "US", now: dt.datetime = None) -> str:
+    now = now or dt.datetime.now(dt.timezone.utc)
+    return EXCHANGES.get(exchange, EXCHANGES["US"]).state(now)
+
+
+def adaptive_ttl(base_ttl: float, symbol: str = None, exchange: str = None, now: dt.datetime = None) -> int:
+    """
+    TTL for market data given the trading calendar of its exchange.
+
+    - Regular session: `base_ttl`.
+    - Pre/post-market: `base_ttl` x EXTENDED_HOURS_TTL_FACTOR, but pre-market entries
+      never outlive the opening bell.
+    - Closed (overnight, weekends, holidays): until the next session starts,
+      capped at MAX_CLOSED_TTL_SECONDS and never below `base_ttl`.
+    """
+    now = now or dt.datetime.now(dt.timezone.utc)
+    calendar = EXCHANGES.get(exchange or exchange_for(symbol), EXCHANGES["US"])
+    state = calendar.state(now)
+    if state == OPEN:
+        return int(base_ttl)
+    if state == PRE:
+        until_open = calendar.seconds_until_open(now) + MARKET_OPEN_GRACE_SECONDS
+        return int(max(1, min(base_ttl * EXTENDED_HOURS_TTL_FACTOR, until_open)))
+    if state == POST:
+        return int(base_ttl * EXTENDED_HOURS_TTL_FACTOR)
+    until_open = (calendar.next_session_start(now) - now).total_seconds()
+    return int(max(base_ttl, min(until_open, MAX_CLOSED_TTL_SECONDS)))
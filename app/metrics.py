@@ -0,0 +1,152 @@
+import os
+import time
+from prometheus_client import (
+    CollectorRegistry, Counter, Histogram, REGISTRY, CONTENT_TYPE_LATEST,
+    generate_latest, multiprocess, start_http_server
+)
+from app.config import logger
+
+# Set (before start-up) for multi-process servers such as Celery prefork workers or
+# several uvicorn workers; every process then writes its samples under this directory.
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+_LONG_BUCKETS = (0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+_LAG_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+_TOKEN_BUCKETS = (100, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+
+WEBHOOK_ACK_SECONDS = Histogram(
+    "webhook_ack_seconds", "Time to acknowledge a WhatsApp webhook delivery", buckets=_LATENCY_BUCKETS)
+QUEUE_WAIT_SECONDS = Histogram(
+    "queue_wait_seconds", "Time a message waits before its agent turn starts", ["stage"], buckets=_LONG_BUCKETS)
+AGENT_RUN_SECONDS = Histogram(
+    "agent_run_seconds", "Duration of an agent turn", ["source"], buckets=_LONG_BUCKETS)
+FIRST_REPLY_SECONDS = Histogram(
+    "agent_first_reply_seconds", "Time from turn start to the first reply part sent", buckets=_LONG_BUCKETS)
+ROUTER_REQUESTS = Counter(
+    "router_requests_total", "Messages seen by the fast-path router", ["result"])
+TOOL_CALL_SECONDS = Histogram(
+    "tool_call_seconds", "Agent tool call latency", ["tool"], buckets=_LATENCY_BUCKETS)
+TOOL_ERRORS = Counter(
+    "tool_errors_total", "Agent tool calls that raised or returned an error", ["tool"])
+CACHE_REQUESTS = Counter(
+    "cache_requests_total", "Cache lookups by function and outcome (l1, hit, stale, miss)", ["function", "result"])
+UPSTREAM_CALLS = Counter(
+    "upstream_calls_total", "Calls to Yahoo Finance / yfinance by endpoint", ["endpoint"])
+WHATSAPP_SEND_SECONDS = Histogram(
+    "whatsapp_send_seconds", "Graph API message send latency", buckets=_LATENCY_BUCKETS)
+WHATSAPP_SENDS = Counter(
+    "whatsapp_sends_total", "Graph API message sends by HTTP status", ["status"])
+GEMINI_TOKENS = Counter(
+    "gemini_tokens_total", "Gemini tokens used", ["source", "kind"])
+TURN_TOKENS = Histogram(
+    "agent_turn_tokens", "Total Gemini tokens used per agent turn", ["source"], buckets=_TOKEN_BUCKETS)
+SCHEDULER_LAG_SECONDS = Histogram(
+    "scheduler_lag_seconds", "Delay between a reminder's due time and its delivery", ["kind"], buckets=_LAG_BUCKETS)
+REMINDERS_DISPATCHED = Counter(
+    "reminders_dispatched_total", "Due reminders handed to workers by the beat tick", ["kind"])
+RATE_LIMIT_EVENTS = Counter(
+    "rate_limit_events_total", "Token bucket waits and refusals", ["bucket", "priority", "outcome"])
+RATE_LIMIT_WAIT_SECONDS = Histogram(
+    "rate_limit_wait_seconds", "Time spent waiting for rate limit tokens", ["bucket", "priority"], buckets=_LONG_BUCKETS)
+CONTEXT_TOKENS = Histogram(
+    "agent_context_tokens", "Estimated history tokens sent per model call, after compaction", buckets=_TOKEN_BUCKETS)
+COMPACTIONS = Counter(
+    "context_compactions_total", "Model calls whose history was compacted, by action (truncated, dropped)", ["action"])
+TURN_PROMPT_TOKENS = Histogram(
+    "agent_turn_prompt_tokens", "Prompt tokens of the last model call in a turn (the context size)", ["source"], buckets=_TOKEN_BUCKETS)
+REMINDERS_DEFERRED = Counter(
+    "reminders_deferred_total", "Scheduled deliveries pushed back to leave budget for interactive traffic", ["kind"])
+
+
+class TurnUsage:
+    """Sums Gemini token usage over the events of one agent turn."""
+
+    def __init__(self, source: str):
+        self.source = source
+        self.prompt = 0
+        self.output = 0
+        self.last_prompt = 0
+
+    def add(self, event):
+        # Partial (streamed) events repeat usage that the closing event reports again
+        usage = getattr(event, "usage_metadata", None)
+        if usage is None or getattr(event, "partial", False):
+            return
+        self.prompt += usage.prompt_token_count or 0
+        self.last_prompt = usage.prompt_token_count or self.last_prompt
+        self.output += (usage.candidates_token_count or 0) + (getattr(usage, "thoughts_token_count", None) or 0)
+
+    def record(self):
+        GEMINI_TOKENS.labels(self.source, "prompt").inc(self.prompt)
+        GEMINI_TOKENS.labels(self.source, "output").inc(self.output)
+        TURN_TOKENS.labels(self.source).observe(self.prompt + self.output)
+        if self.last_prompt:
+            TURN_PROMPT_TOKENS.labels(self.source).observe(self.last_prompt)
+
+
+# --- ADK tool callbacks: latency and errors per tool ---
+
+_tool_started: dict[str, float] = {}
+
+
+def _call_key(tool, tool_context) -> str:
+    return getattr(tool_context, "function_call_id", None) or f"{tool.name}:{id(tool_context)}"
+
+
+def before_tool(tool, args, tool_context):
+    _tool_started[_call_key(tool, tool_context)] = time.perf_counter()
+    return None
+
+
+def after_tool(tool, args, tool_context, tool_response):
+    started = _tool_started.pop(_call_key(tool, tool_context), None)
+    if started is not None:
+        TOOL_CALL_SECONDS.labels(tool.name).observe(time.perf_counter() - started)
+    result = tool_response.get("result") if isinstance(tool_response, dict) else tool_response
+    if (isinstance(tool_response, dict) and tool_response.get("error")) or (isinstance(result, str) and result.startswith("Error")):
+        TOOL_ERRORS.labels(tool.name).inc()
+    return None
+
+
+def on_tool_error(tool, args, tool_context, error):
+    _tool_started.pop(_call_key(tool, tool_context), None)
+    TOOL_ERRORS.labels(tool.name).inc()
+    return None
+
+
+# --- Exposition ---
+
+def _registry():
+    if not PROMETHEUS_MULTIPROC_DIR:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render() -> tuple[bytes, str]:
+    """Current metrics in the Prometheus text format, and their content type."""
+    return generate_latest(_registry()), CONTENT_TYPE_LATEST
+
+
+def start_exporter(port: int):
+    """
+    Serves /metrics on `port` from this process, for Celery workers.
+    In multi-process mode, clears samples left by a previous run first.
+    """
+    if PROMETHEUS_MULTIPROC_DIR:
+        os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+        for name in os.listdir(PROMETHEUS_MULTIPROC_DIR):
+            if name.endswith(".db"):
+                os.remove(os.path.join(PROMETHEUS_MULTIPROC_DIR, name))
+    else:
+        logger.warning("PROMETHEUS_MULTIPROC_DIR is not set; pool processes' metrics won't be exported")
+    start_http_server(port, registry=_registry())
+    logger.info(f"Metrics exporter listening on :{port}")
+
+
+def process_exited(pid: int):
+    """Drops a dead worker process's live gauges (multi-process mode only)."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,343 @@
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+from app.config import logger
+from app import yahoo, ratelimit, tracing
+from app.metrics import UPSTREAM_CALLS
+from app.store import redis_client, get_async_redis
+from app.quotes import normalize_symbols
+from app.tickers import AMBIGUOUS_COMPANY_NAMES, COMPANY_TICKERS, KNOWN_TICKERS, WORD_TICKERS
+from app.cache import (
+    cached_call, async_cached_call, local_cache, entry_expiry, write_entry, try_lock, release_lock
+)
+
+# Articles are stored once, by ID, and indexed per ticker; searches are cached as lists of
+# article IDs under a normalized form of the query, so "Nvidia news", "nvda" and
+# "latest $NVDA headlines" share one upstream fetch and one set of articles.
+# How long a search's article list is served before it is refetched
+NEWS_TTL_SECONDS = int(os.getenv("NEWS_TTL_SECONDS", "900"))
+# Articles and ticker indexes outlive the searches that found them
+NEWS_ARTICLE_TTL_SECONDS = int(os.getenv("NEWS_ARTICLE_TTL_SECONDS", "86400"))
+# Newest articles kept per ticker
+NEWS_TICKER_INDEX_SIZE = int(os.getenv("NEWS_TICKER_INDEX_SIZE", "50"))
+# Articles requested per upstream search, and shown per reply
+NEWS_FETCH_COUNT = int(os.getenv("NEWS_FETCH_COUNT", "10"))
+NEWS_RESULTS = int(os.getenv("NEWS_RESULTS", "5"))
+
+ARTICLE_KEY_PREFIX = "news:a:"
+TICKER_INDEX_PREFIX = "news:t:"
+QUERY_KEY_PREFIX = "news:q:"
+
+_SEARCH_URL = f"{yahoo.YAHOO_QUERY2_URL}/v1/finance/search"
+
+# All-caps words that are not tickers
+_NOT_TICKERS = {"A", "I", "AI", "US", "USA", "UK", "EU", "ETF", "ETFS", "IPO", "CEO", "GDP", "CPI", "FED", "EPS", "AND", "OR", "THE"}
+_TICKER_RE = re.compile(r"(?<![\w$])\$?([A-Z][A-Z0-9]{0,5}(?:[.\-][A-Z]{1,3})?)\b")
+_WORD_RE = re.compile(r"[a-z0-9&]+(?:[.\-][a-z0-9]+)*")
+
+# Words that don't change what a news search is about
+_FILLER = {
+    "news", "latest", "recent", "new", "today", "todays", "this", "week", "update", "updates",
+    "headline", "headlines", "about", "on", "for", "of", "the", "a", "an", "and", "any", "what",
+    "whats", "is", "are", "me", "show", "get", "find", "stock", "stocks", "share", "shares",
+    "price", "market", "markets", "inc", "corp", "company",
+}
+# Words next to an ambiguous company name that show the company is meant
+_COMPANY_CONTEXT = {"stock", "stocks", "share", "shares"}
+
+
+def mentioned_tickers(text: str) -> list[str]:
+    """Tickers written in free text, e.g. 'NVDA and $AAPL earnings' -> ['NVDA', 'AAPL']."""
+    found = [sym for sym in _TICKER_RE.findall(text or "") if sym not in _NOT_TICKERS]
+    return normalize_symbols(found)
+
+
+def _word_ticker(word: str, signalled: bool = False) -> str | None:
+    """
+    Ticker for a lowercase word: a company name, or a known ticker that isn't an everyday word.
+    Names that are also everyday words ('visa', 'oracle') count only when `signalled`.
+    """
+    if word in COMPANY_TICKERS:
+        if word in AMBIGUOUS_COMPANY_NAMES and not signalled:
+            return None
+        return COMPANY_TICKERS[word]
+    symbol = word.upper()
+    if len(symbol) >= 3 and symbol in KNOWN_TICKERS and symbol not in WORD_TICKERS:
+        return symbol
+    return None
+
+
+def normalize_query(query: str) -> tuple[list[str], list[str]]:
+    """
+    Splits a news query into (tickers, keywords): written tickers, known tickers in any
+    case and company names become tickers, filler words are dropped and the remaining
+    words are sorted. 'Nvidia news', 'nvda' and 'latest $NVDA headlines' all give (['NVDA'], []).
+    """
+    # A company name in capitals ('VISA news') names the company, not a ticker of that spelling
+    tickers = normalize_symbols([
+        sym if sym in KNOWN_TICKERS else COMPANY_TICKERS.get(sym.lower(), sym) for sym in mentioned_tickers(query)
+    ])
+    all_words = _WORD_RE.findall((query or "").lower().replace("'s", ""))
+    capitalized = set(re.findall(r"\b[A-Z][A-Z&]+\b", query or ""))
+    words = set()
+    for i, word in enumerate(all_words):
+        if word.upper() in tickers or word in _FILLER:
+            continue
+        neighbours = set(all_words[max(0, i - 1):i]) | set(all_words[i + 1:i + 2])
+        symbol = _word_ticker(word, signalled=word.upper() in capitalized or bool(neighbours & _COMPANY_CONTEXT))
+        if symbol:
+            tickers += [symbol] if symbol not in tickers else []
+        else:
+            words.add(word)
+    if not tickers and not words:
+        # Nothing but filler ('market news today'): those words are the whole query
+        words = set(all_words)
+    return tickers, sorted(words)
+
+
+def _query_key(tickers: list[str], words: list[str]) -> str:
+    if not words:
+        return f"{QUERY_KEY_PREFIX}t:{','.join(tickers)}"
+    return f"{QUERY_KEY_PREFIX}{' '.join(sorted(t.lower() for t in tickers) + words)}"
+
+
+# --- Articles ---
+
+def _canonical_link(link: str) -> str:
+    return re.sub(r"^https?://(www\.)?", "", (link or "").split("?", 1)[0].split("#", 1)[0]).rstrip("/").lower()
+
+
+def _title_key(title: str) -> str:
+    return " ".join(_WORD_RE.findall((title or "").lower()))
+
+
+def _article(item: dict) -> dict | None:
+    """Compact record of a Yahoo search news item, or None if it has no title or link."""
+    if not item.get("title") or not item.get("link"):
+        return None
+    article_id = item.get("uuid") or hashlib.sha1(_canonical_link(item["link"]).encode()).hexdigest()[:16]
+    return {
+        "id": article_id,
+        "title": item["title"],
+        "publisher": item.get("publisher"),
+        "link": item["link"],
+        "published": item.get("providerPublishTime") or 0,
+        "tickers": normalize_symbols(item.get("relatedTickers") or []),
+    }
+
+
+def dedupe(articles: list[dict]) -> list[dict]:
+    """Drops repeats of an article: the same ID, the same link or the same headline. Keeps order."""
+    seen = set()
+    unique = []
+    for article in articles:
+        marks = {article["id"], _canonical_link(article["link"]), _title_key(article["title"])}
+        if marks & seen:
+            continue
+        seen |= marks
+        unique.append(article)
+    return unique
+
+
+def _newest_first(articles: list[dict]) -> list[dict]:
+    # Stable, so articles without a publish time keep the order Yahoo ranked them in
+    return sorted(articles, key=lambda a: a["published"], reverse=True)
+
+
+def _index_writes(pipe, articles: list[dict], tickers: list[str]):
+    """Queues the article records and their ticker index entries on a pipeline."""
+    indexed = set()
+    for article in articles:
+        pipe.set(f"{ARTICLE_KEY_PREFIX}{article['id']}", json.dumps(article), ex=NEWS_ARTICLE_TTL_SECONDS)
+        local_cache.set(f"{ARTICLE_KEY_PREFIX}{article['id']}", article, time.time() + NEWS_TTL_SECONDS)
+        # The searched tickers too: Yahoo doesn't always list them as related
+        for sym in set(article["tickers"]) | set(tickers):
+            pipe.zadd(f"{TICKER_INDEX_PREFIX}{sym}", {article["id"]: article["published"]})
+            indexed.add(sym)
+    for sym in indexed:
+        key = f"{TICKER_INDEX_PREFIX}{sym}"
+        pipe.zremrangebyrank(key, 0, -NEWS_TICKER_INDEX_SIZE - 1)
+        pipe.expire(key, NEWS_ARTICLE_TTL_SECONDS)
+
+
+def _parse_articles(ids: list[str], raw_entries: list, found: dict) -> list[dict]:
+    for article_id, raw in zip(ids, raw_entries):
+        if raw is not None:
+            found[article_id] = json.loads(raw)
+            local_cache.set(f"{ARTICLE_KEY_PREFIX}{article_id}", found[article_id], time.time() + NEWS_TTL_SECONDS)
+    return found
+
+
+def _local_articles(ids: list[str]) -> tuple[dict, list[str]]:
+    """Articles already in the L1 tier, and the IDs to read from Redis."""
+    found, remote = {}, []
+    for article_id in dict.fromkeys(ids):
+        article = local_cache.get(f"{ARTICLE_KEY_PREFIX}{article_id}")
+        if article is not None:
+            found[article_id] = article
+        else:
+            remote.append(article_id)
+    return found, remote
+
+
+def _load_articles(ids: list[str]) -> list[dict]:
+    found, remote = _local_articles(ids)
+    if remote:
+        _parse_articles(remote, redis_client.mget([f"{ARTICLE_KEY_PREFIX}{i}" for i in remote]), found)
+    return [found[i] for i in dict.fromkeys(ids) if i in found]
+
+
+# --- Searches ---
+
+def _upstream_query(tickers: list[str], words: list[str]) -> str:
+    return " ".join(tickers + words)
+
+
+def _store_search(items: list[dict], tickers: list[str]) -> list[str]:
+    """Stores a search's articles and returns their IDs, duplicates removed."""
+    articles = dedupe([a for a in map(_article, items or []) if a])
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        _index_writes(pipe, articles, tickers)
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"News store error: {e}")
+    return [a["id"] for a in articles]
+
+
+@tracing.traced("upstream", endpoint="search")
+def _fetch(tickers: list[str], words: list[str]) -> list[str]:
+    query = _upstream_query(tickers, words)
+    logger.info(f"Fetching news for {query}")
+    ratelimit.acquire_sync("yahoo")
+    UPSTREAM_CALLS.labels("search").inc()
+    import yfinance as yf
+    return _store_search(yf.Search(query, news_count=NEWS_FETCH_COUNT).news, tickers)
+
+
+def _search_ids(tickers: list[str], words: list[str]) -> list[str]:
+    """Article IDs for a normalized query: one cached search, or for bare tickers one per ticker."""
+    if words or not tickers:
+        return cached_call(_query_key(tickers, words), lambda: _fetch(tickers, words), NEWS_TTL_SECONDS, name="news")
+    ids = []
+    for sym in tickers:
+        ids += cached_call(_query_key([sym], []), lambda sym=sym: _fetch([sym], []), NEWS_TTL_SECONDS,
+                           name="news", track=sym)
+    return ids
+
+
+def _index_range(sym: str) -> tuple[str, int, int]:
+    return f"{TICKER_INDEX_PREFIX}{sym}", 0, NEWS_RESULTS * 3 - 1
+
+
+@tracing.traced("cache", function="news")
+def get_news(query: str, limit: int = NEWS_RESULTS) -> list[dict]:
+    """
+    Up to `limit` distinct articles for a query, newest first. Ticker queries also include
+    articles about those tickers that other searches found.
+    """
+    tickers, words = normalize_query(query)
+    if not tickers and not words:
+        return []
+    # A copy: the cached list may be the L1 tier's own object
+    ids = list(_search_ids(tickers, words))
+    if tickers and not words:
+        try:
+            for sym in tickers:
+                ids += [i.decode() for i in redis_client.zrevrange(*_index_range(sym))]
+        except Exception as e:
+            logger.error(f"News index error: {e}")
+    return dedupe(_newest_first(_load_articles(ids)))[:limit]
+
+
+def warm_news(tickers, ahead_seconds: float = 0) -> int:
+    """
+    Refetches news for tickers whose cached search is missing or expires within
+    `ahead_seconds`, skipping any another caller is refreshing. Returns the count refetched.
+    """
+    refreshed = 0
+    for sym in normalize_symbols(tickers):
+        cache_key = _query_key([sym], [])
+        expires_at = entry_expiry(cache_key)
+        if expires_at is not None and expires_at - time.time() > ahead_seconds:
+            continue
+        token = try_lock(cache_key)
+        if not token:
+            continue
+        try:
+            ids = _fetch([sym], [])
+            if ids:
+                write_entry(cache_key, ids, NEWS_TTL_SECONDS)
+            refreshed += 1
+        except Exception as e:
+            logger.error(f"News warm failed for {sym}: {e}")
+        finally:
+            release_lock(cache_key, token)
+    return refreshed
+
+
+# --- Asyncio path: the same keys, through redis.asyncio and the async Yahoo session ---
+
+async def _store_search_async(items: list[dict], tickers: list[str]) -> list[str]:
+    articles = dedupe([a for a in map(_article, items or []) if a])
+    try:
+        pipe = get_async_redis().pipeline(transaction=False)
+        _index_writes(pipe, articles, tickers)
+        await pipe.execute()
+    except Exception as e:
+        logger.error(f"News store error: {e}")
+    return [a["id"] for a in articles]
+
+
+@tracing.traced("upstream", endpoint="search")
+async def _fetch_async(tickers: list[str], words: list[str]) -> list[str]:
+    query = _upstream_query(tickers, words)
+    logger.info(f"Fetching news for {query}")
+    UPSTREAM_CALLS.labels("search").inc()
+    try:
+        data = await yahoo.get_json(_SEARCH_URL, {"q": query, "newsCount": NEWS_FETCH_COUNT, "quotesCount": 0})
+        items = data.get("news") or []
+    except Exception as e:
+        logger.warning(f"Async news search failed, falling back to yfinance: {e}")
+        import yfinance as yf
+        await ratelimit.acquire("yahoo")
+        items = (await asyncio.to_thread(yf.Search, query, news_count=NEWS_FETCH_COUNT)).news
+    return await _store_search_async(items, tickers)
+
+
+async def _search_ids_async(tickers: list[str], words: list[str]) -> list[str]:
+    if words or not tickers:
+        return await async_cached_call(_query_key(tickers, words), lambda: _fetch_async(tickers, words),
+                                       NEWS_TTL_SECONDS, name="news")
+    results = await asyncio.gather(*(
+        async_cached_call(_query_key([sym], []), lambda sym=sym: _fetch_async([sym], []), NEWS_TTL_SECONDS,
+                          name="news", track=sym)
+        for sym in tickers
+    ))
+    return [i for ids in results for i in ids]
+
+
+async def _load_articles_async(ids: list[str]) -> list[dict]:
+    found, remote = _local_articles(ids)
+    if remote:
+        raw_entries = await get_async_redis().mget([f"{ARTICLE_KEY_PREFIX}{i}" for i in remote])
+        _parse_articles(remote, raw_entries, found)
+    return [found[i] for i in dict.fromkeys(ids) if i in found]
+
+
+@tracing.traced("cache", function="news")
+async def get_news_async(query: str, limit: int = NEWS_RESULTS) -> list[dict]:
+    tickers, words = normalize_query(query)
+    if not tickers and not words:
+        return []
+    ids = list(await _search_ids_async(tickers, words))
+    if tickers and not words:
+        try:
+            indexed = await asyncio.gather(*(get_async_redis().zrevrange(*_index_range(sym)) for sym in tickers))
+            ids += [i.decode() for members in indexed for i in members]
+        except Exception as e:
+            logger.error(f"News index error: {e}")
+    return dedupe(_newest_first(await _load_articles_async(ids)))[:limit]
@@ -0,0 +1,90 @@
+import os
+import time
+import asyncio
+import threading
+from collections import Counter
+from app.config import logger
+from app.store import redis_client
+
+# Access counts are kept in hourly buckets; rankings combine the current and previous hour
+POPULARITY_BUCKET_SECONDS = 3600
+POPULARITY_KEY_PREFIX = "cache:pop:"
+# Counts are buffered in process and written to Redis at most this often
+POPULARITY_FLUSH_SECONDS = float(os.getenv("POPULARITY_FLUSH_SECONDS", "5"))
+# Each bucket keeps only its most accessed members; the long tail is trimmed on flush
+POPULARITY_MAX_MEMBERS = int(os.getenv("POPULARITY_MAX_MEMBERS", "500"))
+# Combined rankings are stored this long so repeated top() calls reuse one union
+POPULARITY_TOP_TTL_SECONDS = int(os.getenv("POPULARITY_TOP_TTL_SECONDS", "30"))
+
+_pending: Counter = Counter()
+_pending_lock = threading.Lock()
+_last_flush = time.monotonic()
+
+
+def _key(kind: str, outcome: str, bucket: int) -> str:
+    return f"{POPULARITY_KEY_PREFIX}{kind}:{bucket}:{outcome}"
+
+
+def track(kind: str, member: str, hit: bool):
+    """Counts one cache access (e.g. kind='quote', member='AAPL'). Cheap: no I/O on most calls."""
+    global _last_flush
+    with _pending_lock:
+        _pending[(kind, member, "hit" if hit else "miss")] += 1
+        if time.monotonic() - _last_flush < POPULARITY_FLUSH_SECONDS:
+            return
+        _last_flush = time.monotonic()
+    try:
+        # Called from a coroutine: keep the Redis write off the event loop
+        asyncio.get_running_loop().run_in_executor(None, flush)
+    except RuntimeError:
+        flush()
+
+
+def flush():
+    """Writes buffered counts to Redis."""
+    with _pending_lock:
+        counts = dict(_pending)
+        _pending.clear()
+    if not counts:
+        return
+    bucket = int(time.time() // POPULARITY_BUCKET_SECONDS)
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        touched = set()
+        for (kind, member, outcome), n in counts.items():
+            key = _key(kind, outcome, bucket)
+            pipe.zincrby(key, n, member)
+            touched.add(key)
+        for key in touched:
+            pipe.zremrangebyrank(key, 0, -POPULARITY_MAX_MEMBERS - 1)
+            pipe.expire(key, POPULARITY_BUCKET_SECONDS * 3)
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"Popularity flush failed: {e}")
+
+
+def _recent_keys(kind: str, outcomes=("hit", "miss")) -> list[str]:
+    bucket = int(time.time() // POPULARITY_BUCKET_SECONDS)
+    return [_key(kind, outcome, b) for b in (bucket, bucket - 1) for outcome in outcomes]
+
+
+def top(kind: str, n: int) -> list[str]:
+    """The `n` most accessed members of a kind over the last one to two hours."""
+    bucket = int(time.time() // POPULARITY_BUCKET_SECONDS)
+    union_key = f"{POPULARITY_KEY_PREFIX}{kind}:top:{bucket}"
+    # Redis merges and ranks the buckets; only the n members asked for come back
+    if not redis_client.exists(union_key):
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.zunionstore(union_key, _recent_keys(kind))
+        pipe.expire(union_key, POPULARITY_TOP_TTL_SECONDS)
+        pipe.execute()
+    return [member.decode() for member in redis_client.zrevrange(union_key, 0, n - 1)]
+
+
+def stats(kind: str) -> dict:
+    """Hit and miss totals for a kind over the last one to two hours."""
+    totals = {}
+    for outcome in ("hit", "miss"):
+        scores = redis_client.zunion(_recent_keys(kind, (outcome,)), withscores=True)
+        totals[outcome] = int(sum(score for _, score in scores))
+    return totals
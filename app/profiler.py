@@ -0,0 +1,87 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+from app.config import logger
+
+# Longest window an admin may profile in one go
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "120"))
+# Optional file the collapsed stacks are also written to when a window ends
+PROFILER_OUTPUT = os.getenv("PROFILER_OUTPUT")
+
+_lock = threading.Lock()
+_thread: threading.Thread | None = None
+_stop = threading.Event()
+_stacks: Counter = Counter()
+_info: dict = {}
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def _sample(seconds: float, interval: float):
+    own = threading.get_ident()
+    deadline = time.monotonic() + seconds
+    samples = 0
+    while not _stop.is_set() and time.monotonic() < deadline:
+        threads = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            _stacks[";".join([threads.get(ident, str(ident))] + stack[::-1])] += 1
+        samples += 1
+        _stop.wait(interval)
+    _info.update(running=False, samples=samples, finished_at=time.time())
+    logger.info(f"Profiler captured {samples} samples, {len(_stacks)} distinct stacks")
+    if PROFILER_OUTPUT:
+        try:
+            with open(PROFILER_OUTPUT, "w") as f:
+                f.write(collapsed())
+        except OSError as e:
+            logger.error(f"Could not write profile to {PROFILER_OUTPUT}: {e}")
+
+
+def start(seconds: float = 30, interval: float = 0.01):
+    """
+    Samples every thread's stack each `interval` seconds for `seconds` on a background thread.
+    Raises RuntimeError if a profile is already running.
+    """
+    global _thread
+    with _lock:
+        if running():
+            raise RuntimeError("A profile is already running")
+        seconds = max(0.1, min(seconds, PROFILER_MAX_SECONDS))
+        interval = max(0.001, interval)
+        _stacks.clear()
+        _stop.clear()
+        _info.clear()
+        _info.update(running=True, seconds=seconds, interval=interval, started_at=time.time())
+        _thread = threading.Thread(target=_sample, args=(seconds, interval), name="profiler", daemon=True)
+        _thread.start()
+        logger.info(f"Profiler started for {seconds}s every {interval * 1000:.0f}ms")
+
+
+def stop():
+    _stop.set()
+    if _thread is not None:
+        _thread.join()
+
+
+def running() -> bool:
+    return _thread is not None and _thread.is_alive()
+
+
+def status() -> dict:
+    return dict(_info, stacks=len(_stacks))
+
+
+def collapsed() -> str:
+    """Stacks in the collapsed "frame;frame;frame count" format read by flamegraph.pl and speedscope."""
+    return "".join(f"{stack} {count}\n" for stack, count in _stacks.most_common())
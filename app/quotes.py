@@ -0,0 +1,453 @@
+import os
+import re
+import json
+import time
+import asyncio
+import contextvars
+from app.config import logger
+from app import yahoo
+from app.market_hours import adaptive_ttl, exchange_for
+from app import popularity, tracing, ratelimit
+from app.metrics import CACHE_REQUESTS, UPSTREAM_CALLS
+from app.store import redis_client, get_async_redis
+from app.cache import (
+    try_lock, release_lock, is_locked, cached_call, local_cache, refresh_pool,
+    async_cached_call, try_lock_async, release_lock_async, spawn,
+    CACHE_STALE_FACTOR, CACHE_LOCK_WAIT_SECONDS
+)
+
+# In-session TTL; off-hours quotes live until their exchange reopens (see app.market_hours)
+QUOTE_TTL_SECONDS = int(os.getenv("QUOTE_TTL_SECONDS", "60"))
+# Business summary and growth figures change rarely
+PROFILE_TTL_SECONDS = int(os.getenv("PROFILE_TTL_SECONDS", "86400"))
+# Unknown symbols are remembered briefly so they don't trigger a refetch on every request
+MISSING_TTL_SECONDS = 300
+
+QUOTE_KEY_PREFIX = "quote:"
+PROFILE_KEY_PREFIX = "quote:profile:"
+
+_QUOTE_URL = f"{yahoo.YAHOO_QUERY1_URL}/v7/finance/quote"
+_SUMMARY_URL = f"{yahoo.YAHOO_QUERY2_URL}/v10/finance/quoteSummary"
+_SYMBOL_RE = re.compile(r"^[A-Z0-9^][A-Z0-9.\-=^]{0,14}$")
+
+
+def normalize_symbols(symbols) -> list[str]:
+    """
+    Upper-cases, strips '$' and separators, validates and de-duplicates tickers, keeping order.
+    Accepts a space/comma separated string or an iterable of symbols.
+    """
+    if isinstance(symbols, str):
+        symbols = re.split(r"[\s,;]+", symbols)
+    seen = []
+    for sym in symbols:
+        sym = sym.strip().lstrip("$").upper()
+        if sym and _SYMBOL_RE.match(sym) and sym not in seen:
+            seen.append(sym)
+    return seen
+
+
+def _record_from_quote(raw: dict) -> dict:
+    """Builds a quote record from a v7 /quote result."""
+    return {
+        "symbol": raw.get("symbol"),
+        "name": raw.get("shortName") or raw.get("longName"),
+        "price": raw.get("regularMarketPrice"),
+        "currency": raw.get("currency", "USD"),
+        "day_high": raw.get("regularMarketDayHigh"),
+        "day_low": raw.get("regularMarketDayLow"),
+        "change_percent": raw.get("regularMarketChangePercent"),
+        "market_cap": raw.get("marketCap"),
+        "exchange": raw.get("exchange"),
+        "market_state": raw.get("marketState"),
+    }
+
+
+def _record_from_info(symbol: str, info: dict) -> dict:
+    """Builds a quote record from a Ticker.info dict."""
+    return {
+        "symbol": symbol,
+        "name": info.get("shortName") or info.get("longName"),
+        "price": info.get("currentPrice") or info.get("regularMarketPrice"),
+        "currency": info.get("currency", "USD"),
+        "day_high": info.get("dayHigh"),
+        "day_low": info.get("dayLow"),
+        "change_percent": info.get("regularMarketChangePercent"),
+        "market_cap": info.get("marketCap"),
+        "exchange": info.get("exchange"),
+        "market_state": info.get("marketState"),
+    }
+
+
+@tracing.traced("upstream", endpoint="quote")
+def fetch_quotes_bulk(symbols: list[str]) -> dict[str, dict]:
+    """
+    Fetches quote records for many symbols in one upstream request.
+    Falls back to per-symbol .info lookups if the bulk endpoint is unavailable.
+    """
+    if not symbols:
+        return {}
+    logger.info(f"Fetching quotes for {len(symbols)} symbols: {' '.join(symbols)}")
+    try:
+        from yfinance.data import YfData
+        ratelimit.acquire_sync("yahoo")
+        UPSTREAM_CALLS.labels("quote").inc()
+        data = YfData().get_raw_json(_QUOTE_URL, params={"symbols": ",".join(symbols), "formatted": "false"})
+        results = data.get("quoteResponse", {}).get("result") or []
+        return {r["symbol"].upper(): _record_from_quote(r) for r in results if r.get("symbol")}
+    except Exception as e:
+        logger.warning(f"Bulk quote request failed, falling back to per-symbol lookups: {e}")
+
+    import yfinance as yf
+    records = {}
+    tickers = yf.Tickers(" ".join(symbols))
+    for sym in symbols:
+        try:
+            ratelimit.acquire_sync("yahoo")
+            UPSTREAM_CALLS.labels("info").inc()
+            info = tickers.tickers[sym].info
+            if info and (info.get("currentPrice") or info.get("regularMarketPrice")) is not None:
+                records[sym] = _record_from_info(sym, info)
+        except Exception as e:
+            logger.error(f"Error fetching data for {sym}: {e}")
+    return records
+
+
+def _quote_entries(records: dict[str, dict], missing: list[str] = ()):
+    """Yields (symbol, record, soft expiry, Redis TTL) for records to cache."""
+    now = time.time()
+    for sym, record in records.items():
+        ttl = adaptive_ttl(QUOTE_TTL_SECONDS, exchange=exchange_for(sym, record.get("exchange")))
+        yield sym, record, now + ttl, int(ttl + QUOTE_TTL_SECONDS * CACHE_STALE_FACTOR)
+    for sym in missing:
+        yield sym, {"symbol": sym, "missing": True}, now + MISSING_TTL_SECONDS, MISSING_TTL_SECONDS
+
+
+def _store_quotes(records: dict[str, dict], missing: list[str] = ()):
+    pipe = redis_client.pipeline(transaction=False)
+    for sym, record, expires_at, ex in _quote_entries(records, missing):
+        pipe.set(f"{QUOTE_KEY_PREFIX}{sym}", json.dumps({"v": record, "exp": expires_at}), ex=ex)
+        local_cache.set(f"{QUOTE_KEY_PREFIX}{sym}", record, expires_at)
+    pipe.execute()
+
+
+def _read_quotes(symbols: list[str]) -> dict[str, tuple[dict, bool]]:
+    """Returns {symbol: (record, is_fresh)} for cached symbols, checking the L1 tier before Redis."""
+    found = {}
+    remote = []
+    for sym in symbols:
+        record = local_cache.get(f"{QUOTE_KEY_PREFIX}{sym}")
+        if record is not None:
+            found[sym] = (record, True)
+        else:
+            remote.append(sym)
+    if not remote:
+        return found
+
+    now = time.time()
+    for sym, raw in zip(remote, redis_client.mget([f"{QUOTE_KEY_PREFIX}{sym}" for sym in remote])):
+        if raw is not None:
+            entry = json.loads(raw)
+            fresh = now < entry["exp"]
+            if fresh:
+                local_cache.set(f"{QUOTE_KEY_PREFIX}{sym}", entry["v"], entry["exp"])
+            found[sym] = (entry["v"], fresh)
+    return found
+
+
+def _track_lookups(symbols: list[str], cached: dict[str, tuple[dict, bool]]):
+    tracing.annotate(symbols=len(symbols), hits=len(cached))
+    for sym in symbols:
+        popularity.track("quote", sym, hit=sym in cached)
+        result = "miss" if sym not in cached else "hit" if cached[sym][1] else "stale"
+        CACHE_REQUESTS.labels("quote", result).inc()
+
+
+def _lock_symbols(symbols: list[str]) -> dict[str, str]:
+    """Takes refresh locks for the symbols no other caller is fetching. Returns {symbol: token}."""
+    tokens = {}
+    for sym in symbols:
+        token = try_lock(f"{QUOTE_KEY_PREFIX}{sym}")
+        if token:
+            tokens[sym] = token
+    return tokens
+
+
+def _refresh_locked(tokens: dict[str, str]) -> dict[str, dict]:
+    """Fetches the locked symbols in one bulk call, caches them and releases their locks."""
+    try:
+        fetched = fetch_quotes_bulk(list(tokens))
+        try:
+            _store_quotes(fetched, [sym for sym in tokens if sym not in fetched])
+        except Exception as e:
+            logger.error(f"Quote cache error: {e}")
+        return fetched
+    finally:
+        for sym, token in tokens.items():
+            try:
+                release_lock(f"{QUOTE_KEY_PREFIX}{sym}", token)
+            except Exception as e:
+                logger.error(f"Quote cache error: {e}")
+
+
+@tracing.traced("cache", function="quote")
+def get_quotes(symbols) -> dict[str, dict | None]:
+    """
+    Returns {symbol: record} for normalized symbols, None for unknown ones.
+
+    Cached per symbol. Stale records are served while one caller refreshes them in the
+    background; misses are fetched together in a single upstream call by whichever caller
+    holds each symbol's refresh lock, while concurrent callers wait for that result.
+    """
+    symbols = normalize_symbols(symbols)
+    if not symbols:
+        return {}
+
+    try:
+        cached = _read_quotes(symbols)
+    except Exception as e:
+        logger.error(f"Quote cache error: {e}")
+        fetched = fetch_quotes_bulk(symbols)
+        return {sym: fetched.get(sym) for sym in symbols}
+
+    _track_lookups(symbols, cached)
+
+    quotes = {sym: record for sym, (record, _) in cached.items()}
+    stale = [sym for sym, (_, fresh) in cached.items() if not fresh]
+    misses = [sym for sym in symbols if sym not in cached]
+
+    try:
+        if stale:
+            stale_tokens = _lock_symbols(stale)
+            if stale_tokens:
+                refresh_pool.submit(contextvars.copy_context().run, _refresh_locked, stale_tokens)
+
+        if misses:
+            tokens = _lock_symbols(misses)
+            if tokens:
+                quotes.update(_refresh_locked(tokens))
+                for sym in tokens:
+                    quotes.setdefault(sym, {"missing": True})
+
+            # Symbols another caller is already fetching: wait for its result
+            waiting = [sym for sym in misses if sym not in tokens]
+            deadline = time.monotonic() + CACHE_LOCK_WAIT_SECONDS
+            while waiting and time.monotonic() < deadline:
+                time.sleep(0.05)
+                for sym, (record, _) in _read_quotes(waiting).items():
+                    quotes[sym] = record
+                waiting = [sym for sym in waiting if sym not in quotes and is_locked(f"{QUOTE_KEY_PREFIX}{sym}")]
+            leftover = [sym for sym in misses if sym not in quotes]
+            if leftover:
+                quotes.update(fetch_quotes_bulk(leftover))
+    except Exception as e:
+        logger.error(f"Quote cache error: {e}")
+        leftover = [sym for sym in misses if sym not in quotes]
+        if leftover:
+            quotes.update(fetch_quotes_bulk(leftover))
+
+    return {sym: None if (quotes.get(sym) or {}).get("missing") else quotes.get(sym) for sym in symbols}
+
+
+def warm_quotes(symbols, ahead_seconds: float = 0, batch_size: int = 50) -> int:
+    """
+    Refreshes quotes that are missing or expire within `ahead_seconds`, in bulk requests of
+    up to `batch_size` symbols. Symbols another caller is refreshing are skipped. Returns the count refetched.
+    """
+    symbols = normalize_symbols(symbols)
+    if not symbols:
+        return 0
+    now = time.time()
+    raw = redis_client.mget([f"{QUOTE_KEY_PREFIX}{sym}" for sym in symbols])
+    due = []
+    for sym, entry in zip(symbols, raw):
+        if entry is not None:
+            entry = json.loads(entry)
+            # Unknown symbols are left to expire; fresh ones don't need a refetch yet
+            if entry["v"].get("missing") or entry["exp"] - now > ahead_seconds:
+                continue
+        due.append(sym)
+    refreshed = 0
+    for i in range(0, len(due), batch_size):
+        tokens = _lock_symbols(due[i:i + batch_size])
+        if tokens:
+            _refresh_locked(tokens)
+            refreshed += len(tokens)
+    return refreshed
+
+
+@tracing.traced("upstream", endpoint="info")
+def _fetch_profile(symbol: str) -> dict:
+    logger.info(f"Fetching profile for {symbol}")
+    ratelimit.acquire_sync("yahoo")
+    UPSTREAM_CALLS.labels("info").inc()
+    import yfinance as yf
+    info = yf.Ticker(symbol).info or {}
+    if (info.get("currentPrice") or info.get("regularMarketPrice")) is not None:
+        try:
+            _store_quotes({symbol: _record_from_info(symbol, info)})
+        except Exception as e:
+            logger.error(f"Quote cache error: {e}")
+    return {
+        "summary": info.get("longBusinessSummary", "No summary available."),
+        "revenue_growth": info.get("revenueGrowth", "N/A"),
+    }
+
+
+@tracing.traced("cache", function="get_profile")
+def get_profile(symbol: str) -> dict:
+    """
+    Returns slow-changing company details (summary, revenue growth) for one symbol.
+    A profile miss costs one .info lookup, which also refreshes the symbol's quote record.
+    """
+    symbol = symbol.strip().lstrip("$").upper()
+    return cached_call(f"{PROFILE_KEY_PREFIX}{symbol}", lambda: _fetch_profile(symbol), PROFILE_TTL_SECONDS, name="get_profile")
+
+
+# --- Asyncio path: same cache entries and locks, non-blocking Redis and HTTP ---
+
+@tracing.traced("upstream", endpoint="quote")
+async def fetch_quotes_bulk_async(symbols: list[str]) -> dict[str, dict]:
+    """fetch_quotes_bulk over the async Yahoo session; falls back to yfinance in a thread."""
+    if not symbols:
+        return {}
+    logger.info(f"Fetching quotes for {len(symbols)} symbols: {' '.join(symbols)}")
+    try:
+        UPSTREAM_CALLS.labels("quote").inc()
+        data = await yahoo.get_json(_QUOTE_URL, {"symbols": ",".join(symbols), "formatted": "false"}, crumb=True)
+        results = data.get("quoteResponse", {}).get("result") or []
+        return {r["symbol"].upper(): _record_from_quote(r) for r in results if r.get("symbol")}
+    except Exception as e:
+        logger.warning(f"Async quote request failed, falling back to yfinance: {e}")
+    return await asyncio.to_thread(fetch_quotes_bulk, symbols)
+
+
+async def _store_quotes_async(records: dict[str, dict], missing: list[str] = ()):
+    pipe = get_async_redis().pipeline(transaction=False)
+    for sym, record, expires_at, ex in _quote_entries(records, missing):
+        pipe.set(f"{QUOTE_KEY_PREFIX}{sym}", json.dumps({"v": record, "exp": expires_at}), ex=ex)
+        local_cache.set(f"{QUOTE_KEY_PREFIX}{sym}", record, expires_at)
+    await pipe.execute()
+
+
+async def _read_quotes_async(symbols: list[str]) -> dict[str, tuple[dict, bool]]:
+    found = {}
+    remote = []
+    for sym in symbols:
+        record = local_cache.get(f"{QUOTE_KEY_PREFIX}{sym}")
+        if record is not None:
+            found[sym] = (record, True)
+        else:
+            remote.append(sym)
+    if not remote:
+        return found
+
+    now = time.time()
+    raw_entries = await get_async_redis().mget([f"{QUOTE_KEY_PREFIX}{sym}" for sym in remote])
+    for sym, raw in zip(remote, raw_entries):
+        if raw is not None:
+            entry = json.loads(raw)
+            fresh = now < entry["exp"]
+            if fresh:
+                local_cache.set(f"{QUOTE_KEY_PREFIX}{sym}", entry["v"], entry["exp"])
+            found[sym] = (entry["v"], fresh)
+    return found
+
+
+async def _lock_symbols_async(symbols: list[str]) -> dict[str, str]:
+    tokens = await asyncio.gather(*(try_lock_async(f"{QUOTE_KEY_PREFIX}{sym}") for sym in symbols))
+    return {sym: token for sym, token in zip(symbols, tokens) if token}
+
+
+async def _refresh_locked_async(tokens: dict[str, str]) -> dict[str, dict]:
+    try:
+        fetched = await fetch_quotes_bulk_async(list(tokens))
+        try:
+            await _store_quotes_async(fetched, [sym for sym in tokens if sym not in fetched])
+        except Exception as e:
+            logger.error(f"Quote cache error: {e}")
+        return fetched
+    finally:
+        try:
+            await asyncio.gather(*(release_lock_async(f"{QUOTE_KEY_PREFIX}{sym}", token) for sym, token in tokens.items()))
+        except Exception as e:
+            logger.error(f"Quote cache error: {e}")
+
+
+@tracing.traced("cache", function="quote")
+async def get_quotes_async(symbols) -> dict[str, dict | None]:
+    """Asyncio twin of get_quotes."""
+    symbols = normalize_symbols(symbols)
+    if not symbols:
+        return {}
+
+    try:
+        cached = await _read_quotes_async(symbols)
+    except Exception as e:
+        logger.error(f"Quote cache error: {e}")
+        fetched = await fetch_quotes_bulk_async(symbols)
+        return {sym: fetched.get(sym) for sym in symbols}
+    _track_lookups(symbols, cached)
+
+    quotes = {sym: record for sym, (record, _) in cached.items()}
+    stale = [sym for sym, (_, fresh) in cached.items() if not fresh]
+    misses = [sym for sym in symbols if sym not in cached]
+
+    try:
+        if stale:
+            stale_tokens = await _lock_symbols_async(stale)
+            if stale_tokens:
+                spawn(_refresh_locked_async(stale_tokens))
+
+        if misses:
+            tokens = await _lock_symbols_async(misses)
+            if tokens:
+                quotes.update(await _refresh_locked_async(tokens))
+                for sym in tokens:
+                    quotes.setdefault(sym, {"missing": True})
+
+            waiting = [sym for sym in misses if sym not in tokens]
+            deadline = time.monotonic() + CACHE_LOCK_WAIT_SECONDS
+            client = get_async_redis()
+            while waiting and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+                for sym, (record, _) in (await _read_quotes_async(waiting)).items():
+                    quotes[sym] = record
+                waiting = [sym for sym in waiting
+                           if sym not in quotes and await client.exists(f"lock:{QUOTE_KEY_PREFIX}{sym}")]
+            leftover = [sym for sym in misses if sym not in quotes]
+            if leftover:
+                quotes.update(await fetch_quotes_bulk_async(leftover))
+    except Exception as e:
+        logger.error(f"Quote cache error: {e}")
+        leftover = [sym for sym in misses if sym not in quotes]
+        if leftover:
+            quotes.update(await fetch_quotes_bulk_async(leftover))
+
+    return {sym: None if (quotes.get(sym) or {}).get("missing") else quotes.get(sym) for sym in symbols}
+
+
+@tracing.traced("upstream", endpoint="info")
+async def _fetch_profile_async(symbol: str) -> dict:
+    """_fetch_profile over the async Yahoo session (quoteSummary); falls back to yfinance in a thread."""
+    try:
+        UPSTREAM_CALLS.labels("info").inc()
+        data = await yahoo.get_json(f"{_SUMMARY_URL}/{symbol}", {"modules": "assetProfile,financialData"}, crumb=True)
+        result = (data.get("quoteSummary", {}).get("result") or [{}])[0]
+        growth = (result.get("financialData") or {}).get("revenueGrowth")
+        if isinstance(growth, dict):
+            growth = growth.get("raw")
+        return {
+            "summary": (result.get("assetProfile") or {}).get("longBusinessSummary", "No summary available."),
+            "revenue_growth": "N/A" if growth is None else growth,
+        }
+    except Exception as e:
+        logger.warning(f"Async profile request failed, falling back to yfinance: {e}")
+    return await asyncio.to_thread(_fetch_profile, symbol)
+
+
+@tracing.traced("cache", function="get_profile")
+async def get_profile_async(symbol: str) -> dict:
+    """Asyncio twin of get_profile, sharing its cache entries."""
+    symbol = symbol.strip().lstrip("$").upper()
+    return await async_cached_call(f"{PROFILE_KEY_PREFIX}{symbol}", lambda: _fetch_profile_async(symbol),
+                                   PROFILE_TTL_SECONDS, name="get_profile")
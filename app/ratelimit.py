@@ -0,0 +1,223 @@
+import os
+import time
+import random
+import asyncio
+import contextvars
+from app.config import logger
+from app.store import redis_client, get_async_redis
+from app.metrics import RATE_LIMIT_EVENTS, RATE_LIMIT_WAIT_SECONDS
+
+# Token buckets shared through Redis by every API replica and Celery worker:
+#   user:<phone>  agent turns one person may start
+#   global        agent turns across everyone
+#   gemini        model calls (one per LLM round trip, so a tool-using turn takes several)
+#   yahoo         Yahoo Finance requests, through the async session or yfinance
+#   graph         WhatsApp Graph API posts
+# Each is "<requests per minute>/<burst>"; a rate of 0 switches the bucket off.
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+LIMITS = {
+    "user": os.getenv("RATE_LIMIT_USER", "10/5"),
+    "global": os.getenv("RATE_LIMIT_GLOBAL", "600/100"),
+    "gemini": os.getenv("RATE_LIMIT_GEMINI", "1000/100"),
+    "yahoo": os.getenv("RATE_LIMIT_YAHOO", "300/30"),
+    "graph": os.getenv("RATE_LIMIT_GRAPH", "4800/80"),
+}
+# Share of each shared bucket that only interactive work may spend: scheduled work
+# is held back (and deferred) once the bucket falls to this level
+RATE_LIMIT_INTERACTIVE_RESERVE = float(os.getenv("RATE_LIMIT_INTERACTIVE_RESERVE", "0.3"))
+# How long work may wait for tokens before it gives up (interactive) or is deferred (scheduled)
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("RATE_LIMIT_MAX_WAIT_SECONDS", "10"))
+RATE_LIMIT_SCHEDULED_MAX_WAIT_SECONDS = float(os.getenv("RATE_LIMIT_SCHEDULED_MAX_WAIT_SECONDS", "60"))
+KEY_PREFIX = "ratelimit:"
+
+INTERACTIVE = "interactive"
+SCHEDULED = "scheduled"
+
+SLOW_DOWN_MESSAGE = "🐢 You're sending messages faster than I can answer. Give me a moment and try again."
+
+_priority: contextvars.ContextVar[str] = contextvars.ContextVar("rate_limit_priority", default=INTERACTIVE)
+
+# All-or-nothing take across several buckets, timed by the Redis clock so every
+# process agrees. ARGV: per key, (tokens per second, burst, floor, cost); a cost of 0
+# checks that a token is available without spending it.
+# Returns {0, 0} when taken, else {seconds to wait as a string, index of the limiting key}.
+_TAKE = redis_client.register_script("""
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local levels = {}
+local wait, limiting = 0, 0
+for i, key in ipairs(KEYS) do
+    local rate, burst = tonumber(ARGV[i * 4 - 3]), tonumber(ARGV[i * 4 - 2])
+    local floor, cost = tonumber(ARGV[i * 4 - 1]), tonumber(ARGV[i * 4])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or burst
+    local elapsed = math.max(0, now - (tonumber(state[2]) or now))
+    tokens = math.min(burst, tokens + elapsed * rate)
+    levels[i] = tokens
+    local short = math.max(cost, 1) + floor - tokens
+    if short > 0 and short / rate > wait then
+        wait, limiting = short / rate, i
+    end
+end
+if wait > 0 then
+    return {tostring(wait), limiting}
+end
+for i, key in ipairs(KEYS) do
+    local rate, burst, cost = tonumber(ARGV[i * 4 - 3]), tonumber(ARGV[i * 4 - 2]), tonumber(ARGV[i * 4])
+    if cost > 0 then
+        redis.call('HSET', key, 'tokens', levels[i] - cost, 'ts', now)
+        redis.call('PEXPIRE', key, math.ceil(burst / rate * 1000) + 1000)
+    end
+end
+return {0, 0}
+""")
+
+
+class RateLimited(Exception):
+    """Raised when a bucket has no tokens within the caller's wait budget."""
+
+    def __init__(self, bucket: str, retry_after: float):
+        super().__init__(f"Rate limited on {bucket}; retry in {retry_after:.1f}s")
+        self.bucket = bucket
+        self.retry_after = retry_after
+
+    def defer_seconds(self) -> float:
+        """When deferred work should come back: spread out so it doesn't return all at once."""
+        return self.retry_after * (1 + random.random()) + 1
+
+
+def _parse(limit: str) -> tuple[float, float]:
+    rate, _, burst = limit.partition("/")
+    rate = float(rate) / 60
+    return rate, float(burst) if burst else max(1.0, rate * 60)
+
+
+_BUCKETS = {name: _parse(limit) for name, limit in LIMITS.items()}
+
+
+def set_priority(level: str):
+    """Sets the priority of the current context, and of the asyncio tasks and threads it starts."""
+    _priority.set(level)
+
+
+def current_priority() -> str:
+    return _priority.get()
+
+
+def _script_args(buckets: dict[str, float], level: str) -> tuple[list, list]:
+    """Keys and ARGV for the buckets (name -> cost) that are switched on."""
+    keys, argv = [], []
+    for bucket, cost in buckets.items():
+        rate, burst = _BUCKETS[bucket.split(":", 1)[0]]
+        if rate <= 0:
+            continue
+        # Per-user buckets belong to one person; only shared buckets keep a reserve
+        shared = ":" not in bucket
+        floor = burst * RATE_LIMIT_INTERACTIVE_RESERVE if shared and level != INTERACTIVE else 0
+        keys.append(KEY_PREFIX + bucket)
+        argv += [rate, burst, floor, cost]
+    return keys, argv
+
+
+def _normalize(buckets) -> dict[str, float]:
+    return {buckets: 1} if isinstance(buckets, str) else dict(buckets)
+
+
+def _max_wait(level: str, max_wait: float | None) -> float:
+    if max_wait is not None:
+        return max_wait
+    return RATE_LIMIT_MAX_WAIT_SECONDS if level == INTERACTIVE else RATE_LIMIT_SCHEDULED_MAX_WAIT_SECONDS
+
+
+def _record(bucket: str, level: str, outcome: str, waited: float = 0.0):
+    RATE_LIMIT_EVENTS.labels(bucket.split(":", 1)[0], level, outcome).inc()
+    if waited:
+        RATE_LIMIT_WAIT_SECONDS.labels(bucket.split(":", 1)[0], level).observe(waited)
+
+
+async def acquire(buckets, max_wait: float = None):
+    """
+    Takes tokens from every bucket at once (a name, or {name: cost}; cost 0 only checks),
+    waiting up to `max_wait` seconds for them. Raises RateLimited past that.
+    Fails open when Redis is unavailable.
+    """
+    if not RATE_LIMIT_ENABLED:
+        return
+    level = current_priority()
+    keys, argv = _script_args(_normalize(buckets), level)
+    if not keys:
+        return
+    max_wait, started, limited_by = _max_wait(level, max_wait), time.monotonic(), None
+    while True:
+        try:
+            result = await get_async_redis().eval(_TAKE.script, len(keys), *keys, *argv)
+        except Exception as e:
+            logger.error(f"Rate limiter unavailable: {e}")
+            return
+        wait = float(result[0])
+        if not wait:
+            if limited_by:
+                _record(limited_by, level, "waited", time.monotonic() - started)
+            return
+        limited_by = keys[int(result[1]) - 1][len(KEY_PREFIX):]
+        if time.monotonic() - started + wait > max_wait:
+            _record(limited_by, level, "limited")
+            raise RateLimited(limited_by, wait)
+        await asyncio.sleep(wait)
+
+
+def acquire_sync(buckets, max_wait: float = None):
+    """acquire() for threads (yfinance calls, Celery tasks); blocks while it waits."""
+    if not RATE_LIMIT_ENABLED:
+        return
+    level = current_priority()
+    keys, argv = _script_args(_normalize(buckets), level)
+    if not keys:
+        return
+    max_wait, started, limited_by = _max_wait(level, max_wait), time.monotonic(), None
+    while True:
+        try:
+            result = _TAKE(keys=keys, args=argv)
+        except Exception as e:
+            logger.error(f"Rate limiter unavailable: {e}")
+            return
+        wait = float(result[0])
+        if not wait:
+            if limited_by:
+                _record(limited_by, level, "waited", time.monotonic() - started)
+            return
+        limited_by = keys[int(result[1]) - 1][len(KEY_PREFIX):]
+        if time.monotonic() - started + wait > max_wait:
+            _record(limited_by, level, "limited")
+            raise RateLimited(limited_by, wait)
+        time.sleep(wait)
+
+
+async def start_turn(user_id: str = None):
+    """
+    Admits one agent turn. Interactive turns spend the user's and the global budget,
+    waiting briefly if needed. Scheduled turns spend the global budget but don't wait:
+    if the global or Gemini budget is down to the interactive reserve they raise
+    RateLimited at once so the caller can defer them.
+    """
+    if current_priority() == INTERACTIVE:
+        buckets = {"global": 1}
+        if user_id:
+            buckets[f"user:{user_id}"] = 1
+        await acquire(buckets)
+    else:
+        await acquire({"global": 1, "gemini": 0}, max_wait=0)
+
+
+async def before_model(callback_context, llm_request):
+    """ADK before_model_callback: one Gemini token per model call, at the turn's priority."""
+    await acquire("gemini")
+    return None
+
+
+def stats() -> dict:
+    return {
+        "enabled": RATE_LIMIT_ENABLED,
+        "limits": {name: {"per_minute": rate * 60, "burst": burst} for name, (rate, burst) in _BUCKETS.items()},
+        "interactive_reserve": RATE_LIMIT_INTERACTIVE_RESERVE,
+    }
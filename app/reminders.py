@@ -0,0 +1,228 @@
+import os
+import re
+import json
+import time
+import uuid
+from app.store import redis_client
+from app.config import logger
+
+# Sorted set of reminder IDs scored by next run time
+SCHEDULE_KEY = "scheduled_tasks"
+# Original due time of every claimed reminder, so retries and lease expiries keep their schedule
+PLANNED_KEY = "scheduled_tasks:planned"
+# Set once legacy JSON members have been converted to IDs
+MIGRATED_KEY = "scheduled_tasks:migrated"
+
+REMINDER_KEY_PREFIX = "reminder:"
+PHONE_INDEX_PREFIX = "reminders:phone:"
+
+# How long a claimed reminder stays invisible before another tick may claim it again
+REMINDER_LEASE_SECONDS = int(os.getenv("REMINDER_LEASE_SECONDS", "300"))
+# Reminders claimed per round trip
+REMINDER_CLAIM_BATCH = int(os.getenv("REMINDER_CLAIM_BATCH", "500"))
+
+# Atomically leases due members: their score is pushed to now + lease, and the
+# planned time is recorded once (HSETNX) so a re-claim after a crash keeps it.
+_CLAIM_DUE = redis_client.register_script("""
+local due = redis.call('zrangebyscore', KEYS[1], '-inf', ARGV[1], 'WITHSCORES', 'LIMIT', 0, tonumber(ARGV[3]))
+local out = {}
+for i = 1, #due, 2 do
+    local member = due[i]
+    redis.call('hsetnx', KEYS[2], member, due[i + 1])
+    redis.call('zadd', KEYS[1], ARGV[2], member)
+    out[#out + 1] = member
+    out[#out + 1] = redis.call('hget', KEYS[2], member)
+end
+return out
+""")
+
+# Reschedules a reminder only if it still exists, so a reminder cancelled
+# mid-delivery is not resurrected as an orphan ID.
+_RESCHEDULE = redis_client.register_script("""
+redis.call('hdel', KEYS[3], ARGV[1])
+if redis.call('exists', KEYS[2]) == 1 then
+    return redis.call('zadd', KEYS[1], ARGV[2], ARGV[1])
+end
+return redis.call('zrem', KEYS[1], ARGV[1])
+""")
+
+
+def _reminder_key(reminder_id: str) -> str:
+    return f"{REMINDER_KEY_PREFIX}{reminder_id}"
+
+
+def _phone_key(phone_number: str) -> str:
+    return f"{PHONE_INDEX_PREFIX}{phone_number}"
+
+
+def _encode_reminder(task: dict) -> dict:
+    return {k: json.dumps(v) for k, v in task.items()}
+
+
+def _decode_reminder(raw: dict) -> dict | None:
+    if not raw:
+        return None
+    return {k.decode(): json.loads(v) for k, v in raw.items()}
+
+
+def normalize_topic(topic: str) -> str:
+    """Canonical form of a reminder topic, so 'Tech Stocks!' and 'tech  stocks' share one digest."""
+    topic = re.sub(r"[^a-z0-9&.$ ]+", " ", (topic or "general market").lower())
+    return " ".join(topic.split()) or "general market"
+
+
+# --- Storage ---
+
+def create_reminder(task: dict, next_run: float, reminder_id: str = None) -> str:
+    """Stores a reminder payload, indexes it by phone number and schedules it. Returns its ID."""
+    reminder_id = reminder_id or uuid.uuid4().hex[:10]
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.hset(_reminder_key(reminder_id), mapping=_encode_reminder(task))
+    pipe.sadd(_phone_key(str(task["phone_number"])), reminder_id)
+    pipe.zadd(SCHEDULE_KEY, {reminder_id: next_run})
+    pipe.execute()
+    return reminder_id
+
+
+def get_reminders(reminder_ids: list[str]) -> dict[str, dict]:
+    """Fetches payloads for several reminders in one round trip; missing IDs are left out."""
+    if not reminder_ids:
+        return {}
+    pipe = redis_client.pipeline(transaction=False)
+    for reminder_id in reminder_ids:
+        pipe.hgetall(_reminder_key(reminder_id))
+    found = {}
+    for reminder_id, raw in zip(reminder_ids, pipe.execute()):
+        task = _decode_reminder(raw)
+        if task is not None:
+            found[reminder_id] = task
+    return found
+
+
+def get_reminder(reminder_id: str) -> dict | None:
+    return get_reminders([reminder_id]).get(reminder_id)
+
+
+def list_reminders(phone_number: str) -> list[tuple[str, dict, float]]:
+    """Returns (id, payload, next_run) for one user's reminders, ordered by next run."""
+    ids = [member.decode() for member in redis_client.smembers(_phone_key(phone_number))]
+    if not ids:
+        return []
+    pipe = redis_client.pipeline(transaction=False)
+    for reminder_id in ids:
+        pipe.hgetall(_reminder_key(reminder_id))
+        pipe.zscore(SCHEDULE_KEY, reminder_id)
+        pipe.hget(PLANNED_KEY, reminder_id)
+    results = pipe.execute()
+
+    reminders, stale = [], []
+    for i, reminder_id in enumerate(ids):
+        task = _decode_reminder(results[3 * i])
+        if task is None:
+            stale.append(reminder_id)
+            continue
+        # A leased reminder's score is its lease deadline; report its planned time instead
+        planned = results[3 * i + 2]
+        next_run = float(planned) if planned is not None else results[3 * i + 1]
+        reminders.append((reminder_id, task, next_run or 0.0))
+
+    if stale:
+        redis_client.srem(_phone_key(phone_number), *stale)
+    reminders.sort(key=lambda r: r[2])
+    return reminders
+
+
+def delete_reminder(reminder_id: str, phone_number: str = None) -> bool:
+    """Removes a reminder entirely. Returns False if it did not exist."""
+    if phone_number is None:
+        task = get_reminder(reminder_id)
+        if task is None:
+            return False
+        phone_number = str(task["phone_number"])
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.delete(_reminder_key(reminder_id))
+    pipe.srem(_phone_key(phone_number), reminder_id)
+    pipe.zrem(SCHEDULE_KEY, reminder_id)
+    pipe.hdel(PLANNED_KEY, reminder_id)
+    deleted = pipe.execute()[0]
+    return bool(deleted)
+
+
+def migrate_legacy_reminders() -> int:
+    """
+    Converts raw-JSON sorted set members from older releases into ID-addressed reminders.
+    Runs once; later calls cost a single GET.
+    """
+    if redis_client.get(MIGRATED_KEY):
+        return 0
+    migrated = 0
+    for member, score in redis_client.zscan_iter(SCHEDULE_KEY):
+        if not member.startswith(b"{"):
+            continue
+        try:
+            task = json.loads(member)
+        except ValueError:
+            continue
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.zrem(SCHEDULE_KEY, member)
+        pipe.hdel(PLANNED_KEY, member)
+        removed, _ = pipe.execute()
+        # Only the caller whose ZREM took the member converts it: concurrent migrations,
+        # or SCAN returning a member twice, must not create a second copy
+        if not removed:
+            continue
+        create_reminder(task, score)
+        migrated += 1
+    redis_client.set(MIGRATED_KEY, 1)
+    if migrated:
+        logger.info(f"Migrated {migrated} legacy reminders to indexed storage")
+    return migrated
+
+
+# --- Scheduling ---
+
+def claim_due_reminders(now: float = None, limit: int = REMINDER_CLAIM_BATCH, lease_seconds: int = REMINDER_LEASE_SECONDS) -> list[tuple[str, float]]:
+    """
+    Leases up to `limit` due reminders and returns (reminder_id, planned_time) pairs.
+    Safe to call from several beat ticks or workers at once: each reminder is handed out once per lease.
+    """
+    now = time.time() if now is None else now
+    flat = _CLAIM_DUE(keys=[SCHEDULE_KEY, PLANNED_KEY], args=[now, now + lease_seconds, limit])
+    return [(flat[i].decode(), float(flat[i + 1])) for i in range(0, len(flat), 2)]
+
+
+def reminders_due_between(start: float, end: float, limit: int = REMINDER_CLAIM_BATCH * 10) -> list[str]:
+    """IDs of reminders scheduled in [start, end], without claiming them."""
+    return [member.decode() for member in redis_client.zrangebyscore(SCHEDULE_KEY, start, end, start=0, num=limit)]
+
+
+def extend_leases(reminder_ids: list[str], lease_seconds: int = REMINDER_LEASE_SECONDS):
+    """Keeps claimed reminders invisible for another `lease_seconds` while they run or retry."""
+    if reminder_ids:
+        deadline = time.time() + lease_seconds
+        redis_client.zadd(SCHEDULE_KEY, {reminder_id: deadline for reminder_id in reminder_ids}, xx=True)
+
+
+def extend_lease(reminder_id: str, lease_seconds: int = REMINDER_LEASE_SECONDS):
+    extend_leases([reminder_id], lease_seconds)
+
+
+def next_run_after(planned: float, interval: float, now: float = None) -> float:
+    """
+    Next slot on the reminder's original grid (planned + k * interval).
+    Slots missed while the worker was behind are skipped instead of sent in a burst.
+    """
+    now = time.time() if now is None else now
+    next_run = planned + interval
+    if next_run <= now:
+        missed = int((now - planned) // interval)
+        next_run = planned + (missed + 1) * interval
+    return next_run
+
+
+def complete_reminder(reminder_id: str, next_run: float = None, phone_number: str = None):
+    """Releases a claimed reminder: reschedules it at `next_run`, or deletes it when None."""
+    if next_run is None:
+        delete_reminder(reminder_id, phone_number)
+    else:
+        _RESCHEDULE(keys=[SCHEDULE_KEY, _reminder_key(reminder_id), PLANNED_KEY], args=[reminder_id, next_run])
@@ -0,0 +1,130 @@
+import os
+import re
+from collections import Counter
+from app.config import logger
+from app.quotes import normalize_symbols
+from app.tickers import COMPANY_TICKERS, KNOWN_TICKERS
+from app import async_tools
+from app.metrics import ROUTER_REQUESTS
+
+ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "true").lower() == "true"
+
+DISCLAIMER = "⚠️ For educational purposes only, not financial advice."
+
+_PRICE_RE = re.compile(
+    r"^(?:what(?:'s| is)\s+(?:the\s+)?|how much is\s+|get\s+|check\s+|show\s+(?:me\s+)?)?"
+    r"(?:(?:current|live|latest|stock|share)\s+)?(?:price|quote|stock price|share price)\s+(?:of|for|on)\s+"
+    r"(?P<name>[\w$.&\- ^=]{1,30}?)(?:\s+(?:stock|shares?))?\s*[?.!]*$",
+    re.IGNORECASE,
+)
+_PRICE_SUFFIX_RE = re.compile(r"^(?P<name>\$?[A-Za-z][\w.\-=^]{0,11})\s+(?:price|quote)\s*[?.!]*$", re.IGNORECASE)
+_MULTI_RE = re.compile(
+    r"^(?:(?:check\s+)?(?:prices?|quotes?)\s+(?:of|for)\s+)?(?P<list>[\w$.\-^=]+(?:\s*(?:,|\s|\band\b|&)\s*[\w$.\-^=]+)+)\s*[?.!]*$",
+    re.IGNORECASE,
+)
+_LIST_REMINDERS_RE = re.compile(
+    r"^(?:please\s+)?(?:show|list|view|see|get|what are)?\s*(?:me\s+)?(?:all\s+)?(?:of\s+)?(?:my\s+)?(?:active\s+|current\s+)?"
+    r"(?:schedules?|reminders?|subscriptions?|scheduled updates)\s*(?:please)?\s*[?.!]*$",
+    re.IGNORECASE,
+)
+
+
+def resolve_ticker(name: str, strict: bool = False) -> str | None:
+    """
+    Maps a company name or ticker to a ticker. With `strict`, only dictionary entries and
+    '$' cashtags are accepted, so ordinary words are never mistaken for symbols.
+    """
+    name = name.strip()
+    if name.lower() in COMPANY_TICKERS:
+        return COMPANY_TICKERS[name.lower()]
+    symbols = normalize_symbols([name])
+    if not symbols:
+        return None
+    symbol = symbols[0]
+    if strict and not name.startswith("$") and symbol not in KNOWN_TICKERS:
+        return None
+    if not strict and " " in name:
+        return None
+    return symbol
+
+
+class FastPathRouter:
+    """
+    Answers unambiguous requests (a price, a ticker list, 'show my reminders') by calling
+    the tools directly, skipping the LLM. Anything else returns None and goes to the agent.
+    """
+
+    def __init__(self):
+        self.hits: Counter = Counter()
+        self.misses = 0
+        self.fallbacks = 0
+
+    def match(self, text: str) -> tuple[str, tuple] | None:
+        """Returns (intent, args) for a recognised request, else None."""
+        text = " ".join(text.split())
+        if not text or len(text) > 120:
+            return None
+
+        if _LIST_REMINDERS_RE.match(text):
+            return "list_reminders", ()
+
+        m = _PRICE_RE.match(text) or _PRICE_SUFFIX_RE.match(text)
+        if m:
+            # Strict: 'price of gold' must not become a quote for GOLD
+            symbol = resolve_ticker(m.group("name"), strict=True)
+            if symbol:
+                return "quote", (symbol,)
+
+        m = _MULTI_RE.match(text)
+        if m:
+            names = [n for n in re.split(r"\s*(?:,|\band\b|&|\s)\s*", m.group("list"), flags=re.IGNORECASE) if n]
+            symbols = [resolve_ticker(n, strict=True) for n in names]
+            if len(symbols) >= 2 and all(symbols):
+                return "multi_quote", (" ".join(dict.fromkeys(symbols)),)
+        elif (symbol := resolve_ticker(text.rstrip("?.! "), strict=True)) and (text.startswith("$") or text.rstrip("?.! ").isupper()):
+            # A lone ticker such as 'NVDA' or '$NVDA'
+            return "quote", (symbol,)
+        return None
+
+    async def handle(self, from_number: str, text: str) -> str | None:
+        """Returns the reply for a fast-path request, or None to fall through to the agent."""
+        if not ROUTER_ENABLED:
+            return None
+        matched = self.match(text)
+        if matched is None:
+            self.misses += 1
+            ROUTER_REQUESTS.labels("miss").inc()
+            return None
+
+        intent, args = matched
+        if intent == "list_reminders":
+            reply = await async_tools.list_investment_schedules(from_number)
+        elif intent == "quote":
+            reply = await async_tools.get_yahoo_finance_data(*args)
+        else:
+            reply = await async_tools.get_multi_tickers_data(*args)
+
+        if reply.startswith("Error"):
+            # Let the agent interpret what the user meant
+            self.fallbacks += 1
+            ROUTER_REQUESTS.labels("fallback").inc()
+            return None
+        self.hits[intent] += 1
+        ROUTER_REQUESTS.labels(f"hit_{intent}").inc()
+        logger.info(f"Fast path {intent}{args} answered {from_number}")
+        if intent != "list_reminders":
+            reply = f"{reply.rstrip()}\n\n{DISCLAIMER}"
+        return reply
+
+    def stats(self) -> dict:
+        hits = sum(self.hits.values())
+        total = hits + self.misses + self.fallbacks
+        return {
+            "hits": dict(self.hits),
+            "misses": self.misses,
+            "fallbacks": self.fallbacks,
+            "hit_rate": round(hits / total, 3) if total else 0.0,
+        }
+
+
+router = FastPathRouter()
@@ -0,0 +1,327 @@
+import os
+import json
+import time
+import uuid
+import zlib
+from typing import Any, AsyncIterator, Optional
+
+from google.adk.errors.already_exists_error import AlreadyExistsError
+from google.adk.events import Event
+from google.adk.sessions import BaseSessionService, Session
+from google.adk.sessions.base_session_service import GetSessionConfig, ListSessionsResponse
+from google.adk.sessions.state import State
+from google.genai import types
+
+from app.config import logger
+from app.store import get_async_redis
+
+APP_NAME = "whatsapp-investment-bot"
+
+# Idle sessions expire after this many seconds (refreshed on every event)
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(7 * 86400)))
+# Events loaded into a session by default (0 loads the full history)
+SESSION_EVENT_WINDOW = int(os.getenv("SESSION_EVENT_WINDOW", "200"))
+# Hard cap on stored events per session (0 keeps everything)
+SESSION_MAX_EVENTS = int(os.getenv("SESSION_MAX_EVENTS", "1000"))
+# Serialized events above this size are zlib-compressed
+COMPRESS_THRESHOLD = 1024
+
+_ZLIB_MARKER = b"z"
+_JSON_MARKER = b"j"
+
+
+def _encode_event(event: Event) -> bytes:
+    raw = event.model_dump_json(exclude_none=True).encode()
+    if len(raw) > COMPRESS_THRESHOLD:
+        return _ZLIB_MARKER + zlib.compress(raw)
+    return _JSON_MARKER + raw
+
+
+def _decode_event(blob: bytes) -> Event:
+    if blob[:1] == _ZLIB_MARKER:
+        return Event.model_validate_json(zlib.decompress(blob[1:]))
+    return Event.model_validate_json(blob[1:])
+
+
+def _encode_state(state: dict[str, Any]) -> dict[str, str]:
+    return {k: json.dumps(v, default=str, separators=(",", ":")) for k, v in state.items()}
+
+
+def _decode_state(raw: dict) -> dict[str, Any]:
+    return {k.decode(): json.loads(v) for k, v in raw.items()}
+
+
+def _split_state(state: Optional[dict[str, Any]]) -> tuple[dict, dict, dict]:
+    """Splits a state dict into (app, user, session) deltas, dropping temp: keys."""
+    app_state, user_state, session_state = {}, {}, {}
+    for key, value in (state or {}).items():
+        if key.startswith(State.APP_PREFIX):
+            app_state[key.removeprefix(State.APP_PREFIX)] = value
+        elif key.startswith(State.USER_PREFIX):
+            user_state[key.removeprefix(State.USER_PREFIX)] = value
+        elif not key.startswith(State.TEMP_PREFIX):
+            session_state[key] = value
+    return app_state, user_state, session_state
+
+
+def _align_to_user_turn(events: list[Event]) -> list[Event]:
+    """
+    Drops leading events until the first user message, so a windowed history
+    never starts with an orphaned function response.
+    """
+    for i, event in enumerate(events):
+        if event.author == "user":
+            return events[i:]
+    return events
+
+
+class RedisSessionService(BaseSessionService):
+    """
+    ADK session service backed by Redis, shared by API replicas and Celery workers.
+
+    Layout (all keys expire after `ttl_seconds` of inactivity):
+      {prefix}:s:{app}:{user}:{sid}   hash  -> session state and last update time
+      {prefix}:e:{app}:{user}:{sid}   list  -> serialized events, oldest first
+      {prefix}:idx:{app}:{user}       zset  -> session ids scored by last update
+      {prefix}:us:{app}:{user}        hash  -> user-scoped state
+      {prefix}:as:{app}               hash  -> app-scoped state (no TTL)
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: int = SESSION_TTL_SECONDS,
+        event_window: int = SESSION_EVENT_WINDOW,
+        max_events: int = SESSION_MAX_EVENTS,
+        key_prefix: str = "adk",
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.event_window = event_window
+        self.max_events = max_events
+        self.key_prefix = key_prefix
+
+    # --- Keys ---
+
+    def _session_key(self, app_name: str, user_id: str, session_id: str) -> str:
+        return f"{self.key_prefix}:s:{app_name}:{user_id}:{session_id}"
+
+    def _events_key(self, app_name: str, user_id: str, session_id: str) -> str:
+        return f"{self.key_prefix}:e:{app_name}:{user_id}:{session_id}"
+
+    def _index_key(self, app_name: str, user_id: str) -> str:
+        return f"{self.key_prefix}:idx:{app_name}:{user_id}"
+
+    def _user_state_key(self, app_name: str, user_id: str) -> str:
+        return f"{self.key_prefix}:us:{app_name}:{user_id}"
+
+    def _app_state_key(self, app_name: str) -> str:
+        return f"{self.key_prefix}:as:{app_name}"
+
+    # --- Helpers ---
+
+    def _expire_all(self, pipe, app_name: str, user_id: str, session_id: str):
+        if self.ttl_seconds > 0:
+            pipe.expire(self._session_key(app_name, user_id, session_id), self.ttl_seconds)
+            pipe.expire(self._events_key(app_name, user_id, session_id), self.ttl_seconds)
+            pipe.expire(self._index_key(app_name, user_id), self.ttl_seconds)
+            pipe.expire(self._user_state_key(app_name, user_id), self.ttl_seconds)
+
+    async def _merged_state(self, app_name: str, user_id: str, session_state: dict) -> dict:
+        r = get_async_redis()
+        pipe = r.pipeline(transaction=False)
+        pipe.hgetall(self._app_state_key(app_name))
+        pipe.hgetall(self._user_state_key(app_name, user_id))
+        app_raw, user_raw = await pipe.execute()
+        state = dict(session_state)
+        for key, value in _decode_state(app_raw).items():
+            state[State.APP_PREFIX + key] = value
+        for key, value in _decode_state(user_raw).items():
+            state[State.USER_PREFIX + key] = value
+        return state
+
+    # --- BaseSessionService ---
+
+    async def create_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        state: Optional[dict[str, Any]] = None,
+        session_id: Optional[str] = None,
+    ) -> Session:
+        session_id = session_id.strip() if session_id else uuid.uuid4().hex
+        app_state, user_state, session_state = _split_state(state)
+        now = time.time()
+
+        r = get_async_redis()
+        session_key = self._session_key(app_name, user_id, session_id)
+        created = await r.hsetnx(session_key, "last_update_time", now)
+        if not created:
+            raise AlreadyExistsError(f"Session with id {session_id} already exists.")
+
+        pipe = r.pipeline(transaction=True)
+        pipe.hset(session_key, "state", json.dumps(session_state, default=str))
+        pipe.zadd(self._index_key(app_name, user_id), {session_id: now})
+        if app_state:
+            pipe.hset(self._app_state_key(app_name), mapping=_encode_state(app_state))
+        if user_state:
+            pipe.hset(self._user_state_key(app_name, user_id), mapping=_encode_state(user_state))
+        self._expire_all(pipe, app_name, user_id, session_id)
+        await pipe.execute()
+
+        return Session(
+            id=session_id,
+            app_name=app_name,
+            user_id=user_id,
+            state=await self._merged_state(app_name, user_id, session_state),
+            last_update_time=now,
+        )
+
+    async def get_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        config: Optional[GetSessionConfig] = None,
+    ) -> Optional[Session]:
+        r = get_async_redis()
+        raw = await r.hgetall(self._session_key(app_name, user_id, session_id))
+        if not raw:
+            return None
+
+        window = self.event_window
+        if config and config.num_recent_events is not None:
+            window = config.num_recent_events
+
+        events_key = self._events_key(app_name, user_id, session_id)
+        if config and config.num_recent_events == 0:
+            blobs = []
+        elif window > 0:
+            blobs = await r.lrange(events_key, -window, -1)
+        else:
+            blobs = await r.lrange(events_key, 0, -1)
+
+        events = [_decode_event(blob) for blob in blobs]
+        if config and config.after_timestamp:
+            events = [e for e in events if e.timestamp >= config.after_timestamp]
+        elif window > 0 and len(events) == window:
+            events = _align_to_user_turn(events)
+
+        session_state = json.loads(raw.get(b"state", b"{}"))
+        return Session(
+            id=session_id,
+            app_name=app_name,
+            user_id=user_id,
+            state=await self._merged_state(app_name, user_id, session_state),
+            events=events,
+            last_update_time=float(raw.get(b"last_update_time", 0)),
+        )
+
+    async def iter_events(
+        self, *, app_name: str, user_id: str, session_id: str, page_size: int = 100
+    ) -> AsyncIterator[Event]:
+        """Lazily yields a session's full event history, oldest first, one page at a time."""
+        r = get_async_redis()
+        events_key = self._events_key(app_name, user_id, session_id)
+        start = 0
+        while True:
+            blobs = await r.lrange(events_key, start, start + page_size - 1)
+            for blob in blobs:
+                yield _decode_event(blob)
+            if len(blobs) < page_size:
+                return
+            start += page_size
+
+    async def list_sessions(
+        self, *, app_name: str, user_id: Optional[str] = None
+    ) -> ListSessionsResponse:
+        r = get_async_redis()
+        if user_id is not None:
+            user_ids = [user_id]
+        else:
+            prefix = self._index_key(app_name, "")
+            user_ids = [key.decode()[len(prefix):] async for key in r.scan_iter(match=f"{prefix}*")]
+
+        sessions = []
+        for uid in user_ids:
+            for session_id, updated in await r.zrange(self._index_key(app_name, uid), 0, -1, withscores=True):
+                sessions.append(Session(
+                    id=session_id.decode(),
+                    app_name=app_name,
+                    user_id=uid,
+                    last_update_time=updated,
+                ))
+        sessions.sort(key=lambda s: (s.last_update_time, s.user_id, s.id))
+        return ListSessionsResponse(sessions=sessions)
+
+    async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        pipe = get_async_redis().pipeline(transaction=True)
+        pipe.delete(self._session_key(app_name, user_id, session_id))
+        pipe.delete(self._events_key(app_name, user_id, session_id))
+        pipe.zrem(self._index_key(app_name, user_id), session_id)
+        await pipe.execute()
+
+    async def get_user_state(self, *, app_name: str, user_id: str) -> dict[str, Any]:
+        return _decode_state(await get_async_redis().hgetall(self._user_state_key(app_name, user_id)))
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        if event.partial:
+            return event
+
+        event = await super().append_event(session=session, event=event)
+        session.last_update_time = event.timestamp
+
+        app_name, user_id, session_id = session.app_name, session.user_id, session.id
+        session_key = self._session_key(app_name, user_id, session_id)
+        events_key = self._events_key(app_name, user_id, session_id)
+
+        r = get_async_redis()
+        pipe = r.pipeline(transaction=True)
+        pipe.rpush(events_key, _encode_event(event))
+        if self.max_events > 0:
+            pipe.ltrim(events_key, -self.max_events, -1)
+        pipe.hset(session_key, "last_update_time", event.timestamp)
+        pipe.zadd(self._index_key(app_name, user_id), {session_id: event.timestamp})
+
+        if event.actions and event.actions.state_delta:
+            app_state, user_state, session_state = _split_state(event.actions.state_delta)
+            if app_state:
+                pipe.hset(self._app_state_key(app_name), mapping=_encode_state(app_state))
+            if user_state:
+                pipe.hset(self._user_state_key(app_name, user_id), mapping=_encode_state(user_state))
+            if session_state:
+                persisted = {
+                    k: v for k, v in session.state.items()
+                    if not k.startswith((State.APP_PREFIX, State.USER_PREFIX, State.TEMP_PREFIX))
+                }
+                pipe.hset(session_key, "state", json.dumps(persisted, default=str))
+
+        self._expire_all(pipe, app_name, user_id, session_id)
+        await pipe.execute()
+        return event
+
+
+async def ensure_session(service: BaseSessionService, user_id: str, session_id: str, app_name: str = APP_NAME) -> Session:
+    """Returns the existing session or creates it."""
+    session = await service.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
+    if session is not None:
+        return session
+    try:
+        return await service.create_session(app_name=app_name, user_id=user_id, session_id=session_id)
+    except AlreadyExistsError:
+        # Created concurrently by another replica or worker
+        logger.debug("Session %s created concurrently", session_id)
+        return await service.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
+
+
+async def record_exchange(service: BaseSessionService, user_id: str, session_id: str, user_text: str, reply_text: str,
+                          author: str, app_name: str = APP_NAME):
+    """Appends a user message and a reply produced outside the agent, so later turns see it as history."""
+    session = await ensure_session(service, user_id=user_id, session_id=session_id, app_name=app_name)
+    invocation_id = f"e-{uuid.uuid4()}"
+    for role, event_author, text in (("user", "user", user_text), ("model", author, reply_text)):
+        await service.append_event(session, Event(
+            invocation_id=invocation_id,
+            author=event_author,
+            content=types.Content(role=role, parts=[types.Part(text=text)]),
+        ))
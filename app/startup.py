@@ -0,0 +1,79 @@
+import os
+import sys
+import time
+import subprocess
+from collections import defaultdict
+from app.config import logger
+
+
+def _process_started_at() -> float:
+    """Wall-clock time this process started (from /proc on Linux), else now."""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+
+PROCESS_STARTED_AT = _process_started_at()
+# Everything before this (interpreter, server boot, config) counts as "boot"
+_last_mark = time.time()
+_phases: dict[str, float] = {"boot": _last_mark - PROCESS_STARTED_AT}
+_ready_at: float | None = None
+
+
+def mark(phase: str):
+    """Closes a start-up phase: records the time since the previous mark under `phase`."""
+    global _last_mark
+    now = time.time()
+    _phases[phase] = _phases.get(phase, 0.0) + now - _last_mark
+    _last_mark = now
+
+
+def ready(component: str = "api"):
+    """Marks the process ready to serve and logs where start-up time went."""
+    global _ready_at
+    mark("init")
+    _ready_at = time.time()
+    phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in _phases.items())
+    logger.info(f"{component} ready {_ready_at - PROCESS_STARTED_AT:.2f}s after process start ({phases})")
+
+
+def report() -> dict:
+    return {
+        "ready_seconds": round(_ready_at - PROCESS_STARTED_AT, 3) if _ready_at else None,
+        "phases": {name: round(seconds, 3) for name, seconds in _phases.items()},
+    }
+
+
+def import_breakdown(module: str = "app.main") -> tuple[float, list[tuple[str, float]]]:
+    """
+    Imports `module` in a fresh interpreter with -X importtime.
+    Returns (total seconds, [(package, seconds)]) with import time grouped by package, largest first.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, cwd=os.getcwd())
+    totals: dict[str, float] = defaultdict(float)
+    total = 0.0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        parts = name.split(".")
+        # google.* is several unrelated distributions; keep the second level
+        package = ".".join(parts[:2]) if parts[0] == "google" else parts[0]
+        totals[package] += int(self_us) / 1e6
+        total += int(self_us) / 1e6
+    return total, sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+
+if __name__ == "__main__":
+    target = sys.argv[1] if len(sys.argv) > 1 else "app.main"
+    total, packages = import_breakdown(target)
+    print(f"import {target}: {total:.2f}s")
+    for package, seconds in packages[:20]:
+        print(f"  {package:<28} {seconds * 1000:8.1f} ms  {seconds / total:6.1%}")
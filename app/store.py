@@ -0,0 +1,33 @@
+import os
+import asyncio
+import weakref
+import redis
+import redis.asyncio as aioredis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+
+# Initialize Redis client (centralized)
+redis_client = redis.from_url(REDIS_URL)
+
+# redis.asyncio pools are bound to the loop that first used them, so keep one per loop
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aioredis.Redis]" = weakref.WeakKeyDictionary()
+
+
+def get_async_redis() -> aioredis.Redis:
+    """Returns the asyncio Redis client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = aioredis.from_url(REDIS_URL)
+        _async_clients[loop] = client
+    return client
+
+
+async def close_async_redis():
+    """Closes the asyncio Redis client bound to the running loop, if any."""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
@@ -0,0 +1,57 @@
+import os
+import json
+from app.config import logger
+
+# Ticker dictionary shared by the fast-path router and the news search.
+
+# Optional JSON file of extra {"company name": "TICKER"} entries for the ticker dictionary
+ROUTER_TICKERS_FILE = os.getenv("ROUTER_TICKERS_FILE")
+
+# Company names users type instead of tickers
+COMPANY_TICKERS = {
+    "apple": "AAPL", "microsoft": "MSFT", "nvidia": "NVDA", "amazon": "AMZN", "google": "GOOGL",
+    "alphabet": "GOOGL", "meta": "META", "facebook": "META", "tesla": "TSLA", "netflix": "NFLX",
+    "amd": "AMD", "intel": "INTC", "broadcom": "AVGO", "oracle": "ORCL", "salesforce": "CRM",
+    "adobe": "ADBE", "ibm": "IBM", "qualcomm": "QCOM", "palantir": "PLTR", "uber": "UBER",
+    "paypal": "PYPL", "shopify": "SHOP", "coinbase": "COIN", "disney": "DIS", "walmart": "WMT",
+    "costco": "COST", "coca cola": "KO", "coca-cola": "KO", "pepsi": "PEP", "mcdonalds": "MCD",
+    "nike": "NKE", "starbucks": "SBUX", "boeing": "BA", "berkshire": "BRK-B", "jpmorgan": "JPM",
+    "goldman sachs": "GS", "visa": "V", "mastercard": "MA", "exxon": "XOM", "chevron": "CVX",
+    "pfizer": "PFE", "moderna": "MRNA", "eli lilly": "LLY", "johnson & johnson": "JNJ",
+    "unitedhealth": "UNH", "tsmc": "TSM", "asml": "ASML", "alibaba": "BABA", "reliance": "RELIANCE.NS",
+    "infosys": "INFY", "tcs": "TCS.NS", "bitcoin": "BTC-USD", "ethereum": "ETH-USD",
+    "s&p 500": "^GSPC", "s&p": "^GSPC", "nasdaq": "^IXIC", "dow": "^DJI", "dow jones": "^DJI",
+    "nifty": "^NSEI", "sensex": "^BSESN",
+}
+
+# Bare tickers recognised without a '$' prefix in ticker-only messages
+KNOWN_TICKERS = set(COMPANY_TICKERS.values()) | {
+    "SPY", "QQQ", "DIA", "IWM", "VOO", "VTI", "ARKK", "SMCI", "MU", "ARM", "SNOW", "CRWD", "PANW",
+    "ABNB", "SQ", "HOOD", "SOFI", "RIVN", "LCID", "NIO", "GM", "VZ", "BAC", "WFC", "SCHW", "HD",
+    "LOW", "TGT", "CVS", "ABBV", "MRK", "BMY", "AMGN", "GILD", "TXN", "CSCO", "DELL", "HPQ", "SONY", "TM", "SAP", "BP", "SHEL",
+}
+
+# Known tickers that are also everyday words: recognised in lowercase text only when
+# written as '$LOW' or 'LOW', never from 'low' or 'cost'
+WORD_TICKERS = {
+    "ARM", "COIN", "COST", "DIA", "DIS", "HOOD", "LOW", "PEP", "SAP", "SHOP", "SNOW", "SPY",
+}
+
+# Company names that are also everyday words: in free text they name the company only with
+# a signal, e.g. 'VISA', 'visa stock' or 'meta shares', never from 'visa requirements'
+AMBIGUOUS_COMPANY_NAMES = {"dow", "meta", "nifty", "oracle", "reliance", "visa"}
+
+
+def _load_extra_tickers():
+    if not ROUTER_TICKERS_FILE:
+        return
+    try:
+        with open(ROUTER_TICKERS_FILE) as f:
+            extra = {name.lower(): ticker.upper() for name, ticker in json.load(f).items()}
+        COMPANY_TICKERS.update(extra)
+        KNOWN_TICKERS.update(extra.values())
+    except Exception as e:
+        logger.error(f"Could not load router tickers from {ROUTER_TICKERS_FILE}: {e}")
+
+
+_load_extra_tickers()
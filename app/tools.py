@@ -1,49 +1,52 @@
 import os
-import redis
 import json
-import yfinance as yf
 from dotenv import load_dotenv
-from functools import lru_cache, wraps
 from app.config import logger
-import hashlib
+from app.metrics import UPSTREAM_CALLS
+from app import ratelimit
+from app.cache import redis_cache
+from app.reminders import create_reminder, delete_reminder, list_reminders
+from app.quotes import normalize_symbols, get_quotes, get_profile
+from app.compaction import pin_fact
+from app.news import get_news
 
 load_dotenv()
 
-# Initialize Redis client (centralized)
-redis_client = redis.from_url(os.getenv("REDIS_URL", "redis://redis:6379/0"))
+def _format_number(value) -> str:
+    return f"{value:,}" if isinstance(value, (int, float)) else "N/A"
 
-def redis_cache(ttl_seconds: int = 300):
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            try:
-                # Create a unique cache key based on function name and arguments
-                key_parts = [func.__name__] + list(map(str, args)) + [f"{k}={v}" for k, v in kwargs.items()]
-                key_str = ":".join(key_parts)
-                hashed_key = hashlib.md5(key_str.encode()).hexdigest()
-                cache_key = f"cache:{hashed_key}"
-                
-                # Try to get from Redis
-                cached = redis_client.get(cache_key)
-                if cached:
-                    logger.info(f"Cache hit for {func.__name__}")
-                    return cached.decode('utf-8')
-                
-                # Call function
-                result = func(*args, **kwargs)
-                
-                # Save to Redis
-                if result and not result.startswith("Error"):
-                     redis_client.setex(cache_key, ttl_seconds, result)
-                
-                return result
-            except Exception as e:
-                logger.error(f"Cache error: {e}")
-                return func(*args, **kwargs)
-        return wrapper
-    return decorator
+def format_quote_report(symbol: str, quote: dict, profile: dict) -> str:
+    currency = quote.get("currency") or "USD"
+    summary = profile.get("summary") or "No summary available."
+    return (
+        f"--- {symbol} Report ---\n"
+        f"💰 Price: {quote.get('price')} {currency} (Range: {quote.get('day_low')} - {quote.get('day_high')})\n"
+        f"🏢 Market Cap: {_format_number(quote.get('market_cap'))} {currency}\n"
+        f"📈 Revenue Growth: {profile.get('revenue_growth', 'N/A')}\n"
+        f"📝 Summary: {summary[:400]}...\n"
+    )
+
+def format_multi_quotes(symbols: list[str], quotes: dict) -> str:
+    results = f"--- Multi-Ticker Snapshot ({' '.join(symbols)}) ---\n"
+    for sym in symbols:
+        quote = quotes.get(sym)
+        if quote is None:
+            results += f"🔹 {sym}: not found\n"
+        else:
+            results += f"🔹 {sym}: {quote.get('price')} {quote.get('currency') or 'USD'}\n"
+    return results
+
+def format_news(query: str, news: list[dict]) -> str:
+    if not news:
+        return f"No news found for '{query}'."
+    news_str = f"--- Latest News for '{query}' ---\n"
+    for item in news:
+        title = item.get("title")
+        publisher = item.get("publisher")
+        link = item.get("link")
+        news_str += f"📰 {title} ({publisher})\n🔗 {link}\n\n"
+    return news_str
 
-@redis_cache(ttl_seconds=60)
 def get_yahoo_finance_data(symbol: str) -> str:
     """
     Fetches real-time stock data, company information, and key statistics for a single ticker.
@@ -51,31 +54,21 @@ def get_yahoo_finance_data(symbol: str) -> str:
         symbol: The stock ticker symbol (e.g., 'AAPL', 'NVDA').
     """
     try:
-        logger.info(f"Fetching data for {symbol}")
-        ticker = yf.Ticker(symbol)
-        info = ticker.info
-        
-        current_price = info.get("currentPrice") or info.get("regularMarketPrice")
-        market_cap = info.get("marketCap")
-        summary = info.get("longBusinessSummary", "No summary available.")
-        currency = info.get("currency", "USD")
-        day_high = info.get("dayHigh")
-        day_low = info.get("dayLow")
-        rev_growth = info.get("revenueGrowth", "N/A")
-        
-        data_str = (
-            f"--- {symbol} Report ---\n"
-            f"💰 Price: {current_price} {currency} (Range: {day_low} - {day_high})\n"
-            f"🏢 Market Cap: {market_cap:,} {currency}\n"
-            f"📈 Revenue Growth: {rev_growth}\n"
-            f"📝 Summary: {summary[:400]}...\n"
-        )
-        return data_str
+        symbols = normalize_symbols(symbol)
+        if not symbols:
+            return f"Error fetching data for {symbol}: invalid ticker symbol."
+        symbol = symbols[0]
+
+        # Profile first: on a miss its .info lookup also warms the quote record
+        profile = get_profile(symbol)
+        quote = get_quotes([symbol]).get(symbol)
+        if quote is None:
+            return f"Error fetching data for {symbol}: no market data found."
+        return format_quote_report(symbol, quote, profile)
     except Exception as e:
         logger.error(f"Error fetching data for {symbol}: {e}")
         return f"Error fetching data for {symbol}: {str(e)}"
 
-@redis_cache(ttl_seconds=300)
 def get_multi_tickers_data(symbols_string: str) -> str:
     """
     Fetches current prices for multiple stock symbols at once.
@@ -83,14 +76,10 @@ def get_multi_tickers_data(symbols_string: str) -> str:
         symbols_string: Space-separated tickers (e.g., 'AAPL MSFT GOOG').
     """
     try:
-        logger.info(f"Fetching multi-ticker data for {symbols_string}")
-        tickers = yf.Tickers(symbols_string)
-        results = f"--- Multi-Ticker Snapshot ({symbols_string}) ---\n"
-        for sym in symbols_string.split():
-            info = tickers.tickers[sym].info
-            current_price = info.get("currentPrice") or info.get("regularMarketPrice")
-            results += f"🔹 {sym}: {current_price} {info.get('currency', 'USD')}\n"
-        return results
+        symbols = normalize_symbols(symbols_string)
+        if not symbols:
+            return f"Error fetching multi-ticker data: no valid symbols in '{symbols_string}'."
+        return format_multi_quotes(symbols, get_quotes(symbols))
     except Exception as e:
         logger.error(f"Error fetching multi-ticker data: {e}")
         return f"Error fetching multi-ticker data: {str(e)}"
@@ -103,23 +92,12 @@ def search_finance_news(query: str) -> str:
     """
     try:
         logger.info(f"Searching news for {query}")
-        search = yf.Search(query, max_results=5)
-        news = search.news
-        if not news:
-            return f"No news found for '{query}'."
-        
-        news_str = f"--- Latest News for '{query}' ---\n"
-        for item in news:
-            title = item.get("title")
-            publisher = item.get("publisher")
-            link = item.get("link")
-            news_str += f"📰 {title} ({publisher})\n🔗 {link}\n\n"
-        return news_str
+        return format_news(query, get_news(query))
     except Exception as e:
         logger.error(f"Error searching news for {query}: {e}")
         return f"Error searching news for {query}: {str(e)}"
 
-@redis_cache(ttl_seconds=3600)
+@redis_cache(ttl_seconds=900, market="US")
 def get_sector_analysis(sector_name: str) -> str:
     """
     Gets information and top companies for a market sector.
@@ -131,9 +109,12 @@ def get_sector_analysis(sector_name: str) -> str:
         # Normalize sector name for yfinance
         formatted_name = sector_name.lower().strip().replace(" ", "-")
         
+        import yfinance as yf
         if not hasattr(yf, "Sector"):
             return "Error: Your version of yfinance doesn't support sector analysis. Please update to 0.2.x or higher."
 
+        ratelimit.acquire_sync("yahoo")
+        UPSTREAM_CALLS.labels("sector").inc()
         s = yf.Sector(formatted_name)
         
         try:
@@ -157,7 +138,7 @@ def get_sector_analysis(sector_name: str) -> str:
         logger.error(f"Sector Error: {e}")
         return f"Error fetching sector info for '{sector_name}': {str(e)}. Try a major industry name."
 
-@redis_cache(ttl_seconds=600)
+@redis_cache(ttl_seconds=120, market="US")
 def screen_market_by_valuation(criteria: str = "undervalued_growth") -> str:
     """
     Uses the yfinance Screener to find stocks matching a specific strategy.
@@ -206,6 +187,9 @@ def screen_market_by_valuation(criteria: str = "undervalued_growth") -> str:
                   criteria_key = "day_gainers"
 
         results_data = None
+        ratelimit.acquire_sync("yahoo")
+        UPSTREAM_CALLS.labels("screener").inc()
+        import yfinance as yf
         
         if hasattr(yf, "screen"):
             try:
@@ -243,7 +227,7 @@ def screen_market_by_valuation(criteria: str = "undervalued_growth") -> str:
         logger.error(f"Error screening market: {e}")
         return f"Error screening market: {str(e)}."
 
-def schedule_investment_reminder(phone_number: str, interval: str, duration: str = "forever", topic: str = "general market") -> str:
+def schedule_investment_reminder(phone_number: str, interval: str, duration: str = "forever", topic: str = "general market", personalized: bool = False) -> str:
     """
     Schedules a repeatable or one-time investment reminder.
     Args:
@@ -251,6 +235,8 @@ def schedule_investment_reminder(phone_number: str, interval: str, duration: str
         interval: How often to send update (e.g., '5 minutes', '1 hour', '1 day').
         duration: How long to keep sending (e.g., 'once', '2 days', 'forever').
         topic: The specific investment topic.
+        personalized: True only if the user asks for updates tailored to their own conversation.
+            Otherwise everyone following the same topic receives the same shared update.
     """
     import time
     import re
@@ -284,33 +270,31 @@ def schedule_investment_reminder(phone_number: str, interval: str, duration: str
         "is_one_time": is_one_time,
         "end_time": end_time
     }
+    if personalized:
+        task_data["personalized"] = True
     
-    redis_client.zadd("scheduled_tasks", {json.dumps(task_data): next_run})
+    reminder_id = create_reminder(task_data, next_run)
     duration_msg = "just once" if is_one_time else (f"every {interval} for {duration}" if end_time > 0 else f"every {interval} forever")
-    logger.info(f"Scheduled reminder for {phone_number}: {topic} ({duration_msg})")
-    return f"Scheduled {topic} update for {phone_number} {duration_msg}."
+    logger.info(f"Scheduled reminder {reminder_id} for {phone_number}: {topic} ({duration_msg})")
+    return f"Scheduled {topic} update for {phone_number} {duration_msg} (ID: {reminder_id})."
 
-def cancel_investment_reminders(phone_number: str, topic: str = None) -> str:
+def cancel_investment_reminders(phone_number: str, topic: str = None, reminder_id: str = None) -> str:
     """
     Cancels or stops active investment reminders for a user.
     Args:
         phone_number: The user's WhatsApp phone number.
         topic: The specific topic to stop. If None, stops all for this number.
+        reminder_id: The ID of a single reminder to stop (shown by list_investment_schedules).
     """
     try:
-        all_tasks = redis_client.zrange("scheduled_tasks", 0, -1)
         removed_count = 0
-        
-        for task_json in all_tasks:
-            task_data = json.loads(task_json)
-            if task_data.get("phone_number") == phone_number:
-                if topic:
-                    if topic.lower() in task_data.get("topic", "").lower():
-                        redis_client.zrem("scheduled_tasks", task_json)
-                        removed_count += 1
-                else:
-                    redis_client.zrem("scheduled_tasks", task_json)
-                    removed_count += 1
+        for task_id, task_data, _ in list_reminders(str(phone_number)):
+            if reminder_id and task_id != reminder_id:
+                continue
+            if topic and topic.lower() not in task_data.get("topic", "").lower():
+                continue
+            if delete_reminder(task_id, str(phone_number)):
+                removed_count += 1
         
         if removed_count == 0:
             return "No active reminders found for your number."
@@ -328,32 +312,27 @@ def list_investment_schedules(phone_number: str) -> str:
         phone_number: The user's WhatsApp phone number.
     """
     try:
-        # Get all tasks and their scores (next run times)
-        all_tasks_with_scores = redis_client.zrange("scheduled_tasks", 0, -1, withscores=True)
         user_tasks = []
         
         import datetime
         
-        for task_json, next_run_ts in all_tasks_with_scores:
-            task_data = json.loads(task_json)
-            if str(task_data.get("phone_number")) == str(phone_number):
-                topic = task_data.get("topic", "general market")
-                interval_secs = task_data.get("interval_seconds", 3600)
-                is_one_time = task_data.get("is_one_time", False)
-                end_time = task_data.get("end_time", -1)
-                
-                # Format interval
-                if interval_secs < 3600:
-                    interval_str = f"{interval_secs // 60} min"
-                elif interval_secs < 86400:
-                    interval_str = f"{interval_secs // 3600} hr"
-                else:
-                    interval_str = f"{interval_secs // 86400} day"
-                
-                next_run_str = datetime.datetime.fromtimestamp(next_run_ts).strftime('%H:%M')
-                
-                status = "Once" if is_one_time else f"Every {interval_str}"
-                user_tasks.append(f"⏰ **{topic}** ({status}) - Next: {next_run_str}")
+        for task_id, task_data, next_run_ts in list_reminders(str(phone_number)):
+            topic = task_data.get("topic", "general market")
+            interval_secs = task_data.get("interval_seconds", 3600)
+            is_one_time = task_data.get("is_one_time", False)
+            
+            # Format interval
+            if interval_secs < 3600:
+                interval_str = f"{interval_secs // 60} min"
+            elif interval_secs < 86400:
+                interval_str = f"{interval_secs // 3600} hr"
+            else:
+                interval_str = f"{interval_secs // 86400} day"
+            
+            next_run_str = datetime.datetime.fromtimestamp(next_run_ts).strftime('%H:%M')
+            
+            status = "Once" if is_one_time else f"Every {interval_str}"
+            user_tasks.append(f"⏰ **{topic}** ({status}) - Next: {next_run_str} [ID: {task_id}]")
         
         if not user_tasks:
             return "You have no active scheduled reminders."
@@ -363,3 +342,17 @@ def list_investment_schedules(phone_number: str) -> str:
     except Exception as e:
         logger.error(f"Error listing schedules: {e}")
         return f"Error listing schedules: {str(e)}"
+
+
+def remember_user_fact(name: str, fact: str, tool_context) -> str:
+    """
+    Remembers a lasting fact about the user (e.g. their watchlist, risk profile or holdings)
+    so it is kept in every future conversation. Replaces any fact with the same name.
+    Args:
+        name: Short label for the fact (e.g., 'watchlist', 'risk profile').
+        fact: The fact itself (e.g., 'AAPL, NVDA, TSLA'). Pass an empty string to forget it.
+    """
+    facts = pin_fact(tool_context.state, name, fact)
+    if not fact:
+        return f"🗑️ Forgot '{name}'. Remembered facts: {len(facts)}."
+    return f"📌 Remembered {name}: {fact}"
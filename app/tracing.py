@@ -0,0 +1,274 @@
+import os
+import json
+import time
+import uuid
+import random
+import inspect
+import threading
+from contextvars import ContextVar
+from contextlib import contextmanager
+from functools import wraps
+from app.config import logger
+
+# none | log | jsonl (see get_exporter); other exporters can be plugged in with set_exporter()
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none").lower()
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+# Fraction of new traces that are exported; children follow their root's decision
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+
+# Celery header carrying "trace_id:span_id:sampled" from publisher to worker
+CELERY_TRACE_HEADER = "x-trace-context"
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "sampled", "attributes", "start", "_t0", "duration_ms", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: str | None, sampled: bool, attributes: dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.attributes = attributes
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        self.duration_ms = None
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error: BaseException = None):
+        if self.duration_ms is not None:
+            return
+        self.duration_ms = (time.perf_counter() - self._t0) * 1000
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        if self.sampled:
+            try:
+                _exporter.export(self)
+            except Exception as e:
+                logger.debug(f"Span export failed: {e}")
+
+    def context(self) -> str:
+        """Serialized "trace_id:span_id:sampled", for carrying across queues and processes."""
+        return f"{self.trace_id}:{self.span_id}:{int(self.sampled)}"
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.duration_ms, 3) if self.duration_ms is not None else None,
+            "attributes": self.attributes,
+            "error": self.error,
+            "pid": os.getpid(),
+        }
+
+
+# --- Exporters ---
+
+class SpanExporter:
+    """Receives finished, sampled spans. Subclass and pass to set_exporter() to ship spans elsewhere."""
+
+    def export(self, span: Span):
+        raise NotImplementedError
+
+    def shutdown(self):
+        pass
+
+
+class NullExporter(SpanExporter):
+    def export(self, span: Span):
+        pass
+
+
+class LogExporter(SpanExporter):
+    """One log line per span; handy while developing."""
+
+    def export(self, span: Span):
+        logger.info(
+            "span trace=%s name=%s ms=%.1f attrs=%s%s",
+            span.trace_id, span.name, span.duration_ms, span.attributes, f" error={span.error}" if span.error else ""
+        )
+
+
+class JsonlFileExporter(SpanExporter):
+    """Appends spans as JSON lines to a file for offline analysis (one write per span, safe across processes)."""
+
+    def __init__(self, path: str = TRACE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def export(self, span: Span):
+        line = (json.dumps(span.to_dict(), default=str) + "\n").encode()
+        with self._lock:
+            os.write(self._fd, line)
+
+    def shutdown(self):
+        os.close(self._fd)
+
+
+def get_exporter() -> SpanExporter:
+    if TRACE_EXPORTER == "jsonl":
+        return JsonlFileExporter(TRACE_FILE)
+    if TRACE_EXPORTER == "log":
+        return LogExporter()
+    return NullExporter()
+
+
+_exporter: SpanExporter = get_exporter()
+
+
+def set_exporter(exporter: SpanExporter):
+    global _exporter
+    _exporter.shutdown()
+    _exporter = exporter
+
+
+def enabled() -> bool:
+    return not isinstance(_exporter, NullExporter)
+
+
+# --- Context ---
+
+_current: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Span | None:
+    return _current.get()
+
+
+def current_trace_id() -> str | None:
+    span = _current.get()
+    return span.trace_id if span else None
+
+
+def current_context() -> str | None:
+    span = _current.get()
+    return span.context() if span else None
+
+
+def annotate(**attributes):
+    """Adds attributes to the current span, if any."""
+    span = _current.get()
+    if span is not None:
+        span.attributes.update(attributes)
+
+
+def start_span(name: str, parent: str = None, new_trace: bool = False, **attributes) -> Span:
+    """
+    Starts a span without making it current (end it with span.end()).
+    `parent` is a serialized context from current_context(); by default the current span is the parent.
+    """
+    if parent:
+        trace_id, parent_id, sampled = parent.split(":")
+        return Span(name, trace_id, parent_id, sampled == "1", attributes)
+    current = None if new_trace else _current.get()
+    if current is not None:
+        return Span(name, current.trace_id, current.span_id, current.sampled, attributes)
+    sampled = enabled() and (TRACE_SAMPLE_RATE >= 1 or random.random() < TRACE_SAMPLE_RATE)
+    return Span(name, uuid.uuid4().hex, None, sampled, attributes)
+
+
+@contextmanager
+def span(name: str, parent: str = None, new_trace: bool = False, **attributes):
+    """Times a block as a span, current for everything it calls (including awaited coroutines and tasks)."""
+    s = start_span(name, parent=parent, new_trace=new_trace, **attributes)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.end(error=e)
+        raise
+    finally:
+        _current.reset(token)
+        s.end()
+
+
+def traced(name: str = None, **attributes):
+    """Decorator form of span() for sync and async functions."""
+    def decorator(func):
+        span_name = name or func.__qualname__
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name, **attributes):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name, **attributes):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# --- ADK model callbacks: one span per LLM call ---
+
+_model_spans: dict[str, Span] = {}
+
+
+def before_model(callback_context, llm_request):
+    _model_spans[callback_context.invocation_id] = start_span("llm", model=llm_request.model)
+    return None
+
+
+def after_model(callback_context, llm_response):
+    # Streamed calls report each partial chunk; the span closes on the final response
+    if getattr(llm_response, "partial", False):
+        return None
+    s = _model_spans.pop(callback_context.invocation_id, None)
+    if s is not None:
+        usage = llm_response.usage_metadata
+        if usage is not None:
+            s.set(prompt_tokens=usage.prompt_token_count, output_tokens=usage.candidates_token_count)
+        s.end()
+    return None
+
+
+def on_model_error(callback_context, llm_request, error):
+    s = _model_spans.pop(callback_context.invocation_id, None)
+    if s is not None:
+        s.end(error=error)
+    return None
+
+
+# --- Celery propagation ---
+
+_task_spans: dict[str, tuple] = {}
+
+
+def install_celery_hooks():
+    """Carries the publisher's trace into Celery tasks and runs each task inside a span."""
+    from celery.signals import before_task_publish, task_prerun, task_postrun
+
+    @before_task_publish.connect(weak=False)
+    def _inject(headers=None, **kwargs):
+        ctx = current_context()
+        if ctx and headers is not None:
+            headers[CELERY_TRACE_HEADER] = ctx
+
+    @task_prerun.connect(weak=False)
+    def _start(task_id=None, task=None, **kwargs):
+        parent = getattr(task.request, CELERY_TRACE_HEADER, None) or (task.request.headers or {}).get(CELERY_TRACE_HEADER)
+        s = start_span(f"task.{task.name.rsplit('.', 1)[-1]}", parent=parent, new_trace=parent is None,
+                       task_id=task_id, retries=task.request.retries)
+        _task_spans[task_id] = (s, _current.set(s))
+
+    @task_postrun.connect(weak=False)
+    def _finish(task_id=None, state=None, **kwargs):
+        entry = _task_spans.pop(task_id, None)
+        if entry is None:
+            return
+        s, token = entry
+        s.set(state=state)
+        try:
+            _current.reset(token)
+        except ValueError:
+            _current.set(None)
+        s.end()
@@ -1,27 +1,249 @@
 import httpx
 import os
+import time
+import asyncio
 from dotenv import load_dotenv
+from app.config import logger
+from app.metrics import WHATSAPP_SEND_SECONDS, WHATSAPP_SENDS
+from app import tracing, ratelimit
 
 load_dotenv()
 
 WHATSAPP_PHONE_NUMBER_ID = os.getenv("WHATSAPP_PHONE_NUMBER_ID")
 WHATSAPP_ACCESS_TOKEN = os.getenv("WHATSAPP_ACCESS_TOKEN")
+WHATSAPP_API_BASE_URL = os.getenv("WHATSAPP_API_BASE_URL", "https://graph.facebook.com/v17.0")
 
-async def send_whatsapp_message(to_number: str, message: str):
-    url = f"https://graph.facebook.com/v17.0/{WHATSAPP_PHONE_NUMBER_ID}/messages"
-    headers = {
-        "Authorization": f"Bearer {WHATSAPP_ACCESS_TOKEN}",
-        "Content-Type": "application/json"
-    }
+# Connection pool sizing for the shared Graph API client
+WHATSAPP_MAX_CONNECTIONS = int(os.getenv("WHATSAPP_MAX_CONNECTIONS", "50"))
+WHATSAPP_MAX_KEEPALIVE = int(os.getenv("WHATSAPP_MAX_KEEPALIVE", "20"))
+WHATSAPP_KEEPALIVE_EXPIRY = float(os.getenv("WHATSAPP_KEEPALIVE_EXPIRY", "60"))
+WHATSAPP_TIMEOUT = float(os.getenv("WHATSAPP_TIMEOUT", "10"))
+
+# How long to back off after a Graph 429 that carries no Retry-After header
+WHATSAPP_RETRY_AFTER_SECONDS = float(os.getenv("WHATSAPP_RETRY_AFTER_SECONDS", "60"))
+
+# Cloud API limit on a text message body
+WHATSAPP_MAX_BODY_CHARS = 4096
+# A streamed reply is flushed once this much complete text (whole paragraphs) is buffered
+WHATSAPP_STREAM_MIN_CHARS = int(os.getenv("WHATSAPP_STREAM_MIN_CHARS", "200"))
+
+_client: httpx.AsyncClient | None = None
+
+
+class WhatsAppSendError(Exception):
+    """Raised when the Graph API refuses a message for a reason worth retrying (5xx)."""
+
+    def __init__(self, status: int, body: str):
+        super().__init__(f"Graph API returned {status}: {body[:200]}")
+        self.status = status
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _build_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=WHATSAPP_API_BASE_URL,
+        headers={
+            "Authorization": f"Bearer {WHATSAPP_ACCESS_TOKEN}",
+            "Content-Type": "application/json"
+        },
+        http2=_http2_available(),
+        limits=httpx.Limits(
+            max_connections=WHATSAPP_MAX_CONNECTIONS,
+            max_keepalive_connections=WHATSAPP_MAX_KEEPALIVE,
+            keepalive_expiry=WHATSAPP_KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(WHATSAPP_TIMEOUT, connect=5.0)
+    )
+
+
+async def open_client() -> httpx.AsyncClient:
+    """
+    Opens the process-wide Graph API client.
+    Called from the FastAPI lifespan hook and the Celery worker init hook.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+        logger.info(f"WhatsApp client opened (http2={_http2_available()})")
+    return _client
+
+
+async def close_client():
+    """Closes the shared client and releases pooled connections."""
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+
+
+def _find_cut(text: str, limit: int) -> int:
+    """Where to end the first part of text longer than `limit`; the rest starts at the same index."""
+    window = text[:limit + 1]
+    for sep in ("\n\n", "\n", ". ", " "):
+        pos = window.rfind(sep)
+        # Don't cut so early that parts become tiny
+        if pos > limit // 2:
+            return pos + (1 if sep == ". " else 0)
+    return limit
+
+
+def split_message(text: str, limit: int = WHATSAPP_MAX_BODY_CHARS) -> list[str]:
+    """
+    Splits text into parts of at most `limit` characters, preferring paragraph breaks,
+    then line breaks, then sentence ends, then spaces.
+    """
+    text = text.strip()
+    parts = []
+    while len(text) > limit:
+        cut = _find_cut(text, limit)
+        parts.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text:
+        parts.append(text)
+    return parts
+
+
+def _retry_after(response: httpx.Response) -> float:
+    try:
+        return max(0.0, float(response.headers["Retry-After"]))
+    except (KeyError, ValueError):
+        return WHATSAPP_RETRY_AFTER_SECONDS
+
+
+async def _post_text(client: httpx.AsyncClient, to_number: str, body: str):
     data = {
         "messaging_product": "whatsapp",
         "to": to_number,
         "type": "text",
-        "text": {"body": message}
+        "text": {"body": body}
     }
-    
-    async with httpx.AsyncClient() as client:
-        print(f"DEBUG: Sending message to WhatsApp API: {data}")
-        response = await client.post(url, headers=headers, json=data)
-        print(f"DEBUG: WhatsApp API Response: {response.status_code} - {response.text}")
-        return response.json()
+
+    await ratelimit.acquire("graph")
+    start = time.perf_counter()
+    with tracing.span("whatsapp.post", chars=len(body)) as span:
+        response = await client.post(f"/{WHATSAPP_PHONE_NUMBER_ID}/messages", json=data)
+        span.set(status=response.status_code)
+    elapsed = time.perf_counter() - start
+    elapsed_ms = elapsed * 1000
+    WHATSAPP_SEND_SECONDS.observe(elapsed)
+    WHATSAPP_SENDS.labels(str(response.status_code)).inc()
+
+    if response.is_error:
+        logger.warning(
+            "whatsapp.send status=%s to=%s chars=%d ms=%.1f body=%s",
+            response.status_code, to_number, len(body), elapsed_ms, response.text[:500]
+        )
+        # Transient failures must surface, or scheduled sends would be recorded as delivered
+        if response.status_code == 429:
+            raise ratelimit.RateLimited("graph", _retry_after(response))
+        if response.status_code >= 500:
+            raise WhatsAppSendError(response.status_code, response.text)
+    else:
+        logger.debug(
+            "whatsapp.send status=%s to=%s chars=%d ms=%.1f",
+            response.status_code, to_number, len(body), elapsed_ms
+        )
+    return response.json()
+
+
+async def send_whatsapp_message(to_number: str, message: str):
+    """
+    Sends a text message, split into ordered parts if it exceeds the body limit.
+    Raises RateLimited when Graph throttles a part (429) and WhatsAppSendError on 5xx.
+    """
+    client = await open_client()
+    result = None
+    with tracing.span("whatsapp.send", chars=len(message)) as span:
+        parts = split_message(message)
+        span.set(parts=len(parts))
+        for part in parts:
+            result = await _post_text(client, to_number, part)
+    return result
+
+
+async def send_typing_indicator(message_id: str):
+    """Marks an incoming message as read and shows the typing indicator until the reply arrives."""
+    client = await open_client()
+    data = {
+        "messaging_product": "whatsapp",
+        "status": "read",
+        "message_id": message_id,
+        "typing_indicator": {"type": "text"}
+    }
+    try:
+        # Cosmetic: skipped rather than waited for when the Graph budget is tight
+        await ratelimit.acquire("graph", max_wait=0)
+        response = await client.post(f"/{WHATSAPP_PHONE_NUMBER_ID}/messages", json=data)
+        if response.is_error:
+            logger.debug("whatsapp.typing status=%s body=%s", response.status_code, response.text[:200])
+    except Exception as e:
+        logger.debug(f"Typing indicator failed: {e}")
+
+
+class ReplyStream:
+    """
+    Delivers an agent reply in parts while it is being generated.
+
+    Text is fed in as the runner emits it; whenever at least `min_chars` of complete
+    paragraphs are buffered they are queued for sending. A single sender task posts the
+    parts in order, so generation never waits on the Graph API.
+    """
+
+    def __init__(self, to_number: str, min_chars: int = WHATSAPP_STREAM_MIN_CHARS):
+        self.to_number = to_number
+        self.min_chars = min_chars
+        self.parts_sent = 0
+        self.first_part_at: float | None = None
+        self._buffer = ""
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._sender: asyncio.Task | None = None
+
+    def feed(self, text: str):
+        self._buffer += text
+        cut = self._buffer.rfind("\n\n")
+        if cut >= self.min_chars or len(self._buffer) > WHATSAPP_MAX_BODY_CHARS:
+            if cut < self.min_chars:
+                # One oversized paragraph: send whole parts, keeping the unfinished tail as it arrived
+                # so whitespace at its start survives until the next chunk is appended
+                while len(self._buffer) > WHATSAPP_MAX_BODY_CHARS:
+                    cut = _find_cut(self._buffer, WHATSAPP_MAX_BODY_CHARS)
+                    part, self._buffer = self._buffer[:cut], self._buffer[cut:]
+                    self._enqueue(part)
+            else:
+                part, self._buffer = self._buffer[:cut], self._buffer[cut + 2:]
+                self._enqueue(part)
+
+    def _enqueue(self, part: str):
+        if not part.strip():
+            return
+        if self._sender is None:
+            self._sender = asyncio.create_task(self._send_loop())
+        self._queue.put_nowait(part)
+
+    async def _send_loop(self):
+        while True:
+            part = await self._queue.get()
+            if part is None:
+                return
+            try:
+                await send_whatsapp_message(self.to_number, part)
+                self.parts_sent += 1
+                if self.first_part_at is None:
+                    self.first_part_at = time.monotonic()
+            except Exception as e:
+                logger.error(f"Failed to send reply part to {self.to_number}: {e}")
+
+    async def close(self):
+        """Sends whatever is left and waits until every part has been delivered."""
+        self._enqueue(self._buffer)
+        self._buffer = ""
+        if self._sender is not None:
+            self._queue.put_nowait(None)
+            await self._sender
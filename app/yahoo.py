@@ -0,0 +1,89 @@
+import os
+import asyncio
+import weakref
+import httpx
+from app.config import logger
+from app.whatsapp import _http2_available
+from app import tracing, ratelimit
+
+YAHOO_TIMEOUT = float(os.getenv("YAHOO_TIMEOUT", "10"))
+
+# Overridable so the app can be pointed at a local replay server (bench/yahoo_replay.py)
+YAHOO_QUERY1_URL = os.getenv("YAHOO_QUERY1_URL", "https://query1.finance.yahoo.com")
+YAHOO_QUERY2_URL = os.getenv("YAHOO_QUERY2_URL", "https://query2.finance.yahoo.com")
+YAHOO_COOKIE_URL = os.getenv("YAHOO_COOKIE_URL", "https://fc.yahoo.com")
+
+_CRUMB_URL = f"{YAHOO_QUERY1_URL}/v1/test/getcrumb"
+_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36",
+    "Accept": "application/json,text/plain,*/*",
+}
+
+
+class YahooSession:
+    """Async Yahoo Finance client with the cookie + crumb pair the quote endpoints require."""
+
+    def __init__(self):
+        self.client = httpx.AsyncClient(
+            headers=_HEADERS,
+            http2=_http2_available(),
+            follow_redirects=True,
+            timeout=httpx.Timeout(YAHOO_TIMEOUT, connect=5.0),
+        )
+        self.crumb: str | None = None
+        self._crumb_lock = asyncio.Lock()
+
+    async def get_crumb(self, refresh: bool = False) -> str:
+        async with self._crumb_lock:
+            if self.crumb is None or refresh:
+                # Sets the consent cookie; the page itself is a 404
+                await self.client.get(YAHOO_COOKIE_URL)
+                response = await self.client.get(_CRUMB_URL)
+                response.raise_for_status()
+                crumb = response.text.strip()
+                if not crumb or "<" in crumb:
+                    raise RuntimeError("Yahoo returned no crumb")
+                self.crumb = crumb
+            return self.crumb
+
+    async def get_json(self, url: str, params: dict = None, crumb: bool = False) -> dict:
+        """GETs a Yahoo JSON endpoint, fetching (and on 401 refreshing) the crumb when needed."""
+        params = dict(params or {})
+        for attempt in range(2):
+            if crumb:
+                params["crumb"] = await self.get_crumb(refresh=attempt > 0)
+            await ratelimit.acquire("yahoo")
+            with tracing.span("yahoo.get", path=httpx.URL(url).path) as span:
+                response = await self.client.get(url, params=params)
+                span.set(status=response.status_code, attempt=attempt)
+            if response.status_code in (401, 403) and crumb and attempt == 0:
+                logger.info("Yahoo crumb rejected; refreshing")
+                continue
+            response.raise_for_status()
+            return response.json()
+        response.raise_for_status()
+        return response.json()
+
+
+# httpx pools are bound to the loop that opened them, so keep one session per loop
+_sessions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, YahooSession]" = weakref.WeakKeyDictionary()
+
+
+def get_session() -> YahooSession:
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None:
+        session = YahooSession()
+        _sessions[loop] = session
+    return session
+
+
+async def get_json(url: str, params: dict = None, crumb: bool = False) -> dict:
+    return await get_session().get_json(url, params, crumb)
+
+
+async def close_session():
+    """Closes the Yahoo session bound to the running loop, if any."""
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.client.aclose()
@@ -0,0 +1,136 @@
+# Stand-in for Gemini in load tests: an ADK model that follows scripted tool-call
+# sequences with configurable latency, so agent turns exercise the real tools, cache
+# and reply streaming without spending quota. Importing this module registers it for
+# model names matching "fake-*" (set AGENT_MODEL=fake-llm).
+import os
+import re
+import json
+import asyncio
+import random
+from typing import AsyncGenerator
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.adk.models.registry import LLMRegistry
+from google.adk.models._capabilities import LlmCapabilities
+from google.genai import types
+from prometheus_client import Counter
+from app.compaction import estimate_tokens
+
+# Time to the first chunk of every model call, with +/- jitter
+FAKE_LLM_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", "400"))
+FAKE_LLM_JITTER_MS = float(os.getenv("FAKE_LLM_JITTER_MS", "100"))
+# Streamed replies: number of chunks and the delay between them
+FAKE_LLM_STREAM_CHUNKS = int(os.getenv("FAKE_LLM_STREAM_CHUNKS", "6"))
+FAKE_LLM_CHUNK_MS = float(os.getenv("FAKE_LLM_CHUNK_MS", "60"))
+# Optional JSON file of extra scripts, tried before the built-in ones (see SCRIPTS)
+FAKE_LLM_SCRIPT = os.getenv("FAKE_LLM_SCRIPT")
+
+LLM_CALLS = Counter("fake_llm_calls_total", "Model calls served by the fake LLM", ["kind"])
+
+# Each script maps a user message pattern to a list of steps; a step is the list of tool
+# calls the model makes in one response (several calls run in parallel). Argument values
+# are formatted with the pattern's named groups. After the last step the model answers.
+SCRIPTS = [
+    {"pattern": r"compare \$?(?P<a>[\w.^-]+) (?:and|with|vs\.?) \$?(?P<b>[\w.^-]+)",
+     "steps": [[{"name": "get_yahoo_finance_data", "args": {"symbol": "{a}"}},
+                {"name": "get_yahoo_finance_data", "args": {"symbol": "{b}"}}]]},
+    {"pattern": r"how is \$?(?P<s>[\w.^-]+) doing",
+     "steps": [[{"name": "get_yahoo_finance_data", "args": {"symbol": "{s}"}},
+                {"name": "search_finance_news", "args": {"query": "{s} stock"}}]]},
+    {"pattern": r"news (?:about|on|for) (?P<q>.+?)[?.!]*$",
+     "steps": [[{"name": "search_finance_news", "args": {"query": "{q}"}}]]},
+    {"pattern": r"(?P<syms>(?:\$?[A-Z]{1,5} ){2,}\$?[A-Z]{1,5}) overview",
+     "steps": [[{"name": "get_multi_tickers_data", "args": {"symbols_string": "{syms}"}}],
+               [{"name": "search_finance_news", "args": {"query": "market today"}}]]},
+    {"pattern": r"(?P<sector>technology|healthcare|energy|financial-services) sector",
+     "steps": [[{"name": "get_sector_analysis", "args": {"sector_name": "{sector}"}}]]},
+]
+
+_FILLER = (
+    "Markets are weighing earnings momentum against rate expectations. "
+    "Volatility remains moderate and breadth has improved over the past sessions. "
+)
+
+
+def _load_scripts() -> list[dict]:
+    scripts = list(SCRIPTS)
+    if FAKE_LLM_SCRIPT:
+        with open(FAKE_LLM_SCRIPT) as f:
+            scripts = json.load(f) + scripts
+    return [dict(s, regex=re.compile(s["pattern"], re.IGNORECASE)) for s in scripts]
+
+
+def _user_text(content: types.Content) -> str:
+    return "".join(p.text or "" for p in content.parts or [] if not p.function_response)
+
+
+class FakeLlm(BaseLlm):
+    """Scripted, latency-configurable model for benchmarks."""
+
+    @classmethod
+    def supported_models(cls) -> list[str]:
+        return [r"fake-.*"]
+
+    @property
+    def capabilities(self) -> LlmCapabilities:
+        return LlmCapabilities(output_schema_and_tools=False)
+
+    def _plan(self, llm_request: LlmRequest) -> tuple[list[dict], list[str]]:
+        """Returns (tool calls for this response, or [] to answer) and the tool results so far."""
+        contents = llm_request.contents or []
+        # The turn starts at the last plain user message
+        start = max((i for i, c in enumerate(contents) if c.role == "user" and _user_text(c).strip()), default=0)
+        text = _user_text(contents[start]) if contents else ""
+        text = text.split(": ", 1)[-1]
+        responses = [
+            str((p.function_response.response or {}).get("result", p.function_response.response))
+            for c in contents[start + 1:] for p in c.parts or [] if p.function_response
+        ]
+        steps_done = sum(1 for c in contents[start + 1:] if any(p.function_call for p in c.parts or []))
+
+        for script in _SCRIPTS:
+            m = script["regex"].search(text)
+            if m:
+                if steps_done < len(script["steps"]):
+                    groups = {k: v.strip() for k, v in m.groupdict().items() if v}
+                    return [
+                        {"name": call["name"], "args": {k: v.format(**groups) if isinstance(v, str) else v
+                                                        for k, v in call["args"].items()}}
+                        for call in script["steps"][steps_done]
+                    ], responses
+                break
+        return [], responses
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        await asyncio.sleep(max(0.0, FAKE_LLM_LATENCY_MS + random.uniform(-FAKE_LLM_JITTER_MS, FAKE_LLM_JITTER_MS)) / 1000)
+        calls, results = self._plan(llm_request)
+        # Sized like a real prompt: history, tool results and system instruction
+        instruction = llm_request.config.system_instruction if llm_request.config else None
+        prompt_tokens = estimate_tokens(llm_request.contents or []) + len(str(instruction or "")) // 4
+        usage = types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=prompt_tokens, candidates_token_count=60, total_token_count=prompt_tokens + 60
+        )
+
+        if calls:
+            LLM_CALLS.labels("tool_calls").inc()
+            parts = [types.Part(function_call=types.FunctionCall(name=c["name"], args=c["args"])) for c in calls]
+            yield LlmResponse(content=types.Content(role="model", parts=parts), usage_metadata=usage, turn_complete=True)
+            return
+
+        LLM_CALLS.labels("answer").inc()
+        paragraphs = [r.strip()[:300] for r in results if r.strip()] or ["Happy to help with stocks, sectors and market news."]
+        reply = "\n\n".join(paragraphs + [_FILLER * 2, "⚠️ For educational purposes only, not financial advice."])
+        if stream:
+            size = max(1, len(reply) // max(1, FAKE_LLM_STREAM_CHUNKS))
+            for i in range(0, len(reply), size):
+                yield LlmResponse(content=types.Content(role="model", parts=[types.Part(text=reply[i:i + size])]), partial=True)
+                await asyncio.sleep(FAKE_LLM_CHUNK_MS / 1000)
+        yield LlmResponse(content=types.Content(role="model", parts=[types.Part(text=reply)]),
+                          usage_metadata=usage, turn_complete=True)
+
+
+_SCRIPTS = _load_scripts()
+LLMRegistry.register(FakeLlm)
@@ -0,0 +1,51 @@
+# Local stand-in for the WhatsApp Cloud (Graph) API. Accepts message sends on
+# /{phone_number_id}/messages with a configurable latency, and reports every text it
+# receives to an optional callback so the load generator can time replies.
+#
+#   python -m bench.graph_mock --port 8101
+#
+# Point the app at it with WHATSAPP_API_BASE_URL=http://127.0.0.1:8101.
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from collections import Counter
+from typing import Callable
+from fastapi import FastAPI, Request
+
+
+def create_app(on_text: Callable[[str, str, float], None] = None, latency_ms: float = 120,
+               jitter_ms: float = 60, error_rate: float = 0.0) -> FastAPI:
+    app = FastAPI()
+    app.state.calls = Counter()
+
+    @app.post("/{phone_number_id}/messages")
+    async def send(phone_number_id: str, request: Request):
+        payload = await request.json()
+        await asyncio.sleep(max(0.0, latency_ms + random.uniform(-jitter_ms, jitter_ms)) / 1000)
+        if payload.get("status") == "read":
+            app.state.calls["read_receipt"] += 1
+            return {"success": True}
+        if error_rate and random.random() < error_rate:
+            app.state.calls["error"] += 1
+            return {"error": {"message": "Injected failure", "code": 131000}}
+        app.state.calls[payload.get("type", "unknown")] += 1
+        if payload.get("type") == "text" and on_text is not None:
+            on_text(payload.get("to"), payload["text"]["body"], time.monotonic())
+        return {"messaging_product": "whatsapp", "messages": [{"id": f"wamid.bench.{uuid.uuid4().hex}"}]}
+
+    @app.get("/_bench/stats")
+    async def stats():
+        return dict(app.state.calls)
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+    parser = argparse.ArgumentParser(description="Mock WhatsApp Graph API")
+    parser.add_argument("--port", type=int, default=8101)
+    parser.add_argument("--latency-ms", type=float, default=120)
+    args = parser.parse_args()
+    uvicorn.run(create_app(latency_ms=args.latency_ms), port=args.port, log_level="warning")
@@ -0,0 +1,430 @@
+# Offline load test: starts the API against the fake LLM (bench/fake_llm.py), a Yahoo
+# replay server and a mock Graph API, replays synthetic multi-user webhook traffic at a
+# target rate, and reports ack latency, reply latency percentiles, throughput, upstream
+# call counts and cache hit ratios. Results are appended to a history file and compared
+# with the previous run of the same scenario, so regressions show up across commits.
+#
+#   REDIS_URL=redis://localhost:6379/15 python -m bench.load_test --users 50 --rate 5 --duration 60
+#
+# Needs a Redis the app can use (a dedicated DB: --flush-redis empties it first) and
+# app/agent_config.json. Nothing leaves the machine unless the app falls back to yfinance.
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import subprocess
+from collections import Counter
+import httpx
+import uvicorn
+from prometheus_client.parser import text_string_to_metric_families
+from bench import graph_mock, yahoo_replay
+
+# Popular names get most of the traffic, like real users
+TICKERS = [
+    "AAPL", "NVDA", "MSFT", "TSLA", "AMZN", "GOOGL", "META", "AMD", "NFLX", "AVGO",
+    "PLTR", "COIN", "JPM", "V", "KO", "DIS", "INTC", "UBER", "SHOP", "CRM",
+    "ORCL", "ADBE", "QCOM", "PYPL", "WMT", "COST", "XOM", "LLY", "BA", "SMCI",
+]
+_TICKER_WEIGHTS = [1 / (i + 1) for i in range(len(TICKERS))]
+
+# (weight, template); templates matching the router skip the LLM, the rest follow
+# the fake LLM's scripts
+MESSAGE_MIX = [
+    (25, "price of {a}"),
+    (10, "${a}"),
+    (20, "how is {a} doing?"),
+    (15, "compare {a} and {b}"),
+    (10, "news about {a}"),
+    (10, "{a} {b} {c} overview"),
+    (10, "what should I watch in the market this week?"),
+]
+
+_METRIC_FAMILIES = (
+    "cache_requests", "router_requests", "fake_llm_calls", "upstream_calls", "whatsapp_sends", "tool_errors",
+)
+
+
+def pct(values: list[float], p: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))], 1)
+
+
+def summarize(values: list[float]) -> dict:
+    return {"n": len(values), "p50": pct(values, 50), "p90": pct(values, 90), "p95": pct(values, 95),
+            "p99": pct(values, 99), "max": round(max(values), 1) if values else None}
+
+
+def make_message() -> tuple[str, str]:
+    """Returns (template, text)."""
+    template = random.choices([t for _, t in MESSAGE_MIX], weights=[w for w, _ in MESSAGE_MIX])[0]
+    a, b, c = random.choices(TICKERS, weights=_TICKER_WEIGHTS, k=3)
+    return template, template.format(a=a, b=b, c=c)
+
+
+def webhook_payload(from_number: str, text: str) -> dict:
+    return {"object": "whatsapp_business_account", "entry": [{"changes": [{"value": {
+        "messaging_product": "whatsapp",
+        "messages": [{"from": from_number, "id": f"wamid.bench.{uuid.uuid4().hex}", "type": "text",
+                      "timestamp": str(int(time.time())), "text": {"body": text}}],
+    }}]}]}
+
+
+def scrape(metrics_text: str) -> dict:
+    """Counter samples of interest as {"family{label=value,...}": value}."""
+    samples = {}
+    for family in text_string_to_metric_families(metrics_text):
+        if family.name not in _METRIC_FAMILIES:
+            continue
+        for sample in family.samples:
+            if sample.name.endswith("_total"):
+                labels = ",".join(f"{k}={v}" for k, v in sorted(sample.labels.items()))
+                samples[f"{family.name}{{{labels}}}"] = sample.value
+    return samples
+
+
+def git_revision() -> tuple[str, bool]:
+    try:
+        sha = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], text=True).strip())
+        return sha, dirty
+    except Exception:
+        return "unknown", False
+
+
+class User:
+    __slots__ = ("number", "kind", "text", "sent_at", "first_at", "last_at", "parts")
+
+    def __init__(self, number: str):
+        self.number = number
+        self.kind = None
+        self.text = None
+        self.sent_at = None
+        self.first_at = None
+        self.last_at = None
+        self.parts = 0
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.users = {f"1555{i:07d}": User(f"1555{i:07d}") for i in range(args.users)}
+        self.idle = list(self.users)
+        self.ack_ms: list[float] = []
+        self.first_ms: list[float] = []
+        self.complete_ms: list[float] = []
+        self.by_kind: dict[str, list[float]] = {}
+        self.counts = Counter()
+        self.unexpected_parts = 0
+
+    # --- Stand-in servers ---
+
+    def on_text(self, to: str, body: str, at: float):
+        user = self.users.get(to)
+        if user is None or user.sent_at is None:
+            self.unexpected_parts += 1
+            return
+        if user.first_at is None:
+            user.first_at = at
+        user.last_at = at
+        user.parts += 1
+
+    async def start_server(self, app, port: int) -> uvicorn.Server:
+        server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        self._tasks.append(asyncio.create_task(server.serve()))
+        while not server.started:
+            await asyncio.sleep(0.05)
+        return server
+
+    def start_app(self) -> subprocess.Popen:
+        a = self.args
+        env = dict(
+            os.environ,
+            AGENT_MODEL="fake-llm",
+            FAKE_LLM_LATENCY_MS=str(a.llm_latency_ms),
+            WHATSAPP_API_BASE_URL=f"http://127.0.0.1:{a.graph_port}",
+            WHATSAPP_PHONE_NUMBER_ID="bench",
+            WHATSAPP_ACCESS_TOKEN="bench",
+            YAHOO_QUERY1_URL=f"http://127.0.0.1:{a.yahoo_port}",
+            YAHOO_QUERY2_URL=f"http://127.0.0.1:{a.yahoo_port}",
+            YAHOO_COOKIE_URL=f"http://127.0.0.1:{a.yahoo_port}/",
+        )
+        # Single process: the default registry is the whole picture
+        env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+        if a.debounce is not None:
+            env["MAILBOX_DEBOUNCE_SECONDS"] = str(a.debounce)
+        log = open(a.server_log, "w")
+        return subprocess.Popen([sys.executable, "-m", "bench.server", "--port", str(a.app_port)],
+                                env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    async def wait_ready(self, client: httpx.AsyncClient, proc: subprocess.Popen | None):
+        deadline = time.monotonic() + 90
+        while time.monotonic() < deadline:
+            if proc is not None and proc.poll() is not None:
+                raise RuntimeError(f"App exited with {proc.returncode}; see {self.args.server_log}")
+            try:
+                if (await client.get("/")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.25)
+        raise RuntimeError("App did not become ready in 90s")
+
+    # --- Traffic ---
+
+    async def send_one(self, client: httpx.AsyncClient):
+        if not self.idle:
+            # Every synthetic user is waiting for a reply: the system is saturated
+            self.counts["dropped_busy"] += 1
+            return
+        user = self.users[self.idle.pop(random.randrange(len(self.idle)))]
+        user.kind, user.text = make_message()
+        user.first_at = user.last_at = None
+        user.parts = 0
+        user.sent_at = time.monotonic()
+        self.counts["sent"] += 1
+        try:
+            response = await client.post("/webhook", json=webhook_payload(user.number, user.text))
+            self.ack_ms.append((time.monotonic() - user.sent_at) * 1000)
+            if response.status_code != 200 or response.json().get("status") != "ok":
+                self.counts["ack_errors"] += 1
+        except httpx.HTTPError:
+            self.counts["ack_errors"] += 1
+
+    def _finish(self, user: User, result: str):
+        if result == "completed":
+            first = (user.first_at - user.sent_at) * 1000
+            self.first_ms.append(first)
+            self.complete_ms.append((user.last_at - user.sent_at) * 1000)
+            self.by_kind.setdefault(user.kind, []).append(first)
+            self.counts["reply_parts"] += user.parts
+        self.counts[result] += 1
+        user.sent_at = None
+        self.idle.append(user.number)
+
+    async def track_replies(self):
+        """A reply is complete once no part has arrived for the settle period."""
+        while True:
+            now = time.monotonic()
+            for user in self.users.values():
+                if user.sent_at is None:
+                    continue
+                if user.last_at is not None and now - user.last_at >= self.args.settle:
+                    self._finish(user, "completed")
+                elif now - user.sent_at >= self.args.timeout:
+                    self._finish(user, "timeouts")
+            await asyncio.sleep(0.05)
+
+    async def run(self) -> dict:
+        a = self.args
+        self._tasks = []
+        graph = await self.start_server(graph_mock.create_app(self.on_text, latency_ms=a.graph_latency_ms), a.graph_port)
+        yahoo = await self.start_server(
+            yahoo_replay.create_app(a.fixtures, latency_ms=a.yahoo_latency_ms, strict=a.strict_replay), a.yahoo_port)
+
+        if a.flush_redis:
+            import redis
+            redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0")).flushdb()
+
+        proc = None if a.app_url else self.start_app()
+        base_url = a.app_url or f"http://127.0.0.1:{a.app_port}"
+        limits = httpx.Limits(max_connections=200, max_keepalive_connections=50)
+        try:
+            async with httpx.AsyncClient(base_url=base_url, timeout=30, limits=limits) as client:
+                await self.wait_ready(client, proc)
+                before = scrape((await client.get("/metrics")).text)
+                tracker = asyncio.create_task(self.track_replies())
+
+                print(f"Sending ~{a.rate}/s from {a.users} users for {a.duration}s against {base_url}", file=sys.stderr)
+                started = time.monotonic()
+                sends = set()
+                next_at = started
+                while time.monotonic() - started < a.duration:
+                    next_at += random.expovariate(a.rate)
+                    await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+                    task = asyncio.create_task(self.send_one(client))
+                    sends.add(task)
+                    task.add_done_callback(sends.discard)
+                if sends:
+                    await asyncio.wait(sends)
+                sending_seconds = time.monotonic() - started
+
+                # Let in-flight turns finish
+                deadline = time.monotonic() + a.timeout + a.settle
+                while any(u.sent_at is not None for u in self.users.values()) and time.monotonic() < deadline:
+                    await asyncio.sleep(0.1)
+                elapsed = time.monotonic() - started
+                tracker.cancel()
+
+                after = scrape((await client.get("/metrics")).text)
+                stats = (await client.get("/stats")).json()
+        finally:
+            if proc is not None:
+                proc.terminate()
+                try:
+                    proc.wait(timeout=15)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+            for server in (graph, yahoo):
+                server.should_exit = True
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        deltas = {k: v - before.get(k, 0) for k, v in after.items() if v - before.get(k, 0)}
+        return self.report(deltas, stats, yahoo.config.app, graph.config.app, sending_seconds, elapsed)
+
+    # --- Report ---
+
+    def report(self, deltas: dict, stats: dict, yahoo_app, graph_app, sending_seconds: float, elapsed: float) -> dict:
+        a = self.args
+        cache = {}
+        for key, value in deltas.items():
+            if key.startswith("cache_requests{"):
+                labels = dict(kv.split("=", 1) for kv in key[len("cache_requests{"):-1].split(","))
+                cache.setdefault(labels["function"], Counter())[labels["result"]] += value
+        cache_report = {
+            fn: {"requests": int(sum(c.values())),
+                 "hit_ratio": round((c["l1"] + c["hit"] + c["stale"]) / sum(c.values()), 3),
+                 **{k: int(v) for k, v in c.items()}}
+            for fn, c in sorted(cache.items())
+        }
+        sha, dirty = git_revision()
+        return {
+            "commit": sha,
+            "dirty": dirty,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "scenario": {
+                "users": a.users, "rate": a.rate, "duration": a.duration, "llm_latency_ms": a.llm_latency_ms,
+                "yahoo_latency_ms": a.yahoo_latency_ms, "graph_latency_ms": a.graph_latency_ms, "debounce": a.debounce,
+            },
+            "messages": {k: int(v) for k, v in sorted(self.counts.items())},
+            "achieved_send_rate": round(self.counts["sent"] / sending_seconds, 2),
+            "throughput_rps": round(len(self.complete_ms) / elapsed, 2),
+            "ack_ms": summarize(self.ack_ms),
+            "first_reply_ms": summarize(self.first_ms),
+            "complete_reply_ms": summarize(self.complete_ms),
+            "first_reply_by_message": {kind: summarize(v) for kind, v in sorted(self.by_kind.items())},
+            "upstream": {
+                "yahoo": dict(yahoo_app.state.calls),
+                "yahoo_sources": dict(yahoo_app.state.sources),
+                "graph": dict(graph_app.state.calls),
+                "metrics": {k: int(v) for k, v in sorted(deltas.items())
+                            if k.startswith(("upstream_calls", "fake_llm_calls", "tool_errors"))},
+            },
+            "cache": cache_report,
+            "router": stats.get("router"),
+            "unexpected_reply_parts": self.unexpected_parts,
+        }
+
+
+# Metrics compared against the previous run; higher is worse unless listed in _HIGHER_IS_BETTER
+_TRACKED = [
+    ("ack_ms", "p95"), ("first_reply_ms", "p50"), ("first_reply_ms", "p95"),
+    ("complete_reply_ms", "p95"), ("throughput_rps", None),
+]
+_HIGHER_IS_BETTER = {"throughput_rps"}
+
+
+def compare(report: dict, history_path: str, threshold: float) -> list[str]:
+    """Prints deltas against the last run with the same scenario; returns the regressions."""
+    previous = None
+    if os.path.exists(history_path):
+        with open(history_path) as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry.get("scenario") == report["scenario"]:
+                    previous = entry
+    if previous is None:
+        print("No previous run with this scenario to compare against.")
+        return []
+
+    print(f"\nCompared with {previous['commit']} ({previous['timestamp']}):")
+    regressions = []
+    for section, key in _TRACKED:
+        old = previous[section][key] if key else previous[section]
+        new = report[section][key] if key else report[section]
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = -change if section in _HIGHER_IS_BETTER else change
+        flag = "  REGRESSION" if worse > threshold else ""
+        name = f"{section}.{key}" if key else section
+        print(f"  {name:<24} {old:>10} -> {new:<10} ({change:+.1%}){flag}")
+        if flag:
+            regressions.append(name)
+    for fn, current in report["cache"].items():
+        old = previous.get("cache", {}).get(fn, {}).get("hit_ratio")
+        if old is not None and current["hit_ratio"] < old - threshold:
+            print(f"  cache.{fn}.hit_ratio        {old} -> {current['hit_ratio']}  REGRESSION")
+            regressions.append(f"cache.{fn}.hit_ratio")
+    return regressions
+
+
+def print_summary(report: dict):
+    m = report["messages"]
+    print(f"\nCommit {report['commit']}{' (dirty)' if report['dirty'] else ''}  scenario {report['scenario']}")
+    print(f"Messages: sent {m.get('sent', 0)}, completed {m.get('completed', 0)}, timeouts {m.get('timeouts', 0)}, "
+          f"dropped (all users busy) {m.get('dropped_busy', 0)}, ack errors {m.get('ack_errors', 0)}")
+    print(f"Send rate {report['achieved_send_rate']}/s, throughput {report['throughput_rps']} replies/s")
+    for name in ("ack_ms", "first_reply_ms", "complete_reply_ms"):
+        s = report[name]
+        print(f"  {name:<18} p50 {s['p50']}  p90 {s['p90']}  p95 {s['p95']}  p99 {s['p99']}  max {s['max']}")
+    print("First reply p50/p95 by message type:")
+    for kind, s in report["first_reply_by_message"].items():
+        print(f"  {kind:<45} n={s['n']:<5} {s['p50']} / {s['p95']} ms")
+    print(f"Upstream: yahoo {report['upstream']['yahoo']}, graph {report['upstream']['graph']}")
+    for key, value in report["upstream"]["metrics"].items():
+        print(f"  {key} {value}")
+    print("Cache hit ratios:")
+    for fn, c in report["cache"].items():
+        print(f"  {fn:<28} {c['hit_ratio']:.1%} of {c['requests']}")
+    print(f"Router: {report['router']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for the WhatsApp agent API")
+    parser.add_argument("--users", type=int, default=50, help="synthetic users (each has one message in flight)")
+    parser.add_argument("--rate", type=float, default=5, help="target messages per second (Poisson arrivals)")
+    parser.add_argument("--duration", type=float, default=60, help="seconds of traffic")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for a reply")
+    parser.add_argument("--settle", type=float, default=1.0, help="quiet seconds after the last part that end a reply")
+    parser.add_argument("--llm-latency-ms", type=float, default=400)
+    parser.add_argument("--yahoo-latency-ms", type=float, default=80)
+    parser.add_argument("--graph-latency-ms", type=float, default=120)
+    parser.add_argument("--debounce", type=float, help="override MAILBOX_DEBOUNCE_SECONDS for the app")
+    parser.add_argument("--fixtures", default=yahoo_replay.DEFAULT_FIXTURES, help="recorded Yahoo responses")
+    parser.add_argument("--strict-replay", action="store_true", help="only serve recorded Yahoo responses")
+    parser.add_argument("--app-url", help="use an already running app instead of starting one")
+    parser.add_argument("--app-port", type=int, default=8100)
+    parser.add_argument("--graph-port", type=int, default=8101)
+    parser.add_argument("--yahoo-port", type=int, default=8102)
+    parser.add_argument("--server-log", default="bench_server.log")
+    parser.add_argument("--flush-redis", action="store_true", help="FLUSHDB the app's Redis first (cold cache)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--history", default=os.path.join(os.path.dirname(__file__), "history.jsonl"),
+                        help="append the report here and compare with the previous run of the same scenario")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change reported as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    report = asyncio.run(LoadTest(args).run())
+    print_summary(report)
+    regressions = compare(report, args.history, args.threshold) if args.history else []
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.history:
+        with open(args.history, "a") as f:
+            f.write(json.dumps(report) + "\n")
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+# Scheduler scale benchmark: seeds a Redis DB with a synthetic reminder population,
+# then drives process_dynamic_subscriptions with a stubbed agent and sender. Reports
+# seeding cost and Redis memory per reminder, idle and busy tick duration, delivery
+# throughput and drift from each reminder's planned time (ticks and one in-process worker),
+# and list/cancel latency for the reminder tools.
+#
+#   REDIS_URL=redis://localhost:6379/15 python -m bench.scheduler_bench --sizes 10000,100000,1000000 --flush
+#
+# The DB is emptied between sizes, so point REDIS_URL at a dedicated database.
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tracemalloc
+from collections import deque
+
+TOPICS = [
+    "general market", "tech stocks", "ai stocks", "crypto", "energy", "banks", "dividends", "semiconductors",
+    "nvda", "aapl", "tsla", "oil prices", "gold", "bonds", "emerging markets", "ev stocks", "healthcare",
+    "real estate", "small caps", "s&p 500", "nasdaq", "india markets", "europe markets", "japan", "china tech",
+]
+INTERVALS = [300, 900, 3600, 3600 * 4, 86400]
+
+
+def pct(values: list[float], p: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))], 2)
+
+
+def summarize(values: list[float]) -> dict:
+    return {"n": len(values), "p50": pct(values, 50), "p95": pct(values, 95), "p99": pct(values, 99),
+            "max": round(max(values), 2) if values else None}
+
+
+def redis_memory(client) -> int | None:
+    try:
+        return int(client.info("memory")["used_memory"])
+    except Exception:
+        return None
+
+
+def seed(client, reminders, count: int, start_index: int, first_run: float, spread: float,
+         personalized_share: float, per_user: int, phone_prefix: str, batch: int = 5000) -> list[str]:
+    """Writes `count` reminders straight through a pipeline, in the layout create_reminder uses."""
+    phones = []
+    pipe = client.pipeline(transaction=False)
+    for i in range(count):
+        n = start_index + i
+        phone = f"{phone_prefix}{n // per_user:08d}"
+        if n % per_user == 0:
+            phones.append(phone)
+        reminder_id = f"b{n:010d}"
+        task = {
+            "phone_number": phone,
+            "topic": random.choice(TOPICS),
+            "interval_seconds": random.choice(INTERVALS),
+            "is_one_time": False,
+            "end_time": -1,
+            "personalized": random.random() < personalized_share,
+        }
+        pipe.hset(reminders._reminder_key(reminder_id), mapping=reminders._encode_reminder(task))
+        pipe.sadd(reminders._phone_key(phone), reminder_id)
+        pipe.zadd(reminders.SCHEDULE_KEY, {reminder_id: first_run + random.uniform(0, spread)})
+        if (i + 1) % batch == 0:
+            pipe.execute()
+    pipe.execute()
+    return phones
+
+
+class Harness:
+    """Runs ticks and deliveries in-process, with Celery dispatch, agent and sender stubbed out."""
+
+    def __init__(self, args):
+        self.args = args
+        from tasks import scheduled_tasks
+        self.st = scheduled_tasks
+        self.queue: deque = deque()
+        self.sent: list[tuple[str, float]] = []
+        self.agent_runs = 0
+
+        async def fake_agent_turn(user_id, prompt, session_id=None, source="reminder"):
+            self.agent_runs += 1
+            await asyncio.sleep(args.agent_ms / 1000)
+            return f"Update for {user_id}: {prompt[:40]}"
+
+        async def fake_send(to_number, message):
+            await asyncio.sleep(args.send_ms / 1000)
+            self.sent.append((to_number, time.time()))
+
+        scheduled_tasks.run_agent_turn = fake_agent_turn
+        scheduled_tasks.send_whatsapp_message = fake_send
+        for task in (scheduled_tasks.run_scheduled_reminder, scheduled_tasks.deliver_topic_digest):
+            task.apply_async = lambda args, _task=task, **options: self.queue.append((_task, tuple(args)))
+
+    def tick(self) -> tuple[float, int, float]:
+        """One beat tick. Returns (seconds, tasks dispatched, peak traced MB)."""
+        queued = len(self.queue)
+        tracemalloc.start()
+        started = time.perf_counter()
+        self.st.process_dynamic_subscriptions()
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+        return elapsed, len(self.queue) - queued, peak
+
+    def work_until(self, deadline: float) -> float:
+        """Executes queued deliveries until `deadline` (monotonic). Returns busy seconds."""
+        busy = 0.0
+        while self.queue and time.monotonic() < deadline:
+            task, args = self.queue.popleft()
+            started = time.perf_counter()
+            task(*args)
+            busy += time.perf_counter() - started
+        return busy
+
+
+def run_size(client, harness: Harness, size: int, args) -> dict:
+    from app import reminders, tools
+    result = {"size": size}
+
+    if args.flush:
+        client.flushdb()
+    elif client.dbsize():
+        sys.exit("Refusing to seed a non-empty Redis DB; pass --flush (it empties the DB) or use an empty one.")
+    client.set(reminders.MIGRATED_KEY, 1)
+
+    # Background population, all due in the future (1h..7d) so only the sweep touches it
+    memory_before = redis_memory(client)
+    started = time.perf_counter()
+    phones = seed(client, reminders, size, 0, time.time() + 3600, 6 * 86400,
+                  args.personalized, args.per_user, "1555")
+    seed_seconds = time.perf_counter() - started
+    memory_after = redis_memory(client)
+    result["seed"] = {"seconds": round(seed_seconds, 2), "per_second": round(size / seed_seconds)}
+    if memory_before is not None and memory_after is not None:
+        result["redis_memory"] = {"total_mb": round(memory_after / 1e6, 1),
+                                  "bytes_per_reminder": round((memory_after - memory_before) / size)}
+
+    # Idle tick: nothing due, so this is the cost of the sweep against the population
+    idle = [harness.tick()[0] * 1000 for _ in range(args.idle_ticks)]
+    result["idle_tick_ms"] = summarize(idle)
+
+    # Due wave: one reminder per fresh user, spread over the window, so drift is measurable
+    wave_start = time.time() + 1
+    seed(client, reminders, args.due, size, wave_start, args.window, args.personalized, 1, "1999")
+    planned = {str(phone): float(score) for phone, score in (
+        (json.loads(client.hget(reminders._reminder_key(member.decode()), "phone_number")), score)
+        for member, score in client.zrangebyscore(reminders.SCHEDULE_KEY, wave_start, wave_start + args.window, withscores=True)
+    )}
+    harness.sent.clear()
+    harness.agent_runs = 0
+
+    ticks, dispatched, peaks, busy = [], 0, [], 0.0
+    run_started = time.monotonic()
+    end = run_started + args.window + args.drain
+    next_tick = time.monotonic()
+    while time.monotonic() < end:
+        seconds, count, peak = harness.tick()
+        ticks.append(seconds * 1000)
+        peaks.append(peak)
+        dispatched += count
+        next_tick += args.tick_interval
+        busy += harness.work_until(next_tick)
+        if not harness.queue and len({p for p, _ in harness.sent if p in planned}) >= len(planned):
+            break
+        time.sleep(max(0.0, next_tick - time.monotonic()))
+
+    drift = [(at - planned[phone]) * 1000 for phone, at in harness.sent if phone in planned]
+    result["wave"] = {
+        "due": args.due,
+        "delivered": len(drift),
+        "tasks_dispatched": dispatched,
+        "agent_runs": harness.agent_runs,
+        "tick_ms": summarize(ticks),
+        "tick_peak_mb": round(max(peaks), 2) if peaks else None,
+        "worker_busy_seconds": round(busy, 2),
+        "deliveries_per_worker_second": round(len(drift) / busy, 1) if busy else None,
+        "drift_ms": summarize(drift),
+    }
+
+    # Tool latency against the background population
+    sample = random.sample(phones, min(args.tool_samples, len(phones)))
+    list_ms, cancel_ms = [], []
+    for phone in sample:
+        started = time.perf_counter()
+        tools.list_investment_schedules(phone)
+        list_ms.append((time.perf_counter() - started) * 1000)
+        reminder_id = reminders.list_reminders(phone)[0][0]
+        started = time.perf_counter()
+        tools.cancel_investment_reminders(phone, reminder_id=reminder_id)
+        cancel_ms.append((time.perf_counter() - started) * 1000)
+    result["list_ms"] = summarize(list_ms)
+    result["cancel_ms"] = summarize(cancel_ms)
+    return result
+
+
+def print_result(r: dict):
+    w = r["wave"]
+    mem = r.get("redis_memory", {})
+    print(f"\n== {r['size']:,} reminders ==")
+    print(f"  seed            {r['seed']['seconds']}s ({r['seed']['per_second']:,}/s)"
+          + (f", Redis {mem['total_mb']} MB, {mem['bytes_per_reminder']} B/reminder" if mem else ""))
+    print(f"  idle tick       p50 {r['idle_tick_ms']['p50']} ms  p95 {r['idle_tick_ms']['p95']} ms")
+    print(f"  busy tick       p50 {w['tick_ms']['p50']} ms  max {w['tick_ms']['max']} ms  peak {w['tick_peak_mb']} MB")
+    print(f"  wave            {w['delivered']}/{w['due']} delivered, {w['tasks_dispatched']} tasks, "
+          f"{w['agent_runs']} agent runs, {w['deliveries_per_worker_second']} deliveries/worker-s")
+    print(f"  drift           p50 {w['drift_ms']['p50']} ms  p95 {w['drift_ms']['p95']} ms  max {w['drift_ms']['max']} ms")
+    print(f"  list            p50 {r['list_ms']['p50']} ms  p95 {r['list_ms']['p95']} ms")
+    print(f"  cancel          p50 {r['cancel_ms']['p50']} ms  p95 {r['cancel_ms']['p95']} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reminder scheduler scale benchmark")
+    parser.add_argument("--sizes", default="10000,100000", help="comma-separated population sizes")
+    parser.add_argument("--per-user", type=int, default=3, help="reminders per synthetic user")
+    parser.add_argument("--personalized", type=float, default=0.1, help="share of personalized reminders")
+    parser.add_argument("--due", type=int, default=1000, help="reminders falling due during the window")
+    parser.add_argument("--window", type=float, default=20, help="seconds over which the due wave is spread")
+    parser.add_argument("--drain", type=float, default=60, help="extra seconds allowed to deliver the wave")
+    parser.add_argument("--tick-interval", type=float, default=1.0, help="seconds between beat ticks")
+    parser.add_argument("--idle-ticks", type=int, default=20)
+    parser.add_argument("--agent-ms", type=float, default=50, help="stubbed agent turn latency")
+    parser.add_argument("--send-ms", type=float, default=5, help="stubbed WhatsApp send latency")
+    parser.add_argument("--tool-samples", type=int, default=200, help="users to time list/cancel for")
+    parser.add_argument("--flush", action="store_true", help="FLUSHDB before each size")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="write the JSON results here")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    from app.store import redis_client
+    harness = Harness(args)
+    results = []
+    for size in (int(s) for s in args.sizes.split(",")):
+        result = run_size(redis_client, harness, size, args)
+        print_result(result)
+        results.append(result)
+    if args.flush:
+        redis_client.flushdb()
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+# Runs the FastAPI app for benchmarks with the fake LLM registered. The load generator
+# (bench/load_test.py) starts it with the stand-in URLs in the environment:
+#
+#   AGENT_MODEL=fake-llm WHATSAPP_API_BASE_URL=... YAHOO_QUERY1_URL=... python -m bench.server --port 8100
+import os
+import argparse
+import uvicorn
+import bench.fake_llm  # noqa: F401  (registers fake-* models with ADK)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Finance agent API with the fake LLM")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--keep-allowlist", action="store_true",
+                        help="enforce the allowlist (synthetic users are otherwise allowed)")
+    args = parser.parse_args()
+
+    if not args.keep_allowlist:
+        os.environ["ALLOWLIST_ENABLED"] = "false"
+    from app.main import app
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
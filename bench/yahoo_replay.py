@@ -0,0 +1,141 @@
+# Local stand-in for the Yahoo Finance endpoints the app calls over HTTP (quote, search,
+# quoteSummary, cookie + crumb). Serves recorded responses from a fixtures directory and
+# synthesizes deterministic ones for anything not recorded. With --record, requests are
+# forwarded to Yahoo and the responses saved as fixtures for later offline runs.
+#
+#   python -m bench.yahoo_replay --port 8102 [--fixtures bench/fixtures/yahoo] [--record]
+#
+# Point the app at it with YAHOO_QUERY1_URL / YAHOO_QUERY2_URL / YAHOO_COOKIE_URL.
+import os
+import json
+import random
+import asyncio
+import hashlib
+import argparse
+from collections import Counter
+from fastapi import FastAPI, Request, Response
+
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "yahoo")
+
+_REAL_HOSTS = {
+    "/v7/finance/quote": "https://query1.finance.yahoo.com",
+    "/v1/finance/search": "https://query2.finance.yahoo.com",
+    "/v10/finance/quoteSummary": "https://query2.finance.yahoo.com",
+}
+
+
+def _endpoint(path: str) -> str:
+    return next((p for p in _REAL_HOSTS if path.startswith(p)), path)
+
+
+def _fixture_name(path: str, params: dict) -> str:
+    params = {k: v for k, v in params.items() if k != "crumb"}
+    raw = json.dumps([path, sorted(params.items())])
+    return hashlib.sha1(raw.encode()).hexdigest()[:16] + ".json"
+
+
+def _seed(text: str) -> random.Random:
+    return random.Random(int(hashlib.md5(text.encode()).hexdigest()[:8], 16))
+
+
+def _synthetic_quote(symbol: str) -> dict:
+    rng = _seed(symbol)
+    price = round(rng.uniform(5, 900), 2)
+    return {
+        "symbol": symbol, "shortName": f"{symbol} Corp", "regularMarketPrice": price, "currency": "USD",
+        "regularMarketDayHigh": round(price * 1.02, 2), "regularMarketDayLow": round(price * 0.98, 2),
+        "regularMarketChangePercent": round(rng.uniform(-4, 4), 2), "marketCap": int(price * rng.uniform(1e8, 5e9)),
+        "exchange": "NMS", "marketState": "REGULAR",
+    }
+
+
+def _synthetic(path: str, params: dict) -> dict:
+    if path.startswith("/v7/finance/quote"):
+        symbols = [s for s in params.get("symbols", "").split(",") if s]
+        return {"quoteResponse": {"result": [_synthetic_quote(s.upper()) for s in symbols], "error": None}}
+    if path.startswith("/v1/finance/search"):
+        query = params.get("q", "")
+        count = int(params.get("newsCount", 5))
+        return {"news": [
+            {"title": f"{query}: market update #{i + 1}", "publisher": "Bench Wire",
+             "link": f"https://example.com/{hashlib.md5(f'{query}{i}'.encode()).hexdigest()[:10]}"}
+            for i in range(count)
+        ]}
+    if path.startswith("/v10/finance/quoteSummary"):
+        symbol = path.rsplit("/", 1)[-1].upper()
+        rng = _seed(symbol)
+        return {"quoteSummary": {"result": [{
+            "assetProfile": {"longBusinessSummary": f"{symbol} Corp designs, builds and sells products worldwide. " * 3},
+            "financialData": {"revenueGrowth": {"raw": round(rng.uniform(-0.1, 0.5), 3)}},
+        }], "error": None}}
+    return {}
+
+
+def create_app(fixtures: str = DEFAULT_FIXTURES, record: bool = False, latency_ms: float = 80,
+               jitter_ms: float = 40, strict: bool = False) -> FastAPI:
+    app = FastAPI()
+    app.state.calls = Counter()
+    app.state.sources = Counter()
+
+    async def delay():
+        await asyncio.sleep(max(0.0, latency_ms + random.uniform(-jitter_ms, jitter_ms)) / 1000)
+
+    @app.get("/")
+    async def cookie():
+        app.state.calls["cookie"] += 1
+        response = Response(status_code=404)
+        response.set_cookie("A3", "bench")
+        return response
+
+    @app.get("/v1/test/getcrumb")
+    async def crumb():
+        app.state.calls["crumb"] += 1
+        return Response(content="benchcrumb", media_type="text/plain")
+
+    @app.get("/_bench/stats")
+    async def stats():
+        return {"calls": dict(app.state.calls), "sources": dict(app.state.sources)}
+
+    @app.get("/{path:path}")
+    async def replay(path: str, request: Request):
+        path = "/" + path
+        params = dict(request.query_params)
+        endpoint = _endpoint(path)
+        app.state.calls[endpoint] += 1
+        fixture = os.path.join(fixtures, _fixture_name(path, params))
+
+        if record:
+            from app import yahoo
+            body = await yahoo.get_json(_REAL_HOSTS.get(endpoint, "https://query1.finance.yahoo.com") + path,
+                                        {k: v for k, v in params.items() if k != "crumb"},
+                                        crumb=endpoint != "/v1/finance/search")
+            os.makedirs(fixtures, exist_ok=True)
+            with open(fixture, "w") as f:
+                json.dump({"path": path, "params": params, "body": body}, f)
+            app.state.sources["recorded"] += 1
+            return body
+
+        await delay()
+        if os.path.exists(fixture):
+            app.state.sources["fixture"] += 1
+            with open(fixture) as f:
+                return json.load(f)["body"]
+        if strict:
+            app.state.sources["missing"] += 1
+            return Response(status_code=404)
+        app.state.sources["synthetic"] += 1
+        return _synthetic(path, params)
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+    parser = argparse.ArgumentParser(description="Yahoo Finance replay server")
+    parser.add_argument("--port", type=int, default=8102)
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES)
+    parser.add_argument("--record", action="store_true", help="forward to Yahoo and save responses")
+    parser.add_argument("--strict", action="store_true", help="404 instead of synthesizing unrecorded responses")
+    parser.add_argument("--latency-ms", type=float, default=80)
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.fixtures, args.record, args.latency_ms, strict=args.strict), port=args.port, log_level="warning")
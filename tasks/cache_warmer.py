@@ -0,0 +1,87 @@
+import os
+import time
+from tasks.celery import celery_app
+from app import popularity
+from app.cache import warm, warm_popular
+from app.quotes import warm_quotes
+from app.news import warm_news, mentioned_tickers
+from app.reminders import reminders_due_between, get_reminders
+from app.config import logger
+import app.tools  # noqa: F401 - registers the redis_cache'd tools with the warmer
+
+CACHE_WARM_INTERVAL_SECONDS = float(os.getenv("CACHE_WARM_INTERVAL_SECONDS", "30"))
+# Entries expiring within this window are refreshed; must exceed the interval so none lapse between ticks
+CACHE_WARM_AHEAD_SECONDS = float(os.getenv("CACHE_WARM_AHEAD_SECONDS", str(CACHE_WARM_INTERVAL_SECONDS + 10)))
+# Most used entries kept warm per kind (quotes, and each cached tool)
+CACHE_WARM_TOP_N = int(os.getenv("CACHE_WARM_TOP_N", "100"))
+# Reminders due within this window have their tickers and sectors prefetched
+REMINDER_PREFETCH_SECONDS = float(os.getenv("REMINDER_PREFETCH_SECONDS", "120"))
+
+# Tickers whose news is kept warm (news searches are fewer and slower to change than quotes)
+NEWS_WARM_TOP_N = int(os.getenv("NEWS_WARM_TOP_N", "20"))
+
+# Topic keywords -> yfinance sector keys used by get_sector_analysis
+_SECTOR_KEYWORDS = {
+    "tech": "technology", "technology": "technology", "software": "technology", "semiconductor": "technology",
+    "health": "healthcare", "healthcare": "healthcare", "pharma": "healthcare", "biotech": "healthcare",
+    "energy": "energy", "oil": "energy",
+    "bank": "financial-services", "banks": "financial-services", "financial": "financial-services", "finance": "financial-services",
+    "real estate": "real-estate", "reit": "real-estate", "reits": "real-estate",
+    "utilities": "utilities", "industrial": "industrials", "industrials": "industrials",
+    "materials": "basic-materials", "mining": "basic-materials",
+    "consumer": "consumer-cyclical", "retail": "consumer-cyclical",
+    "communication": "communication-services", "telecom": "communication-services", "media": "communication-services",
+}
+
+
+def topic_symbols(topic: str) -> list[str]:
+    """Tickers written in a reminder topic, e.g. 'NVDA and $AAPL earnings' -> ['NVDA', 'AAPL']."""
+    return mentioned_tickers(topic)
+
+
+def topic_sectors(topic: str) -> set[str]:
+    text = f" {(topic or '').lower()} "
+    return {sector for word, sector in _SECTOR_KEYWORDS.items() if f" {word} " in text}
+
+
+def prefetch_for_reminders(now: float = None) -> tuple[int, int]:
+    """Warms quotes, news and sector reports referenced by reminders that are about to fire."""
+    now = time.time() if now is None else now
+    tasks = get_reminders(reminders_due_between(now, now + REMINDER_PREFETCH_SECONDS))
+    symbols, sectors = [], set()
+    for task in tasks.values():
+        symbols.extend(topic_symbols(task.get("topic")))
+        sectors |= topic_sectors(task.get("topic"))
+
+    quotes = warm_quotes(symbols, ahead_seconds=REMINDER_PREFETCH_SECONDS)
+    quotes += warm_news(symbols, ahead_seconds=REMINDER_PREFETCH_SECONDS)
+    warmed_sectors = 0
+    for sector in sectors:
+        try:
+            warmed_sectors += warm("get_sector_analysis", kwargs={"sector_name": sector},
+                                   ahead_seconds=REMINDER_PREFETCH_SECONDS)
+        except Exception as e:
+            logger.error(f"Sector prefetch failed for {sector}: {e}")
+    return quotes, warmed_sectors
+
+
+@celery_app.task
+def warm_market_cache():
+    """
+    Keeps market data warm so user-facing tool calls hit the cache:
+    refreshes the most used quotes, tool results and tickers' news shortly before they expire,
+    and prefetches data for reminders due soon.
+    """
+    started = time.monotonic()
+    quotes = warm_quotes(popularity.top("quote", CACHE_WARM_TOP_N), ahead_seconds=CACHE_WARM_AHEAD_SECONDS)
+    tools = warm_popular(CACHE_WARM_TOP_N, CACHE_WARM_AHEAD_SECONDS)
+    news = warm_news(popularity.top("news", NEWS_WARM_TOP_N), ahead_seconds=CACHE_WARM_AHEAD_SECONDS)
+    reminder_quotes, reminder_sectors = prefetch_for_reminders()
+
+    total = quotes + tools + news + reminder_quotes + reminder_sectors
+    if total:
+        logger.info(
+            f"Cache warmer refreshed {quotes} popular quotes, {tools} tool results, {news} news searches and "
+            f"{reminder_quotes + reminder_sectors} reminder prefetches in {time.monotonic() - started:.1f}s"
+        )
+    return f"Warmed {total} entries."
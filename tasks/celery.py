@@ -1,5 +1,7 @@
+import asyncio
 import os
 from celery import Celery
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown, task_prerun
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -10,7 +12,7 @@ celery_app = Celery(
     "tasks",
     broker=REDIS_URL,
     backend=REDIS_URL,
-    include=["tasks.scheduled_tasks"]
+    include=["tasks.scheduled_tasks", "tasks.cache_warmer"]
 )
 
 celery_app.conf.update(
@@ -27,4 +29,77 @@ celery_app.conf.beat_schedule = {
         "task": "tasks.scheduled_tasks.process_dynamic_subscriptions",
         "schedule": 60.0,  # Run every minute to check for due reminders
     },
+    "warm-market-cache": {
+        "task": "tasks.cache_warmer.warm_market_cache",
+        "schedule": float(os.getenv("CACHE_WARM_INTERVAL_SECONDS", "30")),
+        # A backlogged run is pointless once the next one is due
+        "options": {"expires": float(os.getenv("CACHE_WARM_INTERVAL_SECONDS", "30"))},
+    },
 }
+
+# Tasks continue the trace of whoever published them (the beat tick, or a message turn)
+from app.tracing import install_celery_hooks
+install_celery_hooks()
+
+# --- Worker process event loop ---
+# One long-lived loop per worker process, so async clients (WhatsApp, Redis)
+# keep their pooled connections between tasks instead of being rebuilt by asyncio.run().
+
+_worker_loop: asyncio.AbstractEventLoop | None = None
+
+
+def get_worker_loop() -> asyncio.AbstractEventLoop:
+    global _worker_loop
+    if _worker_loop is None or _worker_loop.is_closed():
+        _worker_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_worker_loop)
+    return _worker_loop
+
+
+def run_async(coro):
+    """Runs a coroutine on the worker process loop and returns its result."""
+    return get_worker_loop().run_until_complete(coro)
+
+
+@worker_init.connect
+def _init_worker(**kwargs):
+    # Prometheus exporter for this worker (pool processes report via PROMETHEUS_MULTIPROC_DIR)
+    port = os.getenv("CELERY_METRICS_PORT")
+    if port:
+        from app.metrics import start_exporter
+        start_exporter(int(port))
+
+
+@worker_process_init.connect
+def _init_worker_process(**kwargs):
+    from app import startup
+    from app.agent import get_runner
+    from app.whatsapp import open_client
+    startup.mark("imports")
+    # One agent and runner per pool process, built before the first task instead of by it
+    get_runner()
+    startup.mark("agent")
+    run_async(open_client())
+    startup.ready("worker")
+
+
+@task_prerun.connect
+def _run_as_scheduled(**kwargs):
+    # Everything the workers run is background work: it yields rate-limit budget to live chats
+    from app import ratelimit
+    ratelimit.set_priority(ratelimit.SCHEDULED)
+
+
+@worker_process_shutdown.connect
+def _shutdown_worker_process(**kwargs):
+    global _worker_loop
+    from app.metrics import process_exited
+    process_exited(os.getpid())
+    if _worker_loop is None or _worker_loop.is_closed():
+        return
+    from app.whatsapp import close_client
+    from app.yahoo import close_session
+    run_async(close_client())
+    run_async(close_session())
+    _worker_loop.close()
+    _worker_loop = None
@@ -1,133 +1,319 @@
-import asyncio
 import os
-import json
 import time
-from tasks.celery import celery_app
-from app.agent import create_agent
+from tasks.celery import celery_app, run_async
+from app.agent import get_runner
 from app.whatsapp import send_whatsapp_message
-from google.adk.runners import Runner
-from google.adk.sessions import InMemorySessionService
-from google import genai
-from google.genai import types
+from app.reminders import (
+    claim_due_reminders, complete_reminder, extend_lease, extend_leases, next_run_after, normalize_topic,
+    get_reminder, get_reminders, migrate_legacy_reminders, REMINDER_LEASE_SECONDS
+)
+from app.store import redis_client
+from app.config import logger
+from app import metrics, tracing, ratelimit
+
+# Upper bound on reminders handed out by a single beat tick
+MAX_CLAIMS_PER_TICK = int(os.getenv("MAX_CLAIMS_PER_TICK", "10000"))
+REMINDER_MAX_RETRIES = int(os.getenv("REMINDER_MAX_RETRIES", "3"))
+# Queued deliveries not started within this are dropped: their lease is about to run
+# out and the next tick claims the reminders again, so a late start would send twice
+DISPATCH_EXPIRES_SECONDS = REMINDER_LEASE_SECONDS * 2 // 3
+
+# Non-personalized reminders due in the same bucket share one generated update
+DIGEST_BUCKET_SECONDS = int(os.getenv("DIGEST_BUCKET_SECONDS", "900"))
+# Recipients per delivery subtask
+DIGEST_FANOUT_CHUNK = int(os.getenv("DIGEST_FANOUT_CHUNK", "100"))
+# Leases are restarted this often during a fan-out; one rate-limited send can wait a minute,
+# so a chunk of serial sends may outlast a single lease
+DIGEST_LEASE_REFRESH_SECONDS = REMINDER_LEASE_SECONDS // 3
+DIGEST_LOCK_SECONDS = 300
+DIGEST_USER_ID = "scheduler"
+
+@tracing.traced("agent.run")
+async def run_agent_turn(user_id: str, prompt: str, session_id: str = None, source: str = "reminder") -> str:
+    """Runs one agent turn (in the user's own session by default) and returns the reply text."""
+    from google.genai import types
+    from app.sessions import ensure_session
+    # Raises RateLimited straight away when interactive traffic needs the budget
+    await ratelimit.start_turn()
+    session_id = session_id or user_id
+    # Sessions are shared with the API process through Redis, so reminders land in the user's conversation
+    runner = get_runner()
+    await ensure_session(runner.session_service, user_id=user_id, session_id=session_id)
+    message = types.Content(role="user", parts=[types.Part(text=prompt)])
+    text = ""
+    usage = metrics.TurnUsage(source)
+    started = time.monotonic()
+    async for event in runner.run_async(user_id=user_id, session_id=session_id, new_message=message):
+        usage.add(event)
+        if event.content and event.content.parts:
+            for part in event.content.parts:
+                if part.text and not part.thought:
+                    text += part.text
+    metrics.AGENT_RUN_SECONDS.labels(source).observe(time.monotonic() - started)
+    usage.record()
+    tracing.annotate(source=source, prompt_tokens=usage.prompt, output_tokens=usage.output,
+                     context_tokens=usage.last_prompt)
+    return text
+
+
+def reminder_prompt(topic: str) -> str:
+    return f"Provide a brief investment update for: {topic}"
+
+
+def finish_reminder(reminder_id: str, task: dict, planned_time: float) -> str:
+    """Reschedules a delivered reminder on its original grid, or removes it when done."""
+    interval = task.get("interval_seconds", 3600)
+    end_time = task.get("end_time", -1)
+
+    # Reschedule if not one-time and (forever OR time remaining)
+    # We use a buffer of half the interval to ensure we don't skip the last requested update.
+    # Times are measured from the planned run, not from when the worker got to it, so they don't drift.
+    if not task.get("is_one_time", False) and (end_time == -1 or planned_time + (interval / 2) < end_time):
+        next_run = next_run_after(planned_time, interval)
+        complete_reminder(reminder_id, next_run)
+        return f"rescheduled for {next_run}"
+
+    complete_reminder(reminder_id, None, str(task.get("phone_number")))
+    return f"task completed/expired (End: {end_time})"
 
-from app.tools import redis_client
 
 @celery_app.task
 def process_dynamic_subscriptions():
     """
-    Check Redis Sorted Set for due tasks and execute them.
+    Claim due reminders from the Redis Sorted Set and fan them out to workers.
+    Personalized reminders get their own agent run; the rest are grouped by
+    normalized topic and time bucket so each group's update is generated once.
     """
+    migrate_legacy_reminders()
+
     current_time = time.time()
-    # Get all tasks due up to now
-    due_tasks = redis_client.zrangebyscore("scheduled_tasks", 0, current_time)
-    
-    print(f"DEBUG: Checking for due tasks at {current_time}. Found: {len(due_tasks)}")
-    
-    if not due_tasks:
+    dispatched = 0
+    groups: dict[tuple[str, int], list] = {}
+
+    while dispatched < MAX_CLAIMS_PER_TICK:
+        claimed = claim_due_reminders(current_time)
+        if not claimed:
+            break
+        tasks = get_reminders([reminder_id for reminder_id, _ in claimed])
+        for reminder_id, planned_time in claimed:
+            task = tasks.get(reminder_id)
+            if task is None:
+                # Cancelled between scheduling and claim
+                complete_reminder(reminder_id, None)
+            elif task.get("personalized"):
+                metrics.REMINDERS_DISPATCHED.labels("personalized").inc()
+                run_scheduled_reminder.apply_async((reminder_id, planned_time), expires=DISPATCH_EXPIRES_SECONDS)
+            else:
+                metrics.REMINDERS_DISPATCHED.labels("digest").inc()
+                bucket = int(planned_time // DIGEST_BUCKET_SECONDS)
+                groups.setdefault((normalize_topic(task.get("topic")), bucket), []).append([reminder_id, planned_time])
+        dispatched += len(claimed)
+
+    for (topic_key, bucket), recipients in groups.items():
+        for i in range(0, len(recipients), DIGEST_FANOUT_CHUNK):
+            deliver_topic_digest.apply_async((topic_key, bucket, recipients[i:i + DIGEST_FANOUT_CHUNK]),
+                                             expires=DISPATCH_EXPIRES_SECONDS)
+
+    tracing.annotate(dispatched=dispatched, digest_groups=len(groups))
+    if not dispatched:
         return f"No due tasks found at {current_time}."
+    logger.info(f"Dispatched {dispatched} due reminders ({len(groups)} shared topics)")
+    return f"Dispatched {dispatched} tasks."
+
+
+@celery_app.task(bind=True, acks_late=True, max_retries=REMINDER_MAX_RETRIES)
+def run_scheduled_reminder(self, reminder_id: str, planned_time: float, summary_text: str = None):
+    """
+    Deliver one claimed, personalized reminder in the user's own session, then reschedule it.
+    The reminder stays leased (invisible to other ticks) while it runs or retries. Once the
+    update is generated it is carried by any retry or deferral, so only the send is repeated.
+    """
+    tracing.annotate(reminder_id=reminder_id, lag_seconds=round(time.time() - planned_time, 1))
+    task = get_reminder(reminder_id)
+    if task is None:
+        complete_reminder(reminder_id, None)
+        return f"Reminder {reminder_id} was cancelled"
+    phone_number = str(task.get("phone_number"))
+    topic = task.get("topic")
+    label = f"{topic} for {phone_number}"
+    # The lease counted from the claim; restart it now that the work has begun
+    extend_lease(reminder_id)
 
-    agent = create_agent()
-    session_service = InMemorySessionService()
-    runner = Runner(app_name="whatsapp-investment-bot", agent=agent, session_service=session_service)
-    results = []
-    
-    # Process tasks in threadpool to avoid blocking if many
-    for task_json in due_tasks:
-        # Remove the task from Redis immediately to prevent duplicate processing
-        # We will add it back with new time if it's recurring
-        redis_client.zrem("scheduled_tasks", task_json)
-        
+    if summary_text is None:
         try:
-            task = json.loads(task_json)
+            summary_text = run_async(run_agent_turn(phone_number, reminder_prompt(topic)))
+            if not summary_text:
+                raise ValueError("no summary text generated")
+        except ratelimit.RateLimited as e:
+            return _defer_reminder(reminder_id, planned_time, None, label, e)
+        except Exception as e:
+            return _retry_reminder(self, reminder_id, planned_time, None, label, e)
+        extend_lease(reminder_id)
+
+    try:
+        run_async(send_whatsapp_message(phone_number, summary_text))
+    except ratelimit.RateLimited as e:
+        return _defer_reminder(reminder_id, planned_time, summary_text, label, e)
+    except Exception as e:
+        return _retry_reminder(self, reminder_id, planned_time, summary_text, label, e)
+    metrics.SCHEDULER_LAG_SECONDS.labels("personalized").observe(time.time() - planned_time)
+    return f"Sent {label}, " + finish_reminder(reminder_id, task, planned_time)
+
+
+def _defer_reminder(reminder_id: str, planned_time: float, summary_text: str | None, label: str,
+                    error: ratelimit.RateLimited) -> str:
+    """Not a failure: comes back once live chats leave room, without spending a retry."""
+    delay = error.defer_seconds()
+    extend_lease(reminder_id, REMINDER_LEASE_SECONDS + int(delay))
+    run_scheduled_reminder.apply_async((reminder_id, planned_time, summary_text), countdown=delay,
+                                       expires=delay + DISPATCH_EXPIRES_SECONDS)
+    metrics.REMINDERS_DEFERRED.labels("personalized").inc()
+    return f"Deferred {label} by {delay:.0f}s ({error.bucket} budget)"
+
+
+def _retry_reminder(task, reminder_id: str, planned_time: float, summary_text: str | None, label: str,
+                    error: Exception) -> str:
+    """
+    Retries with backoff. Past the retry limit the reminder is left leased, so the next
+    tick claims it again once the lease runs out; it is not reported as sent.
+    """
+    if task.request.retries < task.max_retries:
+        logger.warning(f"Reminder {label} failed, retrying: {error}")
+        countdown = 30 * (task.request.retries + 1)
+        extend_lease(reminder_id, REMINDER_LEASE_SECONDS + countdown)
+        raise task.retry(args=(reminder_id, planned_time, summary_text), exc=error, countdown=countdown,
+                         expires=countdown + DISPATCH_EXPIRES_SECONDS)
+    logger.error(f"Reminder {label} failed after retries: {error}")
+    return f"Failed {label}"
+
+
+def get_topic_digest(topic_key: str, bucket: int, wait_seconds: float = 120) -> str:
+    """
+    Returns the shared update for a topic and time bucket, generating it at most once.
+    The first caller takes a Redis lock and runs the agent; concurrent callers wait for its result.
+    """
+    cache_key = f"digest:{topic_key}:{bucket}"
+    lock_key = f"{cache_key}:lock"
+
+    deadline = time.monotonic() + wait_seconds
+    while True:
+        cached = redis_client.get(cache_key)
+        if cached:
+            return cached.decode("utf-8")
+
+        if redis_client.set(lock_key, 1, nx=True, ex=DIGEST_LOCK_SECONDS):
+            try:
+                # A fresh session per bucket: shared digests must not carry one user's history
+                session_id = f"digest:{topic_key}:{bucket}"
+                text = run_async(run_agent_turn(DIGEST_USER_ID, reminder_prompt(topic_key), session_id=session_id, source="digest"))
+                if text:
+                    redis_client.setex(cache_key, DIGEST_BUCKET_SECONDS * 2, text)
+                return text
+            finally:
+                redis_client.delete(lock_key)
+
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Timed out waiting for digest {cache_key}")
+        time.sleep(0.5)
+
+
+@celery_app.task(bind=True, acks_late=True, max_retries=REMINDER_MAX_RETRIES)
+def deliver_topic_digest(self, topic_key: str, bucket: int, recipients: list):
+    """
+    Deliver one shared update to a chunk of reminders with the same topic and bucket.
+    Recipients stay leased until they are sent and rescheduled.
+    """
+    tracing.annotate(topic=topic_key, recipients=len(recipients))
+    reminder_ids = [reminder_id for reminder_id, _ in recipients]
+    # Waiting on the digest and generating it can take a while: restart the leases first
+    extend_leases(reminder_ids)
+    try:
+        summary_text = get_topic_digest(topic_key, bucket)
+        if not summary_text:
+            raise ValueError("no summary text generated")
+        extend_leases(reminder_ids)
+    except ratelimit.RateLimited as e:
+        return _defer_digest(topic_key, bucket, recipients, e)
+    except Exception as e:
+        return _retry_digest(self, topic_key, bucket, recipients, e)
+
+    # Reminders cancelled since the claim drop out here
+    tasks = get_reminders(reminder_ids)
+
+    async def send_all():
+        delivered, failed, limited = [], [], None
+        refreshed = time.monotonic()
+        for reminder_id, planned_time in recipients:
+            task = tasks.get(reminder_id)
+            if task is None:
+                continue
+            if time.monotonic() - refreshed > DIGEST_LEASE_REFRESH_SECONDS:
+                # Sent recipients stay leased too, until they are rescheduled below
+                extend_leases(reminder_ids)
+                refreshed = time.monotonic()
+            if limited:
+                # The Graph budget is spent: keep the rest for the deferred run
+                failed.append([reminder_id, planned_time])
+                continue
             phone_number = str(task.get("phone_number"))
-            topic = task.get("topic")
-            interval = task.get("interval_seconds", 3600)
-            is_one_time = task.get("is_one_time", False)
-            end_time = task.get("end_time", -1)
-            
-            # Create session if it doesn't exist (mirroring working app/main.py logic)
-            async def init_session():
-                try:
-                    await session_service.create_session(
-                        app_name="whatsapp-investment-bot",
-                        user_id=phone_number,
-                        session_id=phone_number
-                    )
-                    print(f"DEBUG: Created new session for {phone_number} in worker")
-                except Exception as e:
-                    print(f"DEBUG: Session already exists or note: {e}")
-            
-            asyncio.run(init_session())
-            
-            # Execute Agent
-            message = types.Content(
-                role="user",
-                parts=[types.Part(text=f"Provide a brief investment update for: {topic}")]
-            )
-            
-            # Run agent (blocking call)
-            print(f"DEBUG: Worker calling runner.run() for {phone_number} on {topic}")
             try:
-                result = runner.run(user_id=phone_number, session_id=phone_number, new_message=message)
-                print(f"DEBUG: runner.run() generator returned, starting event consumption")
-                summary_text = ""
-                event_count = 0
-                for event in result:
-                    event_count += 1
-                    if hasattr(event, 'content') and event.content and hasattr(event.content, 'parts'):
-                        for part in event.content.parts:
-                            if hasattr(part, 'text') and part.text:
-                                summary_text += part.text
-                    elif hasattr(event, 'text') and event.text:
-                        summary_text += event.text
-                
-                print(f"DEBUG: Processed {event_count} events for {topic}, extracted {len(summary_text)} chars")
-                
-                if summary_text:
-                    print(f"DEBUG: Sending summary to {phone_number}")
-                    asyncio.run(send_whatsapp_message(phone_number, summary_text))
-                    results.append(f"Sent {topic} to {phone_number}")
-                else:
-                    print(f"DEBUG: No summary text generated for {topic}")
+                await send_whatsapp_message(phone_number, summary_text)
+                metrics.SCHEDULER_LAG_SECONDS.labels("digest").observe(time.time() - planned_time)
+                delivered.append([reminder_id, planned_time])
+            except ratelimit.RateLimited as e:
+                limited = e
+                failed.append([reminder_id, planned_time])
             except Exception as e:
-                print(f"ERROR: Worker agent execution failed for {topic}: {str(e)}")
-                import traceback
-                traceback.print_exc()
-                results.append(f"Error: {str(e)}")
-
-            # Reschedule if not one-time and (forever OR time remaining)
-            # We use a buffer of half the interval to ensure we don't skip the last requested update
-            # even if there's slight processing drift.
-            if not is_one_time and (end_time == -1 or current_time + (interval / 2) < end_time):
-                next_run = current_time + interval
-                redis_client.zadd("scheduled_tasks", {task_json: next_run})
-                results.append(f"Rescheduled for {next_run}")
-            else:
-                 results.append(f"Task completed/expired (Current: {current_time}, End: {end_time})")
+                logger.error(f"Failed to deliver {topic_key} to {phone_number}: {e}")
+                failed.append([reminder_id, planned_time])
+        return delivered, failed, limited
+
+    delivered, failed, limited = run_async(send_all())
+    # Only reminders that reached their recipient move on; the rest stay leased
+    for reminder_id, _ in recipients:
+        if reminder_id not in tasks:
+            complete_reminder(reminder_id, None)
+    for reminder_id, planned_time in delivered:
+        finish_reminder(reminder_id, tasks[reminder_id], planned_time)
+
+    result = f"Sent {topic_key} to {len(delivered)}/{len(recipients)} recipients"
+    if limited:
+        return f"{result}; " + _defer_digest(topic_key, bucket, failed, limited)
+    if failed:
+        return f"{result}; " + _retry_digest(self, topic_key, bucket, failed, RuntimeError(f"{len(failed)} sends failed"))
+    return result
+
+
+def _defer_digest(topic_key: str, bucket: int, recipients: list, error: ratelimit.RateLimited) -> str:
+    """Re-queues recipients once the budget that ran out has refilled, without spending a retry."""
+    delay = error.defer_seconds()
+    extend_leases([reminder_id for reminder_id, _ in recipients], REMINDER_LEASE_SECONDS + int(delay))
+    deliver_topic_digest.apply_async((topic_key, bucket, recipients), countdown=delay,
+                                     expires=delay + DISPATCH_EXPIRES_SECONDS)
+    metrics.REMINDERS_DEFERRED.labels("digest").inc(len(recipients))
+    return f"Deferred {topic_key} for {len(recipients)} recipients by {delay:.0f}s ({error.bucket} budget)"
+
+
+def _retry_digest(task, topic_key: str, bucket: int, recipients: list, error: Exception) -> str:
+    """
+    Retries recipients with backoff. Past the retry limit they are left leased, so the
+    next tick claims them again once the lease runs out; nothing is marked delivered.
+    """
+    reminder_ids = [reminder_id for reminder_id, _ in recipients]
+    if task.request.retries < task.max_retries:
+        logger.warning(f"Digest {topic_key} failed for {len(recipients)} recipients, retrying: {error}")
+        countdown = 30 * (task.request.retries + 1)
+        extend_leases(reminder_ids, REMINDER_LEASE_SECONDS + countdown)
+        raise task.retry(args=(topic_key, bucket, recipients), exc=error, countdown=countdown,
+                         expires=countdown + DISPATCH_EXPIRES_SECONDS)
+    logger.error(f"Digest {topic_key} failed for {len(recipients)} recipients after retries: {error}")
+    return f"Failed {topic_key} for {len(recipients)} recipients"
 
-        except Exception as e:
-             results.append(f"Failed to process task: {e}")
-             
-    return f"Processed {len(due_tasks)} tasks. Details: {results}"
 
 @celery_app.task
 def send_market_summary(to_number: str):
     """Fallback legacy task."""
-    agent = create_agent()
-    session_service = InMemorySessionService()
-    runner = Runner(app_name="whatsapp-investment-bot", agent=agent, session_service=session_service)
-    message = types.Content(
-        role="user",
-        parts=[types.Part(text="Provide a brief summary of today's investment market highlights.")]
-    )
-    result = runner.run(user_id=to_number, session_id=to_number, new_message=message)
-    
-    # Extract text from result
-    summary_text = ""
-    for event in result:
-        if hasattr(event, 'text') and event.text:
-            summary_text += event.text
-    
+    summary_text = run_async(run_agent_turn(to_number, "Provide a brief summary of today's investment market highlights."))
     if summary_text:
-        asyncio.run(send_whatsapp_message(to_number, summary_text))
+        run_async(send_whatsapp_message(to_number, summary_text))
     return f"Legacy summary sent to {to_number}"
@@ -0,0 +1,49 @@
+import pytest
+from app import cache, tools
+
+
+@pytest.fixture
+def entries(monkeypatch):
+    """Cache entries written by warm(), with Redis and the upstream call stubbed out."""
+    stored = {}
+    monkeypatch.setattr(cache, "entry_expiry", lambda key: None)
+    monkeypatch.setattr(cache, "try_lock", lambda key: "token")
+    monkeypatch.setattr(cache, "release_lock", lambda key, token: None)
+    monkeypatch.setattr(cache, "_store_result", lambda key, result, *args: stored.__setitem__(key, result))
+    return stored
+
+
+@pytest.fixture
+def read_key(monkeypatch):
+    """The key a tool call reads, captured instead of going to Redis."""
+    seen = []
+    monkeypatch.setattr(cache, "cached_call", lambda key, compute, *args, **kwargs: seen.append(key) or "cached")
+    return seen
+
+
+def _stub_tool(monkeypatch, name, func):
+    _, ttl, stale, market = cache._warmable[name]
+    monkeypatch.setitem(cache._warmable, name, (func, ttl, stale, market))
+
+
+def test_warmed_sector_is_read_by_keyword_call(monkeypatch, entries, read_key):
+    def get_sector_analysis(sector_name: str) -> str:
+        return f"report for {sector_name}"
+    _stub_tool(monkeypatch, "get_sector_analysis", get_sector_analysis)
+
+    assert cache.warm("get_sector_analysis", ("technology",))
+    # ADK calls tools with keyword arguments
+    tools.get_sector_analysis(sector_name="technology")
+    assert read_key[0] in entries
+
+
+def test_default_arguments_share_a_key(monkeypatch, entries, read_key):
+    def screen_market_by_valuation(criteria: str = "undervalued_growth") -> str:
+        return f"screen {criteria}"
+    _stub_tool(monkeypatch, "screen_market_by_valuation", screen_market_by_valuation)
+
+    assert cache.warm("screen_market_by_valuation")
+    tools.screen_market_by_valuation()
+    tools.screen_market_by_valuation(criteria="undervalued_growth")
+    tools.screen_market_by_valuation("undervalued_growth")
+    assert len(set(read_key)) == 1 and read_key[0] in entries
@@ -0,0 +1,56 @@
+import asyncio
+import time
+import pytest
+from app import mailbox
+
+
+class _NoLock:
+    def __init__(self, user_id):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+@pytest.fixture(autouse=True)
+def no_redis_lock(monkeypatch):
+    monkeypatch.setattr(mailbox, "UserLock", _NoLock)
+
+
+def test_message_to_idle_mailbox_starts_at_once():
+    started = []
+
+    async def handler(user_id, texts):
+        started.append(time.monotonic())
+
+    async def run():
+        box = mailbox.UserMailbox(handler, debounce_seconds=5)
+        submitted = time.monotonic()
+        box.submit("15550001111", "price of AAPL")
+        await box.shutdown()
+        return started[0] - submitted
+
+    assert asyncio.run(run()) < 1
+
+
+def test_messages_during_a_turn_are_merged():
+    batches = []
+
+    async def handler(user_id, texts):
+        batches.append(texts)
+        await asyncio.sleep(0.1)
+
+    async def run():
+        box = mailbox.UserMailbox(handler, debounce_seconds=0.05)
+        box.submit("15550001111", "hi")
+        await asyncio.sleep(0.02)
+        box.submit("15550001111", "price of AAPL")
+        box.submit("15550001111", "and MSFT")
+        await box.shutdown()
+        return box.coalesced
+
+    assert asyncio.run(run()) == 1
+    assert batches == [["hi"], ["price of AAPL", "and MSFT"]]
@@ -0,0 +1,20 @@
+import datetime as dt
+from app import market_hours
+
+# Wednesday 14 October 2026: the US regular session opens at 13:30 UTC
+_OPEN = dt.datetime(2026, 10, 14, 13, 30, tzinfo=dt.timezone.utc)
+
+
+def test_pre_market_entry_expires_at_the_open():
+    now = _OPEN - dt.timedelta(seconds=10)
+    assert market_hours.market_state("US", now) == market_hours.PRE
+    assert market_hours.adaptive_ttl(60, "AAPL", now=now) == 10 + market_hours.MARKET_OPEN_GRACE_SECONDS
+
+
+def test_early_pre_market_entry_uses_extended_hours_ttl():
+    now = _OPEN - dt.timedelta(hours=2)
+    assert market_hours.adaptive_ttl(60, "AAPL", now=now) == int(60 * market_hours.EXTENDED_HOURS_TTL_FACTOR)
+
+
+def test_regular_session_uses_base_ttl():
+    assert market_hours.adaptive_ttl(60, "AAPL", now=_OPEN + dt.timedelta(hours=1)) == 60
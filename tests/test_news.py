@@ -0,0 +1,16 @@
+import pytest
+from app.news import normalize_query
+
+
+@pytest.mark.parametrize("query", ["Nvidia news", "nvda", "latest $NVDA headlines"])
+def test_ways_of_naming_a_company_share_a_query(query):
+    assert normalize_query(query) == (["NVDA"], [])
+
+
+def test_everyday_word_company_name_is_not_a_ticker():
+    assert normalize_query("news about visa requirements for investors") == ([], ["investors", "requirements", "visa"])
+
+
+@pytest.mark.parametrize("query", ["visa stock news", "VISA news", "$V news", "visa shares"])
+def test_everyday_word_company_name_with_a_signal(query):
+    assert normalize_query(query) == (["V"], [])
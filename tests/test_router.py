@@ -0,0 +1,31 @@
+import pytest
+from app.router import FastPathRouter
+
+
+@pytest.fixture
+def router():
+    return FastPathRouter()
+
+
+@pytest.mark.parametrize("text", [
+    "price of gold",
+    "what is the price of oil?",
+    "price of tech",
+    "gold price",
+    "oil price?",
+    "what's the price of tech stocks",
+])
+def test_ordinary_words_are_not_tickers(router, text):
+    assert router.match(text) is None
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("price of Nvidia", ("quote", ("NVDA",))),
+    ("what is the price of $GOLD?", ("quote", ("GOLD",))),
+    ("price of SMCI", ("quote", ("SMCI",))),
+    ("AAPL price", ("quote", ("AAPL",))),
+    ("$NVDA", ("quote", ("NVDA",))),
+    ("AAPL, MSFT and nvidia", ("multi_quote", ("AAPL MSFT NVDA",))),
+])
+def test_known_tickers_and_cashtags(router, text, expected):
+    assert router.match(text) == expected
@@ -0,0 +1,67 @@
+import asyncio
+import httpx
+import pytest
+from app import whatsapp, ratelimit
+
+
+@pytest.fixture
+def graph(monkeypatch):
+    """Points the Graph client at a stub that answers with `graph.status`, and skips the rate limiter."""
+    class Graph:
+        status = 200
+        headers = {}
+        posted = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        Graph.posted.append(request)
+        return httpx.Response(Graph.status, headers=Graph.headers, json={"messages": [{"id": "wamid.1"}]})
+
+    async def acquire(*args, **kwargs):
+        return 0.0
+
+    monkeypatch.setattr(ratelimit, "acquire", acquire)
+    monkeypatch.setattr(whatsapp, "_build_client",
+                        lambda: httpx.AsyncClient(base_url="https://graph.test", transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(whatsapp, "_client", None)
+    return Graph
+
+
+def test_server_error_raises(graph):
+    graph.status = 503
+    with pytest.raises(whatsapp.WhatsAppSendError) as raised:
+        asyncio.run(whatsapp.send_whatsapp_message("15550001111", "hello"))
+    assert raised.value.status == 503
+
+
+def test_throttled_send_is_rate_limited_for_retry_after(graph):
+    graph.status = 429
+    graph.headers = {"Retry-After": "12"}
+    with pytest.raises(ratelimit.RateLimited) as raised:
+        asyncio.run(whatsapp.send_whatsapp_message("15550001111", "hello"))
+    assert (raised.value.bucket, raised.value.retry_after) == ("graph", 12.0)
+
+
+def test_client_error_is_only_logged(graph):
+    graph.status = 400
+    assert asyncio.run(whatsapp.send_whatsapp_message("15550001111", "hello")) == {"messages": [{"id": "wamid.1"}]}
+
+
+def test_stream_keeps_spaces_between_chunks_across_parts(monkeypatch):
+    sent = []
+
+    async def send(to_number, message):
+        sent.extend(whatsapp.split_message(message))
+
+    async def stream(chunks):
+        reply = whatsapp.ReplyStream("15550001111")
+        for chunk in chunks:
+            reply.feed(chunk)
+        await reply.close()
+
+    monkeypatch.setattr(whatsapp, "send_whatsapp_message", send)
+    words = [f"market{i}" for i in range(1500)]
+    # One paragraph well over the body limit, fed the way the runner streams it: a word at a time
+    asyncio.run(stream([f"{word} " for word in words]))
+    assert len(sent) > 1
+    assert all(len(part) <= whatsapp.WHATSAPP_MAX_BODY_CHARS for part in sent)
+    assert " ".join(sent) == " ".join(words)